@@ -0,0 +1,3 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
@@ -0,0 +1,75 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+#
+# Measure the cost of a flag submission as the number of flags on a challenge grows
+# Usage: python -m benchmarks.flags [--flags 10,1000,10000,100000] [--submissions 200]
+
+import time
+import random
+import argparse
+from core.objects.challenge import Challenge
+
+MESSAGE_LENGTH = 200
+
+
+def naive_validate(challenge, text):
+    """
+    Flag lookup as it was done before the matcher, a substring test for every flag
+    """
+    for flag in challenge.flags.keys():
+        if flag in text:
+            return flag
+    return None
+
+
+def make_challenge(flags):
+    challenge = Challenge(1, 'virtualbox', 'benchmark')
+    for i in range(flags):
+        challenge.create_flag(f'THO{{{i:08x}}}', i % 10, 10)
+    return challenge
+
+
+def make_messages(challenge, submissions):
+    """
+    Chat sized messages, a tenth of them containing a flag somewhere in the text
+    """
+    texts = list(challenge.flags.keys())
+    messages = []
+    for i in range(submissions):
+        filler = ''.join(random.choice('abcdefghijklmnopqrstuvwxyz THO{}') for _ in range(MESSAGE_LENGTH))
+        if i % 10 == 0:
+            position = random.randrange(MESSAGE_LENGTH)
+            filler = filler[:position] + random.choice(texts) + filler[position:]
+        messages.append(filler)
+    return messages
+
+
+def measure(function, messages):
+    start = time.perf_counter()
+    for message in messages:
+        function(message)
+    return (time.perf_counter() - start) / len(messages) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark flag submissions")
+    parser.add_argument('--flags', default='10,1000,10000,100000', help="Comma separated flag counts")
+    parser.add_argument('--submissions', type=int, default=200, help="Messages submitted per flag count")
+    args = parser.parse_args()
+    print(f"{'flags':>8}{'build ms':>12}{'matcher us':>14}{'naive us':>14}")
+    for flags in [int(x) for x in args.flags.split(',') if x]:
+        challenge = make_challenge(flags)
+        messages = make_messages(challenge, args.submissions)
+        start = time.perf_counter()
+        # Let the first submission pay for the failure links, the same as in the bot
+        challenge.validate_flag('benchmark', '')
+        build = (time.perf_counter() - start) * 1000
+        naive = measure(lambda message: naive_validate(challenge, message), messages)
+        # Flags captured along the way are skipped, the rest of the message is still scanned
+        matcher = measure(lambda message: challenge.validate_flag('benchmark', message), messages)
+        print(f"{flags:>8}{build:>12.2f}{matcher:>14.2f}{naive:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+#
+# Compare load/save time and size of pickled users against core.state.serializer
+# Usage: python -m benchmarks.serialization [number of users]
+
+import sys
+import time
+import pickle
+from core.objects.profile import Profile
+from core.objects.token import Token
+from core.objects.user import User
+from core.objects.usertable import UserTable
+from core.state import serializer
+
+REPEAT = 5
+
+
+def generate_profile(users):
+    profile = Profile.__new__(Profile)
+    profile.__dict__.update(id=1, channel_name='channel', bot_name='bot', superusers={'channel', 'bot'},
+                            client_id='client', bot_id=1, channel_id=2, challenge=1, discord=None,
+                            tokens={'api': Token('api'), 'irc': Token('irc')}, users=dict())
+    for i in range(users):
+        user = User(f'user{i}', moderator=i % 1000 == 0)
+        user.interact = (None, True, False)[i % 3]
+        user.interaction_count = i % 50
+        profile.users[user.name] = user
+    return profile
+
+
+def pickle_profile(profile):
+    return pickle.dumps(profile)
+
+
+def dumps_profile(profile, compress=False):
+    """
+    Profile and users the way FileStore stores them, the profile and one file per shard
+    """
+    table = UserTable.from_dict(profile.users)
+    users, profile.users = profile.users, table
+    try:
+        shards = [serializer.dumps_users(shard, compress=compress) for shard in table.pop_changed().values()]
+        return [serializer.dumps(profile, compress=compress)] + shards
+    finally:
+        profile.users = users
+
+
+def loads_profile(data):
+    profile = serializer.loads(data[0])
+    shards = [serializer.loads_users(shard) for shard in data[1:]]
+    profile.users = dict()
+    for shard in shards:
+        profile.users.update(shard)
+    return profile
+
+
+def loads_profile_only(data):
+    return serializer.loads(data[0])
+
+
+def measure(function, *args):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(args):
+    users = int(args[0]) if args else 100000
+    profile = generate_profile(users)
+    formats = [
+        ('pickle', pickle_profile, pickle.loads),
+        ('serializer', dumps_profile, loads_profile),
+        ('serializer+zlib', lambda obj: dumps_profile(obj, compress=True), loads_profile),
+        ('profile only', dumps_profile, loads_profile_only),
+    ]
+    print(f"Profile with {users} users, best of {REPEAT}")
+    print(f"{'format':<18}{'save (ms)':>12}{'load (ms)':>12}{'load/pickle':>12}{'size (kB)':>12}")
+    pickle_load = None
+    for name, dumps, loads in formats:
+        save, data = measure(dumps, profile)
+        load, _ = measure(loads, data)
+        pickle_load = pickle_load or load
+        size = len(data) if isinstance(data, bytes) else sum(len(part) for part in data)
+        print(f"{name:<18}{save * 1000:>12.1f}{load * 1000:>12.1f}{load / pickle_load:>12.2f}{size / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,233 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+#
+# Measure a state store against synthetic profiles and challenges in a temporary directory
+# A FileStore is also checked to keep changes made to a profile upgraded from a raw pickle,
+# and to load a challenge whose journal was compacted into a snapshot that already had later changes
+# Usage: python -m benchmarks.storage [--store core.state.filestore.FileStore] [--users 1000,100000]
+#                                     [--flags 10,1000] [--repeat 20]
+
+import os
+import time
+import pickle
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from importlib import import_module
+from core import settings
+from core.objects.user import User
+from core.objects.profile import Profile
+from core.state.filestore import FileStore, get_full_path
+
+DEFAULT_STORE = 'core.state.filestore.FileStore'
+
+
+class Timings:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+
+    def measure(self, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.samples.append(time.perf_counter() - start)
+        return result
+
+    def percentile(self, percent):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    def __str__(self):
+        total = sum(self.samples)
+        throughput = len(self.samples) / total if total else float('inf')
+        return (f"{self.name:<22}{len(self.samples):>6}{throughput:>12.1f}"
+                f"{self.percentile(50) * 1000:>10.2f}{self.percentile(95) * 1000:>10.2f}"
+                f"{self.percentile(99) * 1000:>10.2f}{max(self.samples) * 1000:>10.2f}")
+
+
+def directory_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+
+def load_store_class(middleware):
+    module_path, klass = middleware.rsplit('.', 1)
+    return getattr(import_module(module_path), klass)
+
+
+def print_header(title):
+    print(f"\n{title}")
+    print(f"{'operation':<22}{'n':>6}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+
+def flushed(store, function, *args, **kwargs):
+    """
+    Call a store method and wait until its writes have reached the disk
+    """
+    result = function(*args, **kwargs)
+    store.flush()
+    return result
+
+
+def bench_profiles(store_class, path, users, repeat):
+    store = store_class()
+    create = Timings('create_profile')
+    for i in range(repeat):
+        profile = create.measure(flushed, store, store.create_profile, f'channel{i}', bot=f'bot{i}')
+    profile = store.create_profile('benchmark', bot='benchbot')
+    names = [f'user{i}' for i in range(users)]
+    for i, name in enumerate(names):
+        user = User(name)
+        user.interact = (None, True, False)[i % 3]
+        profile.users[name] = user
+    populate = Timings('save_profile (all)')
+    populate.measure(flushed, store, store.save_profile, profile)
+
+    save = Timings('save_profile (1 user)')
+    load = Timings('load_profile')
+    allowed = Timings('get_allowed_users')
+    denied = Timings('set_denied_users')
+    for _ in range(repeat):
+        name = random.choice(names)
+        user = profile.users[name]
+        user.interaction_count += 1
+        profile.users[name] = user
+        save.measure(flushed, store, store.save_profile, profile)
+        profile = load.measure(store_class().load_profile, profile.id)
+    for _ in range(repeat):
+        allowed.measure(store.get_allowed_users, profile.id)
+        denied.measure(flushed, store, store.set_denied_users, profile.id, random.sample(names, min(10, users)))
+    print_header(f"{store_class.__name__}: profile with {users} users")
+    for timings in (create, populate, save, load, allowed, denied):
+        print(timings)
+    print(f"Storage used: {directory_size(path) / 1024:.1f} kB")
+
+
+def check_legacy_upgrade(store_class):
+    """
+    Change the users of a profile stored as a raw pickle, and make sure the changes survive a reload
+    """
+    profile = Profile.__new__(Profile)
+    profile.__dict__.update({'id': 900, 'channel_name': 'legacy', 'bot_name': None, 'superusers': {'legacy'},
+                             'users': {name: User(name) for name in ('u1', 'u2')}, 'client_id': None,
+                             'tokens': dict(), 'bot_id': None, 'channel_id': None, 'challenge': None,
+                             'discord': None})
+    profile.users['u1'].interact = True
+    get_full_path('900_legacy.profile').write_bytes(pickle.dumps(profile))
+    store = store_class()
+    profile = store.load_profile(900)
+    profile.set_denied_users(['u2'])
+    profile.set_allowed_users(['newguy'])
+    flushed(store, store.save_profile, profile)
+    profile = store_class().load_profile(900)
+    if profile.users['u2'].interact is not False or 'newguy' not in profile.users \
+            or profile.users['u1'].interact is not True:
+        raise SystemExit("Changes to an upgraded legacy profile were lost after a reload")
+    print("Legacy profile upgrade: changes kept after reload")
+
+
+def describe_challenge(challenge):
+    return (challenge.level, challenge.objective, sorted(challenge.objectives),
+            sorted((f.text, f.value, f.captured) for f in challenge.flags.values()),
+            sorted(challenge.get_leaderboard_scores().items()))
+
+
+def check_journal_replay(store_class):
+    """
+    Compact a journal while the challenge already holds changes that are journaled afterwards,
+    replaying those on the snapshot has to leave it unchanged
+    """
+    journal = settings.FILE_STORE_JOURNAL if hasattr(settings, 'FILE_STORE_JOURNAL') else None
+    limit = settings.FILE_STORE_JOURNAL_LIMIT if hasattr(settings, 'FILE_STORE_JOURNAL_LIMIT') else None
+    settings.FILE_STORE_JOURNAL = True
+    try:
+        compact_with_later_changes(store_class)
+    finally:
+        settings.FILE_STORE_JOURNAL, settings.FILE_STORE_JOURNAL_LIMIT = journal, limit
+    print("Journal compaction: changes in the snapshot replay without effect")
+
+
+def compact_with_later_changes(store_class):
+    store = store_class()
+    challenge = store.create_challenge('virtualbox', 'journal')
+    for i in range(3):
+        challenge.create_flag(f'F{i}', i, 10)
+    flushed(store, store.save_challenge, challenge)
+    challenge.validate_flag('u1', 'F0')
+    challenge.delete_flag('F2')
+    challenge.create_objective('first', 1)
+    journaled = challenge.pop_changes()
+    # Made before the journaled records are saved, so they are in the snapshot and journaled after it
+    challenge.create_flag('F2', 2, 50)
+    challenge.validate_flag('u2', 'F2')
+    challenge.delete_objective(1)
+    challenge.set_current_objective('second')
+    settings.FILE_STORE_JOURNAL_LIMIT = len(journaled)
+    store.save_challenge(challenge, changes=journaled)
+    flushed(store, store.save_challenge, challenge)
+    if describe_challenge(store_class().load_challenge(challenge.id)) != describe_challenge(challenge):
+        raise SystemExit("Replaying a compacted journal changed the challenge")
+
+
+def bench_challenges(store_class, path, flags, repeat):
+    store = store_class()
+    create = Timings('create_challenge')
+    for i in range(repeat):
+        create.measure(flushed, store, store.create_challenge, 'virtualbox', f'box{i}')
+    challenge = store.create_challenge('virtualbox', 'benchmark')
+    texts = [f'THO{{{i:08x}}}' for i in range(flags)]
+    for i, text in enumerate(texts):
+        challenge.create_flag(text, i % 10, 10)
+    # Capture half of the flags, leaving the rest for the capture timings
+    for i, text in enumerate(texts[:flags // 2]):
+        challenge.validate_flag(f'user{i % 500}', text)
+    populate = Timings('save_challenge (all)')
+    populate.measure(flushed, store, store.save_challenge, challenge)
+
+    capture = Timings('save_challenge (1 cap)')
+    load = Timings('load_challenge')
+    remaining = texts[flags // 2:]
+    for i in range(min(repeat, len(remaining))):
+        challenge.validate_flag(f'user{i}', remaining[i])
+        capture.measure(flushed, store, store.save_challenge, challenge)
+        load.measure(store_class().load_challenge, challenge.id)
+    print_header(f"{store_class.__name__}: challenge with {flags} flags")
+    for timings in (create, populate, capture, load):
+        if timings.samples:
+            print(timings)
+    print(f"Storage used: {directory_size(path) / 1024:.1f} kB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a state store")
+    parser.add_argument('--store', default=DEFAULT_STORE, help="Dotted path of the store class")
+    parser.add_argument('--users', default='1000,100000', help="Comma separated profile sizes")
+    parser.add_argument('--flags', default='10,1000', help="Comma separated challenge sizes")
+    parser.add_argument('--repeat', type=int, default=20, help="Samples per operation")
+    args = parser.parse_args()
+    store_class = load_store_class(args.store)
+    # Saves are measured as they hit the disk, without group commit
+    settings.FILE_STORE_COMMIT_WINDOW = 0
+    settings.DEFAULT_PROFILE = None
+    for users in [int(x) for x in args.users.split(',') if x]:
+        with tempfile.TemporaryDirectory() as path:
+            settings.FILE_STORE_PATH = path
+            settings.DATABASE_PATH = os.path.join(path, 'benchmark.db')
+            bench_profiles(store_class, path, users, args.repeat)
+    if issubclass(store_class, FileStore):
+        with tempfile.TemporaryDirectory() as path:
+            settings.FILE_STORE_PATH = path
+            check_legacy_upgrade(store_class)
+        with tempfile.TemporaryDirectory() as path:
+            settings.FILE_STORE_PATH = path
+            check_journal_replay(store_class)
+    for flags in [int(x) for x in args.flags.split(',') if x]:
+        with tempfile.TemporaryDirectory() as path:
+            settings.FILE_STORE_PATH = path
+            settings.DATABASE_PATH = os.path.join(path, 'benchmark.db')
+            bench_challenges(store_class, path, flags, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,11 @@ import json
 import logging
 import threading
 from twitchio.ext import commands
-from core.exceptions import NoProfileSelectedError, NoChallengeSelectedError,\
-    BoxNotInitializedError, BoxNotRunningError
+from core.exceptions import NoProfileSelectedError, NoChallengeSelectedError, ChallengeNotFoundError,\
+    BoxNotInitializedError, BoxNotRunningError, BoxNotFoundError, InputQueueFullError,\
+    StandbyActiveError
 from core.objects.challenge import FLAG_DOES_NOT_EXIST, FLAG_ALREADY_CAPTURED, FLAG_CAPTURED_SUCCESSFULLY
+from core.objects.flag import FLAG_SUBMISSION_THROTTLED
 
 logger = logging.getLogger(__name__)
 
@@ -86,7 +88,8 @@ class TwitchBot(commands.Bot):
                         f"{user} is now in the hotseat, and has exclusive control for the next 5 minutes"
                     )
             elif reward == 'Hints':
-                await self.channel.send(self.state.reveal_hint())
+                challenge_id, _ = self.state.route(user, ())
+                await self.channel.send(self.state.reveal_hint(challenge_id))
 
     async def _parse_bits(self, data):
         message = json.loads(data.get('data').get('message'))
@@ -126,7 +129,8 @@ class TwitchBot(commands.Bot):
             display_name = message_data.get('tags').get('display_name')
             if login != self.nick:
                 logger.info(f"Received whisper: {body} from {login}")
-                result, points = self.state.capture_flag(login, body)
+                challenge_id, words = self.state.route(login, body.split(' '))
+                result, points = self.state.submit_flag(login, ' '.join(words), challenge_id)
                 # Whispers are kinda broken
                 # They require the user to close and reopen the whisper box to see the response
                 # Not sure why that happens
@@ -136,12 +140,20 @@ class TwitchBot(commands.Bot):
                 elif result == FLAG_CAPTURED_SUCCESSFULLY:
                     await self._ws.send_privmsg(self.channel.name,
                                                 f".w {login} Flag has been captured and {points} points rewarded!")
-                    total_points = self.state.get_challenge_points(login)
+                    total_points = self.state.get_challenge_points(login, challenge_id)
                     await self.channel.send(f"""{display_name} received {points} points for submitting a flag
                                             for a total of {total_points} points!""")
+                    teams = self.state.get_team_leaderboard(3, challenge_id)
+                    if teams:
+                        await self.channel.send("Team standings: " + " | ".join(teams))
                 elif result == FLAG_ALREADY_CAPTURED:
                     await self._ws.send_privmsg(self.channel.name,
                                                 f".w {login} Flag was already captured")
+                elif result == FLAG_SUBMISSION_THROTTLED and points is not None:
+                    # Only the first throttled submission is answered, so guessing does not flood the whispers
+                    await self._ws.send_privmsg(self.channel.name,
+                                                f".w {login} Too many submissions, "
+                                                f"try again in {int(points) + 1} seconds")
         except (NoChallengeSelectedError, AttributeError):
             logger.info("Whisper message not handled")
 
@@ -177,6 +189,30 @@ class TwitchBot(commands.Bot):
         # Ignore if an erroneous command is sent to the bot
         return
 
+    def _route(self, ctx, args):
+        """
+        Pick the challenge a command is for, from a '#name' argument or the challenge the author joined
+
+        :return: Challenge id, the arguments and the text after the command, both without the challenge name
+        :rtype: tuple
+        """
+        challenge_id, routed = self.state.route(ctx.author.name, args)
+        prefix = ctx.message.content.split(' ')[0]
+        text = ctx.message.content[len(prefix)+1:]
+        if len(routed) < len(args):
+            text = text[len(args[0])+1:]
+        return challenge_id, routed, text
+
+    def _queued(self, challenge_id):
+        """
+        :return: Note on the input that is still waiting to be delivered ahead of the latest command
+        :rtype: str
+        """
+        ahead = self.state.get_input_pending(challenge_id) - 1
+        if ahead > 0:
+            return f" ({ahead} ahead in queue)"
+        return ""
+
     # region general commands
     @commands.command(name='help')
     async def show_help(self, ctx, *args):
@@ -186,7 +222,11 @@ class TwitchBot(commands.Bot):
             '!type your text' to type text |
             '!execute your command' to execute commands (enter at end of line) |
             '!press keys' to send special key commands |
-            '!release' to release stuck modifier keys
+            '!release' to release stuck modifier keys |
+            '!lb' to show the leaderboard, '!rank [username]' for your position |
+            '!season [username]' for the scores across all challenges |
+            '!team [join name|leave]' to show or change your team, '!teams' for the team standings |
+            '!play [name|leave]' to pick the challenge your commands go to, or start a command with '#name'
             """
         if ctx.author.is_mod:
             if 'mod' in args:
@@ -195,8 +235,10 @@ class TwitchBot(commands.Bot):
                 '!allow username(s)' |
                 '!deny username(s)' |
                 '!remove username(s)' |
+                '!team set name username(s)' move users to a team |
                 '!stop [halt] [restore]' stop, forcefully halt or restore the VM |
                 '!snap' snapshot the current VM state |
+                '!machine [name]' send the keyboard input to another machine of the challenge |
                 '!delay [ms] [seconds]' override keypress delay
                 """
             else:
@@ -204,10 +246,11 @@ class TwitchBot(commands.Bot):
         await ctx.send(help_text)
 
     @commands.command(name='objective', aliases=['obj', 'what'])
-    async def show_objective(self, ctx):
+    async def show_objective(self, ctx, *args):
+        challenge_id, _, _ = self._route(ctx, args)
         objective = "There is no objective set at the moment"
         try:
-            objective = self.state.get_current_objective()
+            objective = self.state.get_current_objective(challenge_id)
         except NoChallengeSelectedError:
             pass
         objective_text = objective + """ |
@@ -241,36 +284,37 @@ class TwitchBot(commands.Bot):
 
     @commands.command(name='type', aliases=['t'])
     async def type_input(self, ctx, *args):
+        challenge_id, args, command = self._route(ctx, args)
         if not args:
             return
         try:
             if await self.can_interact(ctx):
-                # TODO: self.state.new_interaction()
-                prefix = ctx.message.content.split(' ')[0]
-                command = ctx.message.content[len(prefix)+1:]
-                self.state.type_text(command)
-                await ctx.send(f"Typed: '{command}'"[:500])
+                self.state.new_interaction(ctx.author.name, ctx.message.content, 'type', challenge_id)
+                self.state.type_text(command, challenge_id, ctx.author.name)
+                queued = self._queued(challenge_id)
+                await ctx.send(f"Typed: '{command}'"[:500 - len(queued)] + queued)
         except (ValueError, IndexError, AttributeError) as e:
             logger.exception(e)
         except (NoChallengeSelectedError, BoxNotInitializedError):
             await ctx.send("There is no challenge running at the moment, please stand by..")
+        except InputQueueFullError:
+            await ctx.send("Too much input is waiting to be typed, please try again in a moment")
         except BoxNotRunningError:
             await ctx.send("Instance is not running, attempting to restart it...")
-            self.state.start_challenge()
+            self.state.start_challenge(challenge_id=challenge_id)
 
     @commands.command(name='execute', aliases=['e'])
     async def execute_line(self, ctx, *args):
+        challenge_id, args, command = self._route(ctx, args)
         try:
             if await self.can_interact(ctx):
-                # TODO: self.state.new_interaction()
+                self.state.new_interaction(ctx.author.name, ctx.message.content, 'execute', challenge_id)
                 if args:
-                    prefix = ctx.message.content.split(' ')[0]
-                    command = ctx.message.content[len(prefix)+1:]
-                    self.state.type_text(command)
-                    self.state.send_keys(['enter'])
-                    await ctx.send(f"Executed: '{command}'"[:500])
+                    self.state.execute_text(command, challenge_id, ctx.author.name)
+                    queued = self._queued(challenge_id)
+                    await ctx.send(f"Executed: '{command}'"[:500 - len(queued)] + queued)
                 else:
-                    command = self.state.send_keys(['enter'])
+                    command = self.state.send_keys(['enter'], challenge_id, ctx.author.name)
                     if command:
                         keys_sent = ' '.join(command)
                         await ctx.send(f"Pressed: '{keys_sent}'")
@@ -278,51 +322,159 @@ class TwitchBot(commands.Bot):
             logger.exception(e)
         except (NoChallengeSelectedError, BoxNotInitializedError):
             await ctx.send("There is no challenge running at the moment, please stand by..")
+        except InputQueueFullError:
+            await ctx.send("Too much input is waiting to be typed, please try again in a moment")
         except BoxNotRunningError:
             await ctx.send("Instance is not running, attempting to restart it...")
-            self.state.start_challenge()
+            self.state.start_challenge(challenge_id=challenge_id)
 
     @commands.command(name='press', aliases=['p'])
     async def press_keys(self, ctx, *args):
+        challenge_id, args, _ = self._route(ctx, args)
         try:
             if await self.can_interact(ctx):
                 if len(args) == 0:
-                    await ctx.send(f"Special keys: {self.state.get_special_keys()}")
+                    await ctx.send(f"Special keys: {self.state.get_special_keys(challenge_id)}")
                 else:
-                    # TODO: self.state.new_interaction()
-                    command = self.state.send_keys(args)
+                    self.state.new_interaction(ctx.author.name, ctx.message.content, 'press', challenge_id)
+                    command = self.state.send_keys(args, challenge_id, ctx.author.name)
                     if command:
                         keys_sent = ' '.join(command)
                         await ctx.send(f"Pressed: '{keys_sent}'")
                     else:
-                        await ctx.send(f"Special keys: {self.state.get_special_keys()}")
+                        await ctx.send(f"Special keys: {self.state.get_special_keys(challenge_id)}")
         except (ValueError, IndexError, AttributeError) as e:
             logger.exception(e)
         except (NoChallengeSelectedError, BoxNotInitializedError):
             await ctx.send("There is no challenge running at the moment, please stand by..")
+        except InputQueueFullError:
+            await ctx.send("Too much input is waiting to be typed, please try again in a moment")
         except BoxNotRunningError:
             await ctx.send("Instance is not running, attempting to restart it...")
-            self.state.start_challenge()
+            self.state.start_challenge(challenge_id=challenge_id)
 
     @commands.command(name='release')
     async def release_keys(self, ctx, *args):
+        challenge_id, _, _ = self._route(ctx, args)
         try:
             if await self.can_interact(ctx):
-                self.state.release_keys()
+                self.state.release_keys(challenge_id)
                 await ctx.send('Released all modifier keys')
         except (NoChallengeSelectedError, BoxNotInitializedError, BoxNotRunningError):
             await ctx.send("There is no challenge running at the moment, please stand by..")
+        except InputQueueFullError:
+            await ctx.send("Too much input is waiting to be typed, please try again in a moment")
+
+    @commands.command(name='play')
+    async def play_challenge(self, ctx, *args):
+        if len(args) > 0 and args[0] == 'leave':
+            self.state.leave_challenge(ctx.author.name)
+        elif len(args) > 0:
+            try:
+                active = self.state.join_challenge(ctx.author.name, args[0])
+                await ctx.send(f"{ctx.author.name} is now playing {active.challenge.name}")
+            except ChallengeNotFoundError:
+                await ctx.send(f"There is no challenge called {args[0]} at the moment")
+            return
+        active = self.state.get_joined_challenge(ctx.author.name)
+        challenges = ' | '.join(str(active) for active in self.state.get_active_challenges())
+        if active:
+            await ctx.send(f"{ctx.author.name} is playing {active.challenge.name}. Challenges: {challenges}")
+        elif challenges:
+            await ctx.send(f"Challenges: {challenges}")
+        else:
+            await ctx.send("There is no challenge running at the moment, please stand by..")
     # endregion challenge interaction
 
     # region user handling
     @commands.command(name='leaderboard', aliases=['lb'])
     async def show_leaderboard(self, ctx, *args):
-        leaderboard = self.state.get_leaderboard(5)
+        challenge_id, _, _ = self._route(ctx, args)
+        try:
+            leaderboard = self.state.get_leaderboard(5, challenge_id)
+        except NoChallengeSelectedError:
+            return
         if not leaderboard:
             await ctx.send("Leaderboard is empty!")
         else:
             await ctx.send(" | ".join(leaderboard))
 
+    @commands.command(name='season')
+    async def show_season(self, ctx, *args):
+        try:
+            if len(args) > 0:
+                username = args[0].lstrip('@')
+                rank = self.state.get_season_rank(username)
+                if rank:
+                    points = self.state.get_season_points(username)
+                    await ctx.send(f"{username} is number {rank} this season with {points} points")
+                else:
+                    await ctx.send(f"{username} has no points this season")
+            else:
+                leaderboard = self.state.get_season_leaderboard(5)
+                if not leaderboard:
+                    await ctx.send("Season leaderboard is empty!")
+                else:
+                    await ctx.send(" | ".join(leaderboard))
+        except NoProfileSelectedError:
+            pass
+
+    @commands.command(name='team')
+    async def manage_team(self, ctx, *args):
+        try:
+            if len(args) > 1 and args[0] == 'join':
+                self.state.set_team([ctx.author.name], args[1])
+                await ctx.send(f"{ctx.author.name} joined team {args[1]}")
+            elif len(args) > 0 and args[0] == 'leave':
+                self.state.set_team([ctx.author.name], None)
+                await ctx.send(f"{ctx.author.name} left their team")
+            elif len(args) > 2 and args[0] == 'set' and ctx.author.is_mod:
+                usernames = [username.lstrip('@') for username in args[2:]]
+                self.state.set_team(usernames, args[1])
+                await ctx.send(f"Moved {', '.join(usernames)} to team {args[1]}")
+            else:
+                team = self.state.get_team(ctx.author.name)
+                if not team:
+                    await ctx.send(f"{ctx.author.name} is not on a team, use '!team join name' to join one")
+                    return
+                challenge_id, _ = self.state.route(ctx.author.name, ())
+                rank = self.state.get_team_rank(team, challenge_id)
+                points = self.state.get_team_points(team, challenge_id)
+                if rank:
+                    await ctx.send(f"{ctx.author.name} is on team {team}, number {rank} with {points} points")
+                else:
+                    await ctx.send(f"{ctx.author.name} is on team {team}, which has not scored yet")
+        except (NoProfileSelectedError, NoChallengeSelectedError):
+            pass
+
+    @commands.command(name='teams')
+    async def show_teams(self, ctx, *args):
+        challenge_id, _, _ = self._route(ctx, args)
+        try:
+            leaderboard = self.state.get_team_leaderboard(5, challenge_id)
+        except NoChallengeSelectedError:
+            return
+        if not leaderboard:
+            await ctx.send("No team has scored yet!")
+        else:
+            await ctx.send(" | ".join(leaderboard))
+
+    @commands.command(name='rank')
+    async def show_rank(self, ctx, *args):
+        challenge_id, args, _ = self._route(ctx, args)
+        username = ctx.author.name
+        if len(args) > 0:
+            username = args[0].lstrip('@')
+        try:
+            rank = self.state.get_rank(username, challenge_id)
+        except NoChallengeSelectedError:
+            return
+        if rank:
+            points = self.state.get_challenge_points(username, challenge_id)
+            await ctx.send(f"{username} is number {rank} on the leaderboard with {points} points")
+        else:
+            await ctx.send(f"{username} has not captured any flags yet")
+
     @commands.command(name='hotseat', aliases=['hs'])
     async def hotseat_user(self, ctx, *args):
         if ctx.author.is_mod:
@@ -373,26 +525,23 @@ class TwitchBot(commands.Bot):
     async def shut_down(self, ctx, *args):
         if not ctx.author.is_mod:
             return
+        challenge_id, args, _ = self._route(ctx, args)
         if args:
             if args[0] == 'restore':
                 try:
-                    self.state.stop_challenge()
-                except BoxNotRunningError:
-                    pass
-                try:
-                    self.state.start_challenge(restore=True)
+                    self.state.restore_challenge(challenge_id=challenge_id)
                     await ctx.send("Most recent snapshot has been restored")
                 except (NoChallengeSelectedError, BoxNotInitializedError):
                     await ctx.send("Could not restore snapshot")
             if args[0] == 'halt':
                 try:
-                    self.state.stop_challenge(save=False)
+                    self.state.stop_challenge(save=False, challenge_id=challenge_id)
                     await ctx.send("System is now in 'powered off' state")
                 except (NoChallengeSelectedError, BoxNotInitializedError, BoxNotInitializedError):
                     await ctx.send("System is not running")
         else:
             try:
-                self.state.stop_challenge(save=True)
+                self.state.stop_challenge(save=True, challenge_id=challenge_id)
                 await ctx.send("System is now in 'saved' state")
             except (NoChallengeSelectedError, BoxNotInitializedError, BoxNotInitializedError):
                 await ctx.send("System is not running")
@@ -401,19 +550,39 @@ class TwitchBot(commands.Bot):
     async def snapshot(self, ctx, *args):
         if not ctx.author.is_mod:
             return
+        challenge_id, _, _ = self._route(ctx, args)
         try:
-            self.state.snapshot_challenge(ctx.author.name)
+            self.state.snapshot_challenge(ctx.author.name, challenge_id)
             await ctx.send("Snapshot created!")
         except (NoChallengeSelectedError, BoxNotInitializedError):
             await ctx.send("No system to take snapshot of")
+        except StandbyActiveError:
+            await ctx.send("A standby clone is running, snapshots can be taken after the challenge is restarted")
+
+    @commands.command(name='machine', aliases=['vm'])
+    async def select_machine(self, ctx, *args):
+        if not ctx.author.is_mod:
+            return
+        challenge_id, args, _ = self._route(ctx, args)
+        try:
+            if args:
+                self.state.select_machine(args[0], challenge_id)
+            machines, selected = self.state.get_machines(challenge_id)
+            others = ', '.join(name for name in machines if name != selected)
+            await ctx.send(f"Keyboard input goes to {selected}" + (f", other machines: {others}" if others else ""))
+        except (NoChallengeSelectedError, BoxNotInitializedError):
+            await ctx.send("There is no challenge running at the moment, please stand by..")
+        except BoxNotFoundError:
+            await ctx.send(f"There is no machine called {args[0]} in this challenge")
 
     @commands.command(name='delay')
     async def press_delay(self, ctx, *args):
         if not ctx.author.is_mod:
             return
+        challenge_id, args, _ = self._route(ctx, args)
         try:
             if not args:
-                delay = self.state.get_press_delay()
+                delay = self.state.get_press_delay(challenge_id)
                 response = f"Press delay is {delay}ms"
             else:
                 delay = int(args[0])
@@ -422,7 +591,7 @@ class TwitchBot(commands.Bot):
                 if len(args) > 1:
                     expiry = int(args[1])
                     response += f" for the next {expiry} seconds"
-                self.state.set_press_delay(delay, expiration=expiry)
+                self.state.set_press_delay(delay, expiration=expiry, challenge_id=challenge_id)
             await ctx.send(response)
         except (NoChallengeSelectedError, BoxNotInitializedError):
             await ctx.send("There is no challenge running at the moment, please stand by..")
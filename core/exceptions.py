@@ -47,6 +47,16 @@ class BoxNotFoundError(FileNotFoundError):
     pass
 
 
+class InputQueueFullError(Exception):
+    """Too much keyboard input is waiting to be delivered to the box"""
+    pass
+
+
+class StandbyActiveError(Exception):
+    """A standby clone is running in place of the machine, a snapshot of it would be deleted with the clone"""
+    pass
+
+
 class DuplicateFlagError(IndexError):
     """The flag already exists"""
     pass
@@ -57,6 +67,11 @@ class FlagNotFoundError(IndexError):
     pass
 
 
+class InvalidFlagFormatError(ValueError):
+    """The flag format is not a valid regular expression"""
+    pass
+
+
 class FlagAlreadyCapturedError(Exception):
     """The flag has already been captured"""
     pass
@@ -80,3 +95,8 @@ class DuplicateHintError(IndexError):
 class HintMovementError(IndexError):
     """The hint can not be moved in that direction"""
     pass
+
+
+class SerializationError(ValueError):
+    """The stored object could not be read"""
+    pass
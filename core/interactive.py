@@ -5,9 +5,10 @@
 import cmd
 import logging
 from core.objects.flag import FLAG_CAPTURED_SUCCESSFULLY
-from core.exceptions import ProfileNotFoundError, BoxAlreadyRunningError, BoxNotRunningError,\
+from core.exceptions import ProfileNotFoundError, NoProfileSelectedError, BoxAlreadyRunningError, BoxNotRunningError,\
     ChallengeNotFoundError, DuplicateFlagError, FlagNotFoundError, NoChallengeSelectedError,\
-    ObjectiveAlreadyExists, HintNotFoundError, HintMovementError
+    ObjectiveAlreadyExists, HintNotFoundError, HintMovementError, InvalidFlagFormatError, BoxNotFoundError,\
+    StandbyActiveError
 
 logger = logging.getLogger(__name__)
 
@@ -50,12 +51,14 @@ class Interactive(cmd.Cmd):
         print("""Commands:
     help - This help text
     profile (create|update|select) [id] - Configure profiles
-    challenge (create|update|delete|select|list) - Configure challenges
-    flag (create|capture|delete|list) - Configure flags in selected challenge
+    challenge (create|update|delete|select|machines|activate|deactivate|active|list) - Configure challenges
+    flag (create|capture|delete|list|format|stats) - Configure flags in selected challenge
     hint (create|move|delete|list) - Configure hints in selected challenge
     objective (create|override|reset|delete|list) - Configure the objective
+    season (top|user) - Show the scores across all challenges of the profile
+    team (set|remove|list) - Manage teams and show the team standings
     twitch (init|connect|disconnect|status) - Twitch interaction
-    vm (start|stop|halt|snapshot) - Configure the VM
+    vm (start|stop|halt|snapshot|select) - Configure the VM
     stream (up|down) - Start or stop the stream (Not implemented)
     status - Show information about the current state
     quit - Shut down the stream and quit the bot
@@ -115,6 +118,27 @@ class Interactive(cmd.Cmd):
                 print(f"Selected challenge '{challenge}'")
             except (TypeError, ValueError, IndexError, ProfileNotFoundError, ChallengeNotFoundError):
                 print("Please provide an existing challenge id")
+        elif 'machines' in args:
+            names = args.split()[1:]
+            try:
+                self.state.set_challenge_machines(names)
+                print(f"Challenge runs on {', '.join(self.state.challenge.get_machines())}")
+            except NoChallengeSelectedError:
+                print("Select a challenge to configure machines on")
+        elif 'deactivate' in args:
+            try:
+                self.state.deactivate_challenge(int(args.split()[1]))
+            except (ValueError, IndexError, NoChallengeSelectedError):
+                print("Please provide the id of an active challenge")
+        elif 'activate' in args:
+            try:
+                active = self.state.activate_challenge(int(args.split()[1]))
+                print(f"Challenge '{active.challenge}' is now active, chat can play it with #{active.prefix}")
+            except (ValueError, IndexError, ChallengeNotFoundError):
+                print("Please provide an existing challenge id")
+        elif 'active' in args:
+            for active in self.state.get_active_challenges():
+                print(f"{active.challenge.id}\t{active}\t{active.status()}")
         elif 'list' in args:
             print("Not implemented.... yet..")
         else:
@@ -123,6 +147,10 @@ class Interactive(cmd.Cmd):
     update - Update the selected challenge
     delete [id] - Delete a challenge
     select [id] - Select a different challenge
+    machines [names] - Run the selected challenge on several VMs, the first one gets the keyboard input
+    activate [id] - Run a challenge next to the selected one, chat picks it with #name or !play name
+    deactivate [id] - Save a challenge and shut down its VM
+    active - List the challenges that are being played
     list - List all challenges
             """)
 
@@ -130,7 +158,17 @@ class Interactive(cmd.Cmd):
         if not self.state.challenge:
             print("Challenge not initialized!")
             args = ''
-        if 'create' in args:
+        if args.startswith('format'):
+            pattern = args[7:].strip()
+            try:
+                self.state.set_flag_format(pattern or None)
+                if pattern:
+                    print(f"Only flags matching '{pattern}' are accepted")
+                else:
+                    print("Flags are accepted anywhere in a message")
+            except InvalidFlagFormatError as e:
+                print(f"Error: Invalid flag format: {e}")
+        elif 'create' in args:
             flag = input("  Flag text: ")
             level = _demand_integer("  What level does the flag unlock: ")
             points = _demand_integer("  How many points does the flag reward: ")
@@ -159,6 +197,10 @@ class Interactive(cmd.Cmd):
                 print("Error: Flag does not exist!")
             except NoChallengeSelectedError:
                 print("Select a challenge to configure flags on")
+        elif 'stats' in args:
+            counters = self.state.get_submission_counters()
+            print(f"Submissions from chat: {counters['accepted']} accepted, {counters['rejected']} rejected "
+                  f"({counters['cached']} answered from cache), {counters['throttled']} throttled")
         elif 'list' in args:
             try:
                 print(self.state.list_flags())
@@ -170,6 +212,9 @@ class Interactive(cmd.Cmd):
     capture - Mark a flag as captured
     delete [flag] - Delete a flag
     list - List all flags
+    format [pattern] - Only accept flags matching a pattern, such as THO{[^}]+}
+                       Without a pattern, flags are accepted anywhere in a message
+    stats - Show how many flags submitted from chat were accepted, rejected and throttled
             """)
 
     def do_hint(self, args):
@@ -186,13 +231,12 @@ class Interactive(cmd.Cmd):
                 print("Select a challenge to configure flags on")
         elif 'move' in args:
             print(self.state.list_hints())
-            level = _demand_integer("  Level of hint to move: ")
-            index = _demand_integer("  ID of hint to move: ")
+            hint_id = _demand_integer("  ID of hint to move: ")
             direction = None
             while direction != 'up' and direction != 'down':
                 direction = input("  Direction to move hint (up|down): ")
             try:
-                getattr(self.state, 'move_hint_' + direction)(level, index)
+                getattr(self.state, 'move_hint_' + direction)(hint_id)
             except (NoChallengeSelectedError, HintNotFoundError, HintMovementError):
                 print("Could not move hint")
         elif 'delete' in args:
@@ -201,9 +245,9 @@ class Interactive(cmd.Cmd):
             except (ValueError, IndexError):
                 print("Error: Please provide a hint id to delete!")
             except HintNotFoundError:
-                print("Error: Flag does not exist!")
+                print("Error: Hint does not exist!")
             except NoChallengeSelectedError:
-                print("Select a challenge to configure flags on")
+                print("Select a challenge to configure hints on")
         elif 'list' in args:
             try:
                 print(self.state.list_hints())
@@ -212,8 +256,8 @@ class Interactive(cmd.Cmd):
         else:
             print("""Hint commands:
     create - Create a new hint
-    move - Move a hint up/down (Hints are revealed in order top-down)
-    delete [hint] - Delete a hint
+    move - Move a hint up/down (Hints are revealed in order top-down, revealed hints stay on top)
+    delete [id] - Delete a hint
     list - List all hints
             """)
 
@@ -262,6 +306,55 @@ class Interactive(cmd.Cmd):
     list - List all objectives
             """)
 
+    def do_season(self, args):
+        args = args.split()
+        try:
+            if args and args[0] == 'top':
+                number = int(args[1]) if len(args) > 1 else 10
+                leaderboard = self.state.get_season_leaderboard(number)
+                print("\n".join(leaderboard) if leaderboard else "No points scored this season")
+            elif args and args[0] == 'user' and len(args) > 1:
+                rank = self.state.get_season_rank(args[1])
+                if rank:
+                    print(f"{args[1]}: {self.state.get_season_points(args[1])} points, rank {rank}")
+                else:
+                    print(f"{args[1]} has no points this season")
+            else:
+                print("""Season commands:
+    top [number] - Show the best users across all challenges
+    user [username] - Show the points and rank of a user
+                """)
+        except ValueError:
+            print("Error: Please provide the number of users to show!")
+        except NoProfileSelectedError:
+            print("Select a profile to show the season of")
+
+    def do_team(self, args):
+        args = args.split()
+        try:
+            if args and args[0] == 'set':
+                team = input("  Team name: ").strip()
+                usernames = input("  Usernames, separated by spaces: ").split()
+                if team and usernames:
+                    self.state.set_team(usernames, team)
+                    print(f"Moved {len(usernames)} users to team {team}")
+            elif args and args[0] == 'remove' and len(args) > 1:
+                self.state.set_team(args[1:], None)
+                print(f"Removed {len(args) - 1} users from their team")
+            elif args and args[0] == 'list':
+                leaderboard = self.state.get_team_leaderboard(10)
+                print("\n".join(leaderboard) if leaderboard else "No team has scored in this challenge")
+            else:
+                print("""Team commands:
+    set - Move users to a team
+    remove [usernames] - Remove users from their team
+    list - Show the team standings in the selected challenge
+                """)
+        except NoProfileSelectedError:
+            print("Select a profile to manage teams on")
+        except NoChallengeSelectedError:
+            print("Select a challenge to show the team standings of")
+
     def do_twitch(self, args):
         """
         Connect or disconnect the TwitchIO Services
@@ -313,16 +406,36 @@ class Interactive(cmd.Cmd):
                 print("Box has been shut down successfully!")
             except BoxNotRunningError:
                 print(f"'{self.state.box}' is not running")
+        elif 'restore' in args:
+            print(f"Restoring '{self.state.box}'...")
+            if self.state.restore_challenge():
+                print("A standby clone took over")
+            else:
+                print("Snapshot has been restored")
         elif 'snapshot' in args:
             print(f"Taking snapshot of '{self.state.box}'...")
-            self.state.box.snapshot('Interactive mode')
-            print("State has been saved successfully!")
+            try:
+                self.state.box.snapshot('Interactive mode')
+                print("State has been saved successfully!")
+            except StandbyActiveError:
+                print("Error: A standby clone is running, its snapshot would be deleted with it")
+        elif 'select' in args:
+            try:
+                self.state.select_machine(args.split()[1])
+            except IndexError:
+                pass
+            except BoxNotFoundError:
+                print("Error: Machine is not part of the challenge!")
+            machines, selected = self.state.get_machines()
+            print(f"Keyboard input goes to {selected}, machines: {', '.join(machines)}")
         else:
             print("""VM commands:
     start - Start the client
     stop - Stop and save the client
     halt - Forcefully shut down the client
+    restore - Restore the last snapshot, from a standby clone when one is ready
     snapshot - Take a snapshot of the current client state
+    select [name] - Send the keyboard input to another machine of the challenge
             """)
 
     def do_stream(self, args):
@@ -2,16 +2,35 @@
 # "Twitch Hacks Online"
 # 2020 - Frank Godo
 
+import re
+from bisect import bisect_left, bisect_right, insort
+from core.objects.tracked import Tracked
 from core.objects.hint import Hint
+from core.objects.hintqueue import HintQueue, build_hint_queues
 from core.objects.objective import Objective
-from core.objects.flag import Flag, FLAG_ALREADY_CAPTURED, FLAG_CAPTURED_SUCCESSFULLY, FLAG_DOES_NOT_EXIST
+from core.objects.flagmatcher import FlagMatcher
+from core.objects.leaderboard import Leaderboard
+from core.objects.flag import Flag, normalize_flag, FLAG_ALREADY_CAPTURED, FLAG_CAPTURED_SUCCESSFULLY,\
+    FLAG_DOES_NOT_EXIST
 from core.exceptions import ProviderNotFoundError, FlagNotFoundError, FlagAlreadyCapturedError, DuplicateFlagError,\
-    ObjectiveAlreadyExists, HintNotFoundError, DuplicateHintError, HintMovementError
+    ObjectiveAlreadyExists, HintNotFoundError, DuplicateHintError, InvalidFlagFormatError
 
 PROVIDERS = ['virtualbox']
 
+# Changes recorded on a challenge, so a state store can persist them incrementally
+CHANGE_SNAPSHOT = 'snapshot'
+CHANGE_CAPTURE = 'capture'
+CHANGE_CREATE_FLAG = 'create_flag'
+CHANGE_DELETE_FLAG = 'delete_flag'
+CHANGE_CREATE_OBJECTIVE = 'create_objective'
+CHANGE_DELETE_OBJECTIVE = 'delete_objective'
+CHANGE_SET_OBJECTIVE = 'set_objective'
+CHANGE_SET_FLAG_FORMAT = 'set_flag_format'
+CHANGE_REVEAL_HINT = 'reveal_hint'
+CHANGE_SET_MACHINES = 'set_machines'
 
-class Challenge:
+
+class Challenge(Tracked):
     def __init__(self, id, provider, name):
         self.id = id
         if provider not in PROVIDERS:
@@ -20,97 +39,245 @@ class Challenge:
         self.name = name
         self.level = 0
         self.flags = dict()
+        # Level -> HintQueue
         self.hints = dict()
         self.objectives = dict()
         self.objective = None
+        # Regular expression for the flag syntax, submissions are only matched exactly when set
+        self.flag_format = None
+        # VirtualBox machines of the challenge, such as an attacker box and its targets. Empty for a single
+        # machine named after the challenge
+        self.machines = list()
+        self._changes = list()
+        self._matcher = None
+        self._flag_table = None
+        self._flag_pattern = None
+        self._leaderboard = None
+        self._hint_index = None
+        self._next_hint_id = 1
+        self._objective_levels = None
+        self._objective_cache = None
 
     def __str__(self):
         return f"{self.name} on {self.provider}"
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_changes', None)
+        state.pop('_matcher', None)
+        state.pop('_flag_table', None)
+        state.pop('_flag_pattern', None)
+        state.pop('_leaderboard', None)
+        state.pop('_hint_index', None)
+        state.pop('_next_hint_id', None)
+        state.pop('_objective_levels', None)
+        state.pop('_objective_cache', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if any(not isinstance(hints, HintQueue) for hints in self.hints.values()):
+            # Hints pickled before they were kept in queues
+            self.hints = build_hint_queues(self.hints)
+        self._changes = list()
+        self._matcher = None
+        self._flag_table = None
+        self._flag_pattern = None
+        self._leaderboard = None
+        self._hint_index = None
+        self._next_hint_id = 1
+        self._objective_levels = None
+        self._objective_cache = None
+        self.own_children()
+
+    # region changes
+    def _record(self, *change):
+        self._changes.append(change)
+        self.touch()
+
+    def own_children(self):
+        """
+        Have the flags, hints and objectives touch the challenge when they change, so its revision covers them
+        Needed after they were added directly, such as by a state store
+        """
+        for flag in self.flags.values():
+            flag.set_owner(self)
+        for hints in self.hints.values():
+            for hint in hints:
+                hint.set_owner(self)
+        for objective in self.objectives.values():
+            objective.set_owner(self)
+
+    def pop_changes(self):
+        """
+        Fetch and clear the changes recorded since the last call
+
+        :return: Change records, CHANGE_SNAPSHOT means the whole challenge has to be saved
+        :rtype: list of tuples
+        """
+        changes = self._changes
+        self._changes = list()
+        return changes
+
+    def apply_change(self, change):
+        """
+        Replay a recorded change on this challenge
+        Applying a change the challenge already contains leaves it unchanged. Stores rely on this, as a snapshot
+        can be written after changes were made but before their records were saved
+
+        :param change: Change record as returned by pop_changes()
+        """
+        action, args = change[0], change[1:]
+        if action == CHANGE_CAPTURE:
+            flag_text, username, capture_time = args
+            flagobj = self.flags.get(flag_text)
+            if flagobj and not flagobj.is_captured():
+                leaderboard = self._get_leaderboard()
+                flagobj.captured = username
+                flagobj.capture_time = capture_time
+                leaderboard.add_capture(username, flagobj.value)
+                self._level_up(flagobj.get_level())
+        elif action == CHANGE_CREATE_FLAG:
+            flag_text, level, points_value, description, location = args
+            if flag_text not in self.flags:
+                self._add_flag(Flag(flag_text, level, points_value, description=description, location=location))
+        elif action == CHANGE_DELETE_FLAG:
+            if args[0] in self.flags:
+                self._remove_flag(args[0])
+        elif action == CHANGE_CREATE_OBJECTIVE:
+            objective, level = args
+            if level not in self.objectives:
+                self._add_objective(Objective(objective, level))
+        elif action == CHANGE_DELETE_OBJECTIVE:
+            if args[0] in self.objectives:
+                self._remove_objective(args[0])
+        elif action == CHANGE_SET_OBJECTIVE:
+            self.objective = args[0]
+        elif action == CHANGE_SET_FLAG_FORMAT:
+            self.flag_format = args[0]
+            self._flag_pattern = None
+        elif action == CHANGE_SET_MACHINES:
+            self.machines = list(args[0])
+        elif action == CHANGE_REVEAL_HINT:
+            level = self._get_hint_index().get(args[0])
+            if level is not None:
+                hint = self.hints[level].peek()
+                if hint is not None and hint.id == args[0]:
+                    self.hints[level].reveal_next()
+        else:
+            raise ValueError(f"Unknown challenge change: {action}")
+    # endregion changes
+
     def get_current_level(self):
         return self.level
 
+    def get_machines(self):
+        """
+        :return: Names of the machines of the challenge, the first one gets the keyboard input by default
+        :rtype: list of str
+        """
+        return list(self.machines) or [self.name]
+
+    def set_machines(self, names):
+        """
+        :param names: VirtualBox machine names, empty for a single machine named after the challenge
+        """
+        self.machines = list(names)
+        self._record(CHANGE_SET_MACHINES, self.machines)
+
     # region hints
-    def _reorder_hints(self, levels: list = []):
-        if not levels:
-            levels = self.hints.keys()
-        for level in levels:
-            temp = list()
-            for i, hint in enumerate(self.hints.get(level)):
-                hint._order = i
-                temp.append(hint)
-            self.hints[level] = temp
+    def _get_hint_index(self):
+        """
+        :return: Level of every hint by hint id, built on first use
+        :rtype: dict
+        """
+        if self._hint_index is None:
+            self._hint_index = {hint.id: level for level, hints in self.hints.items() for hint in hints}
+            self._next_hint_id = max(self._hint_index, default=0) + 1
+        return self._hint_index
+
+    def _get_hint_queue(self, hint_id):
+        try:
+            return self.hints[self._get_hint_index()[hint_id]]
+        except KeyError:
+            raise HintNotFoundError
 
     def create_hint(self, hint_text, level, cost):
-        if level not in self.hints:
-            self.hints[level] = list()
+        """
+        Add a hint at the end of a level, it is revealed after the hints already in that level
+
+        :return: Id of the new hint
+        :rtype: int
+        """
         try:
             hint = Hint(hint_text, level, cost)
-            if hint in self.hints[level]:
-                raise DuplicateHintError
-            self.hints[level].append(hint)
-            self._reorder_hints([level])
         except ValueError:
             raise
+        if any(hint == other for other in self.get_hints(hint.level)):
+            raise DuplicateHintError
+        index = self._get_hint_index()
+        hint.id = self._next_hint_id
+        self._next_hint_id += 1
+        self.hints.setdefault(hint.level, HintQueue()).append(hint)
+        hint.set_owner(self)
+        index[hint.id] = hint.level
+        self._record(CHANGE_SNAPSHOT)
+        return hint.id
 
-    def move_hint_up(self, level, index):
-        if index == 0:
-            raise HintMovementError
-        try:
-            lst = self.hints[level]
-            lst.insert(index-1, lst.pop(index))
-            self.hints[level] = lst
-            self._reorder_hints([level])
-        except (KeyError, IndexError, AttributeError):
-            raise HintNotFoundError
+    def move_hint_up(self, hint_id):
+        self._get_hint_queue(hint_id).move_up(hint_id)
+        self._record(CHANGE_SNAPSHOT)
 
-    def move_hint_down(self, level, index):
-        try:
-            lst = self.hints[level]
-            lst.insert(index, lst.pop(index+1))
-            self.hints[level] = lst
-            self._reorder_hints([level])
-        except (KeyError, AttributeError):
-            raise HintNotFoundError
-        except IndexError:
-            raise HintMovementError
+    def move_hint_down(self, hint_id):
+        self._get_hint_queue(hint_id).move_down(hint_id)
+        self._record(CHANGE_SNAPSHOT)
 
-    def delete_hint(self, level, index):
-        try:
-            self.hints[level].pop(index)
-            self._reorder_hints([level])
-        except (KeyError, IndexError, AttributeError):
-            raise HintNotFoundError
+    def delete_hint(self, hint_id):
+        hints = self._get_hint_queue(hint_id)
+        hint = hints.remove(hint_id)
+        del self._hint_index[hint_id]
+        if not hints:
+            del self.hints[hint.level]
+        self._record(CHANGE_SNAPSHOT)
+
+    def get_hint(self, hint_id):
+        return self._get_hint_queue(hint_id).get(hint_id)
 
     def get_hint_levels(self):
         return self.hints.keys()
 
     def get_hints(self, level):
-        return self.hints.get(level, [])
+        return self.hints.get(level, ())
 
     def reveal_next_hint(self):
-        hints = self.get_hints(self.level)
-        for index, hint in enumerate(hints):
-            if not hint.revealed:
-                hint.revealed = True
-                self.hints[self.level][index] = hint
-                return hint.text
-        else:
+        """
+        Reveal the next hint of the current level
+        Only the revealed hint is recorded, so a store does not have to save the whole challenge
+
+        :return: The hint text, or a message when there are no hints left
+        :rtype: str
+        """
+        hints = self.hints.get(self.level)
+        hint = hints.reveal_next() if hints is not None else None
+        if hint is None:
             return "No hints are available for this level"
+        self._record(CHANGE_REVEAL_HINT, hint.id)
+        return hint.text
     # endregion hints
 
     # region flags
     def create_flag(self, flag_text, level, points_value, description=None, location=None):
-        if self.flags.get(flag_text):
+        if self.flags.get(flag_text) or normalize_flag(flag_text) in self._get_flag_table():
             raise DuplicateFlagError
         flag = Flag(flag_text, level, points_value, description=description, location=location)
-        self.flags[flag.text] = flag
+        self._add_flag(flag)
+        self._record(CHANGE_CREATE_FLAG, flag.text, flag.level, flag.value, description, location)
 
     def delete_flag(self, flag_text):
-        try:
-            del self.flags[flag_text]
-        except KeyError:
+        if flag_text not in self.flags:
             raise FlagNotFoundError
+        self._remove_flag(flag_text)
+        self._record(CHANGE_DELETE_FLAG, flag_text)
 
     def get_flag(self, flag):
         flagobj = self.flags.get(flag)
@@ -122,77 +289,211 @@ class Challenge:
         return sorted(self.flags.values(), key=Flag.get_level)
 
     def set_flag(self, flag):
-        self.flags[flag.text] = flag
+        self._add_flag(flag)
+        self._record(CHANGE_SNAPSHOT)
 
     def _submit_flag(self, username, flag):
         try:
             flagobj = self.get_flag(flag)
+            leaderboard = self._get_leaderboard()
             flagobj.capture(username.lower())
+            leaderboard.add_capture(flagobj.captured, flagobj.value)
             self.flags[flagobj.text] = flagobj
+            self._record(CHANGE_CAPTURE, flagobj.text, flagobj.captured, flagobj.capture_time)
             return flagobj
         except AttributeError:
             raise FlagNotFoundError
         except (FlagNotFoundError, FlagAlreadyCapturedError):
             raise
 
+    def _get_matcher(self):
+        """
+        The flag matcher is rebuilt when flags were added to self.flags directly, such as by a state store
+        """
+        if self._matcher is None or len(self._matcher) != len(self.flags):
+            self._matcher = FlagMatcher(self.flags.keys())
+        return self._matcher
+
+    def _get_flag_table(self):
+        """
+        Normalized flag text -> flag text, for the exact lookups of the strict mode
+        """
+        if self._flag_table is None or len(self._flag_table) != len(self.flags):
+            self._flag_table = {normalize_flag(text): text for text in self.flags.keys()}
+        return self._flag_table
+
+    def _add_flag(self, flag):
+        # Fetch the indexes first, they are rebuilt when they don't match the flags
+        matcher = self._get_matcher()
+        table = self._get_flag_table()
+        leaderboard = self._get_leaderboard()
+        previous = self.flags.get(flag.text)
+        self.flags[flag.text] = flag
+        flag.set_owner(self)
+        matcher.add(flag.text)
+        table[normalize_flag(flag.text)] = flag.text
+        if previous and previous.is_captured():
+            leaderboard.remove_capture(previous.captured, previous.value)
+        if flag.is_captured():
+            leaderboard.add_capture(flag.captured, flag.value)
+
+    def _remove_flag(self, flag_text):
+        matcher = self._get_matcher()
+        table = self._get_flag_table()
+        leaderboard = self._get_leaderboard()
+        flag = self.flags.pop(flag_text)
+        matcher.remove(flag_text)
+        table.pop(normalize_flag(flag_text), None)
+        if flag.is_captured():
+            leaderboard.remove_capture(flag.captured, flag.value)
+
+    def set_flag_format(self, pattern):
+        """
+        Only accept submissions of flags that match a pattern, such as THO{[^}]+}
+
+        :param pattern: Regular expression for the flag syntax, None to match flags anywhere in a message
+        :raises InvalidFlagFormatError: The pattern is not a valid regular expression
+        """
+        if pattern:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise InvalidFlagFormatError(e)
+        self.flag_format = pattern or None
+        self._flag_pattern = None
+        self._record(CHANGE_SET_FLAG_FORMAT, self.flag_format)
+
+    def _find_flags(self, text):
+        """
+        :return: Flag texts found in the submission
+        :rtype: generator of str
+        """
+        if not self.flag_format:
+            yield from self._get_matcher().find(text)
+            return
+        if self._flag_pattern is None:
+            self._flag_pattern = re.compile(self.flag_format)
+        table = self._get_flag_table()
+        for candidate in self._flag_pattern.finditer(text):
+            flag = table.get(normalize_flag(candidate.group(0)))
+            if flag:
+                yield flag
+
     def validate_flag(self, username, text):
-        for flag in self.flags.keys():
-            if flag in text:  # FIXME: Should probably be a bit more picky on the syntax
-                try:
-                    flagobj = self._submit_flag(username, flag)
-                    level = flagobj.get_level()
-                    if self.level < level:
-                        self.level = level
-                        self.update_objective(level)
-                    points = flagobj.get_value()
-                    return (FLAG_CAPTURED_SUCCESSFULLY, points)
-                except FlagAlreadyCapturedError:
-                    return (FLAG_ALREADY_CAPTURED, None)
-                except FlagNotFoundError:
-                    continue
+        already_captured = False
+        for flag in self._find_flags(text):
+            flagobj = self.flags.get(flag)
+            if not flagobj:
+                continue
+            if flagobj.is_captured():
+                # Keep scanning, the message may contain a flag that is still available
+                already_captured = True
+                continue
+            try:
+                flagobj = self._submit_flag(username, flag)
+                self._level_up(flagobj.get_level())
+                points = flagobj.get_value()
+                return (FLAG_CAPTURED_SUCCESSFULLY, points)
+            except FlagAlreadyCapturedError:
+                already_captured = True
+            except FlagNotFoundError:
+                continue
+        if already_captured:
+            return (FLAG_ALREADY_CAPTURED, None)
         return (FLAG_DOES_NOT_EXIST, None)
+
+    def _level_up(self, level):
+        if self.level < level:
+            self.level = level
+            self._update_objective(level)
     # endregion flags
 
     # region leaderboard
+    def _get_leaderboard(self):
+        """
+        The leaderboard is built from the captured flags the first time it is used after loading
+        """
+        if self._leaderboard is None:
+            self._leaderboard = Leaderboard.from_flags(self.flags.values())
+        return self._leaderboard
+
     def get_challenge_points(self, username):
-        total = 0
-        for flag in self.flags.values():
-            if flag.captured == username.lower():
-                total += flag.value
-        return total
+        return self._get_leaderboard().get_points(username.lower())
+
+    def get_rank(self, username):
+        return self._get_leaderboard().get_rank(username.lower())
+
+    def get_leaderboard_scores(self):
+        """
+        :return: username -> points of every user that captured a flag
+        :rtype: dict
+        """
+        return dict(self._get_leaderboard().scores)
 
     def get_leaderboard(self, number):
-        leaderboard = dict()
-        for flag in self.flags.values():
-            if flag.captured:
-                points = leaderboard.get(flag.captured, 0)
-                leaderboard[flag.captured] = flag.value + points
-        leaders = sorted(leaderboard, key=leaderboard.get, reverse=True)
-        return [f"{leaderboard[leaders[i]]} pts: {leaders[i]}" for i in range(min(number, len(leaders)))]
+        return [f"{points} pts: {username}" for username, points in self._get_leaderboard().top(number)]
     # endregion leaderboard
 
     # region objectives
+    def _get_objective_levels(self):
+        """
+        :return: Sorted levels that have an objective, built on first use
+        :rtype: list
+        """
+        if self._objective_levels is None:
+            self._objective_levels = sorted(self.objectives)
+        return self._objective_levels
+
+    def _add_objective(self, objective):
+        levels = self._get_objective_levels()
+        self.objectives[objective.level] = objective
+        objective.set_owner(self)
+        insort(levels, objective.level)
+        self._objective_cache = None
+
+    def _remove_objective(self, level):
+        levels = self._get_objective_levels()
+        del self.objectives[level]
+        del levels[bisect_left(levels, level)]
+        self._objective_cache = None
+
+    def find_objective(self, level):
+        """
+        :return: The objective of the highest level at or below the given level, None if there is none
+        :rtype: core.objects.Objective
+        """
+        levels = self._get_objective_levels()
+        index = bisect_right(levels, level)
+        if not index:
+            return None
+        return self.objectives[levels[index - 1]]
+
     def create_objective(self, objective, level):
         if self.objectives.get(level):
             raise ObjectiveAlreadyExists
-        self.objectives[level] = Objective(objective, level)
+        self._add_objective(Objective(objective, level))
+        self._record(CHANGE_CREATE_OBJECTIVE, objective, level)
 
     def delete_objective(self, level):
-        try:
-            del self.objectives[level]
-        except KeyError:
-            pass
+        if level in self.objectives:
+            self._remove_objective(level)
+            self._record(CHANGE_DELETE_OBJECTIVE, level)
 
     def get_objectives(self):
-        return sorted(self.objectives.values(), key=Objective.get_level)
+        return [self.objectives[level] for level in self._get_objective_levels()]
 
     def get_current_objective(self):
+        """
+        :return: The objective override, or the objective of the current level. None if neither is set
+        :rtype: str
+        """
         if self.objective:
             return self.objective
-        try:
-            return self.objectives.get(self.get_current_level()).text
-        except AttributeError:
-            return None
+        level = self.get_current_level()
+        if self._objective_cache is None or self._objective_cache[0] != level:
+            objective = self.find_objective(level)
+            self._objective_cache = (level, objective.text if objective else None)
+        return self._objective_cache[1]
 
     def set_current_objective(self, text):
         """
@@ -201,12 +502,14 @@ class Challenge:
         :param text: The objective text
         """
         self.objective = text
+        self._record(CHANGE_SET_OBJECTIVE, text)
 
     def update_objective(self, level):
-        while level >= 0:
-            objective = self.objectives.get(level)
-            if objective:
-                self.objective = objective.text
-                break
-            level -= 1
+        self._update_objective(level)
+        self._record(CHANGE_SET_OBJECTIVE, self.objective)
+
+    def _update_objective(self, level):
+        objective = self.find_objective(level)
+        if objective:
+            self.objective = objective.text
     # endregion objectives
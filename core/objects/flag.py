@@ -3,14 +3,24 @@
 # 2020 - Frank Godo
 
 import time
+import unicodedata
+from core.objects.tracked import Tracked
 from core.exceptions import FlagAlreadyCapturedError
 
 FLAG_DOES_NOT_EXIST = -1
 FLAG_ALREADY_CAPTURED = 0
 FLAG_CAPTURED_SUCCESSFULLY = 1
+FLAG_SUBMISSION_THROTTLED = -2
 
 
-class Flag:
+def normalize_flag(text):
+    """
+    Normalize a flag for exact lookups, so lookalike characters and surrounding whitespace from chat still match
+    """
+    return unicodedata.normalize('NFKC', text).strip()
+
+
+class Flag(Tracked):
     def __init__(self, flag_text, level, points_value, description=None, location=None):
         """
         Flag located on a challenge
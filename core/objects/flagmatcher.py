@@ -0,0 +1,101 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+from collections import deque
+
+
+class FlagMatcher:
+    def __init__(self, patterns=()):
+        """
+        Aho-Corasick automaton finding every flag contained in a message in a single pass
+
+        Patterns are added to the trie as they are created, the failure links are
+        rebuilt on the next search after an addition. Removed patterns are only
+        unmarked, so a removal never requires a rebuild.
+
+        :param patterns: (optional) Initial flag texts
+        """
+        self._goto = [dict()]
+        self._fail = [0]
+        # Pattern ending at a node, and the nearest node on the failure path with a pattern
+        self._terminal = [None]
+        self._output = [0]
+        self._patterns = set()
+        self._stale = False
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __contains__(self, pattern):
+        return pattern in self._patterns
+
+    def add(self, pattern):
+        if not pattern or pattern in self._patterns:
+            return
+        node = 0
+        for char in pattern:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append(dict())
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._output.append(0)
+                self._goto[node][char] = child
+            node = child
+        self._terminal[node] = pattern
+        self._patterns.add(pattern)
+        self._stale = True
+
+    def remove(self, pattern):
+        if pattern not in self._patterns:
+            return
+        node = 0
+        for char in pattern:
+            node = self._goto[node][char]
+        self._terminal[node] = None
+        self._patterns.discard(pattern)
+
+    def _build(self):
+        goto, fail, terminal, output = self._goto, self._fail, self._terminal, self._output
+        queue = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            output[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                fail[child] = state
+                output[child] = state if terminal[state] is not None else output[state]
+                queue.append(child)
+        self._stale = False
+
+    def find(self, text):
+        """
+        Scan a message once for flags
+
+        :param text: The submitted message
+        :return: Flag texts in the order they end in the message, repeated flags are yielded again
+        :rtype: generator of str
+        """
+        if self._stale:
+            self._build()
+        goto, fail, terminal, output = self._goto, self._fail, self._terminal, self._output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            match = node if terminal[node] is not None else output[node]
+            while match:
+                if terminal[match] is not None:
+                    yield terminal[match]
+                match = output[match]
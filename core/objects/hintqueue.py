@@ -0,0 +1,170 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+from core.exceptions import HintNotFoundError, DuplicateHintError, HintMovementError
+
+
+class HintQueue:
+    def __init__(self, hints=()):
+        """
+        The hints of one level, in the order they are revealed
+        Kept as a linked list addressed by hint id, with a cursor on the next hint to reveal.
+        Revealed hints always come before the hints that are still hidden
+
+        :param hints: (optional) Hint objects with an id, revealed hints are moved ahead of hidden ones
+        """
+        self._hints = dict()
+        self._prev = dict()
+        self._next = dict()
+        self._head = None
+        self._tail = None
+        # Id of the first hidden hint, None when every hint has been revealed
+        self._cursor = None
+        for hint in sorted(hints, key=lambda h: not h.revealed):
+            self.append(hint)
+
+    def __len__(self):
+        return len(self._hints)
+
+    def __contains__(self, hint_id):
+        return hint_id in self._hints
+
+    def __iter__(self):
+        hint_id = self._head
+        while hint_id is not None:
+            yield self._hints[hint_id]
+            hint_id = self._next[hint_id]
+
+    def get(self, hint_id):
+        try:
+            return self._hints[hint_id]
+        except KeyError:
+            raise HintNotFoundError
+
+    def _link(self, hint_id, prev_id, next_id):
+        self._prev[hint_id] = prev_id
+        self._next[hint_id] = next_id
+        if prev_id is None:
+            self._head = hint_id
+        else:
+            self._next[prev_id] = hint_id
+        if next_id is None:
+            self._tail = hint_id
+        else:
+            self._prev[next_id] = hint_id
+
+    def _unlink(self, hint_id):
+        prev_id = self._prev.pop(hint_id)
+        next_id = self._next.pop(hint_id)
+        if prev_id is None:
+            self._head = next_id
+        else:
+            self._next[prev_id] = next_id
+        if next_id is None:
+            self._tail = prev_id
+        else:
+            self._prev[next_id] = prev_id
+        return prev_id, next_id
+
+    def append(self, hint):
+        """
+        Add a hint at the end of the queue, a revealed hint is placed after the other revealed hints
+        """
+        if hint.id in self._hints:
+            raise DuplicateHintError
+        self._hints[hint.id] = hint
+        if not hint.revealed:
+            self._link(hint.id, self._tail, None)
+            if self._cursor is None:
+                self._cursor = hint.id
+        elif self._cursor is None:
+            self._link(hint.id, self._tail, None)
+        else:
+            self._link(hint.id, self._prev[self._cursor], self._cursor)
+
+    def remove(self, hint_id):
+        """
+        :return: The removed hint
+        :raises HintNotFoundError: The hint is not in this queue
+        """
+        hint = self.get(hint_id)
+        _, next_id = self._unlink(hint_id)
+        del self._hints[hint_id]
+        if self._cursor == hint_id:
+            self._cursor = next_id
+        return hint
+
+    def _swap(self, first, second):
+        """
+        Swap two neighbouring hints, first being directly before second
+        """
+        if self._hints[first].revealed != self._hints[second].revealed:
+            # A hidden hint can not be moved ahead of a revealed one
+            raise HintMovementError
+        prev_id = self._prev[first]
+        next_id = self._next[second]
+        self._link(second, prev_id, first)
+        self._link(first, second, next_id)
+        if self._cursor == first:
+            self._cursor = second
+
+    def move_up(self, hint_id):
+        """
+        :raises HintMovementError: The hint is first, or directly after the last revealed hint
+        """
+        self.get(hint_id)
+        prev_id = self._prev[hint_id]
+        if prev_id is None:
+            raise HintMovementError
+        self._swap(prev_id, hint_id)
+
+    def move_down(self, hint_id):
+        """
+        :raises HintMovementError: The hint is last, or it is the last revealed hint
+        """
+        self.get(hint_id)
+        next_id = self._next[hint_id]
+        if next_id is None:
+            raise HintMovementError
+        self._swap(hint_id, next_id)
+
+    def peek(self):
+        """
+        :return: The next hint to reveal, None when every hint has been revealed
+        """
+        if self._cursor is None:
+            return None
+        return self._hints[self._cursor]
+
+    def reveal_next(self):
+        """
+        Reveal the hint under the cursor and move the cursor to the next one
+
+        :return: The revealed hint, None when every hint has been revealed
+        """
+        hint = self.peek()
+        if hint is not None:
+            hint.revealed = True
+            self._cursor = self._next[hint.id]
+        return hint
+
+
+def build_hint_queues(hints):
+    """
+    Group loaded hints into one queue per level, hints stored without an id are given a new one
+
+    :param hints: Level -> Hint objects in the order they are revealed
+    :return: Level -> HintQueue
+    :rtype: dict
+    """
+    hint_ids = [getattr(hint, 'id', None) for level_hints in hints.values() for hint in level_hints]
+    next_id = max((hint_id for hint_id in hint_ids if hint_id is not None), default=0) + 1
+    queues = dict()
+    for level, level_hints in hints.items():
+        for hint in level_hints:
+            if getattr(hint, 'id', None) is None:
+                hint.id = next_id
+                next_id += 1
+        queues[level] = HintQueue(level_hints)
+    return queues
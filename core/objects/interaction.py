@@ -2,14 +2,17 @@
 # "Twitch Hacks Online"
 # 2020 - Frank Godo
 
+import time
+
 
 class Interaction:
-    def __init__(self, username, raw_input, action, profile, challenge):
+    def __init__(self, username, raw_input, action, profile, challenge, timestamp=None):
         self.username = username
         self.raw_input = raw_input
         self.action = action
         self.profile_id = profile
         self.challenge_id = challenge
+        self.timestamp = timestamp if timestamp is not None else time.time()
 
     def __str__(self):
         return self.action
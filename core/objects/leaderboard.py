@@ -0,0 +1,99 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    def __init__(self):
+        """
+        Points per user, with a ranking that is kept sorted as flags are captured
+        """
+        self.scores = dict()
+        self._captures = dict()
+        # Sorted (-points, username) entries, best first. Updates and rank lookups are O(log n)
+        self._ranking = SortedList()
+
+    def __len__(self):
+        return len(self.scores)
+
+    @classmethod
+    def from_scores(cls, scores):
+        """
+        Build a leaderboard from known points, sorting the ranking once
+
+        :param scores: username -> points
+        """
+        leaderboard = cls()
+        leaderboard.scores = dict(scores)
+        leaderboard._ranking = SortedList((-points, username) for username, points in leaderboard.scores.items())
+        return leaderboard
+
+    @classmethod
+    def from_flags(cls, flags):
+        """
+        Build the leaderboard from the captured flags of a challenge
+
+        :param flags: Flag objects
+        """
+        scores = dict()
+        captures = dict()
+        for flag in flags:
+            if flag.is_captured():
+                scores[flag.captured] = scores.get(flag.captured, 0) + flag.value
+                captures[flag.captured] = captures.get(flag.captured, 0) + 1
+        leaderboard = cls.from_scores(scores)
+        leaderboard._captures = captures
+        return leaderboard
+
+    def set_points(self, username, points):
+        """
+        Replace the points of a user
+
+        :param points: New points of the user, None removes the user from the leaderboard
+        """
+        previous = self.scores.get(username)
+        if previous is not None:
+            self._ranking.remove((-previous, username))
+        if points is None:
+            self.scores.pop(username, None)
+        else:
+            self.scores[username] = points
+            self._ranking.add((-points, username))
+
+    def _update(self, username, points, captures):
+        count = self._captures.get(username, 0) + captures
+        if count > 0:
+            self._captures[username] = count
+            self.set_points(username, self.scores.get(username, 0) + points)
+        else:
+            self._captures.pop(username, None)
+            self.set_points(username, None)
+
+    def add_capture(self, username, points):
+        self._update(username, points, 1)
+
+    def remove_capture(self, username, points):
+        if username in self.scores:
+            self._update(username, -points, -1)
+
+    def get_points(self, username):
+        return self.scores.get(username, 0)
+
+    def get_rank(self, username):
+        """
+        :return: Position of the user, users with the same points share a position. None for users without points
+        :rtype: int
+        """
+        points = self.scores.get(username)
+        if points is None:
+            return None
+        return self._ranking.bisect_left((-points,)) + 1
+
+    def top(self, number):
+        """
+        :return: Username and points of the best users
+        :rtype: list of tuples
+        """
+        return [(username, -points) for points, username in self._ranking.islice(0, number)]
@@ -2,8 +2,10 @@
 # "Twitch Hacks Online"
 # 2020 - Frank Godo
 
+from core.objects.tracked import Tracked
 
-class Objective:
+
+class Objective(Tracked):
     def __init__(self, objective_text, level):
         self.text = objective_text
         try:
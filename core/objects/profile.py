@@ -5,11 +5,13 @@
 import logging
 from core.objects.user import User
 from core.objects.token import Token
+from core.objects.tracked import Tracked
+from core.objects.usertable import UserTable
 
 logger = logging.getLogger(__name__)
 
 
-class Profile:
+class Profile(Tracked):
     def __init__(self, id, channel, bot=None, client_id=None):
         """
         Twitch channel and API profile
@@ -26,7 +28,7 @@ class Profile:
         if bot and bot != channel:
             self.bot_name = bot
             self.superusers.add(bot)
-        self.users = dict()
+        self.users = UserTable()
         # Twitch application (API)
         self.client_id = client_id
         self.tokens = dict()
@@ -43,20 +45,6 @@ class Profile:
             return f'{self.bot_name} on {self.channel_name}'
         return self.channel_name
 
-    def _convert_profile(self):
-        if not hasattr(self, 'tokens'):
-            self.tokens = dict()
-            if hasattr(self, 'irc_token') and self.irc_token:
-                irc_token = Token('irc')
-                irc_token.token = self.irc_token
-                self.tokens['irc'] = irc_token
-                del self.irc_token
-            if hasattr(self, 'api_token') and self.api_token:
-                api_token = Token('api')
-                api_token.token = self.api_token
-                self.tokens['api'] = api_token
-                del self.api_token
-
     def verify_tokens(self):
         """
         Verify all the tokens saved in the tokens dict
@@ -90,12 +78,12 @@ class Profile:
                 self.tokens.get(key).generate()
             except AttributeError:
                 raise
+        self.touch()
 
     def check(self):
         """
         Do a check of the profile for token validity etc.
         """
-        self._convert_profile()  # Convert old profile versions automatically
         expired = self.verify_tokens()
         if expired:
             self.renew_tokens(*expired)
@@ -108,7 +96,21 @@ class Profile:
         types = ['api']
         if self.bot_name:
             types.append('irc')
-        self.renew_tokens(types)
+        for key in types:
+            if key not in self.tokens:
+                self.tokens[key] = Token(key)
+        self.renew_tokens(*types)
+
+    def has_changes(self):
+        """
+        :return: The profile or any of its users has been modified since it was saved
+        :rtype: Boolean
+        """
+        if self.is_dirty():
+            return True
+        if isinstance(self.users, UserTable):
+            return self.users.has_changed()
+        return any(user.is_dirty() for user in self.users.values())
 
     def add_new_user(self, user):
         """
@@ -161,6 +163,35 @@ class Profile:
                 self.users[username] = new_user
         logger.info("Added %s to deny list", usernames)
 
+    def set_team(self, usernames, team):
+        """
+        Move users to a team
+
+        :param usernames: list of usernames
+        :param team: Team name, None removes the users from their team
+        :return: username -> the team the user was on
+        :rtype: dict
+        """
+        logger.debug("Setting team %s on users: %s", team, usernames)
+        previous = dict()
+        for username in usernames:
+            username = username.lower()
+            user = self.users.get(username)
+            if not user:
+                user = User(username, client_id=self.client_id, channel_id=self.channel_id)
+            previous[username] = user.team
+            if user.team != team or username not in self.users:
+                user.team = team
+                self.users[username] = user
+        logger.info("Set team %s on %s", team, usernames)
+        return previous
+
+    def get_team(self, username):
+        user = self.users.get(username.lower())
+        if user:
+            return user.team
+        return None
+
     def reset_interact(self, usernames):
         """
         Resets allowed/denied users to default
@@ -176,5 +207,5 @@ class Profile:
                 self.users[username] = user
             else:
                 new_user = User(username, client_id=self.client_id, channel_id=self.channel_id)
-                self.users[user] = new_user
+                self.users[username] = new_user
         logger.info("Reset interact property for: %s", usernames)
@@ -0,0 +1,93 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+from core.objects.leaderboard import Leaderboard
+
+
+class SeasonIndex:
+    def __init__(self, id):
+        """
+        Points of every user across all challenges played on a profile
+        Kept up to date on every capture, so season rankings never need the challenges to be loaded
+
+        :param id: Id of the profile the season belongs to
+        """
+        self.id = id
+        # Challenge id -> username -> points
+        self.challenges = dict()
+        self._totals = Leaderboard()
+        self._changes = set()
+
+    def __getstate__(self):
+        return {'id': self.id, 'challenges': self.challenges}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        totals = dict()
+        for scores in self.challenges.values():
+            for username, points in scores.items():
+                totals[username] = totals.get(username, 0) + points
+        self._totals = Leaderboard.from_scores(totals)
+        self._changes = set()
+
+    def __len__(self):
+        return len(self._totals)
+
+    def set_points(self, challenge_id, username, points):
+        """
+        Update the points a user has in a challenge
+
+        :param points: Points in the challenge, None when the user has none
+        :return: The points were changed
+        :rtype: Boolean
+        """
+        scores = self.challenges.setdefault(challenge_id, dict())
+        previous = scores.get(username)
+        if points == previous:
+            return False
+        if points is None:
+            del scores[username]
+            if not scores:
+                del self.challenges[challenge_id]
+        else:
+            scores[username] = points
+        total = self._totals.get_points(username) - (previous or 0) + (points or 0)
+        if not any(username in scores for scores in self.challenges.values()):
+            total = None
+        self._totals.set_points(username, total)
+        self._changes.add((challenge_id, username))
+        return True
+
+    def set_challenge(self, challenge_id, scores):
+        """
+        Replace the points of every user in a challenge
+
+        :param scores: username -> points
+        :return: Any points were changed
+        :rtype: Boolean
+        """
+        changed = False
+        for username in set(self.challenges.get(challenge_id, dict())) | set(scores):
+            changed |= self.set_points(challenge_id, username, scores.get(username))
+        return changed
+
+    def pop_changes(self):
+        """
+        Fetch and clear the entries changed since the last call
+
+        :return: Challenge id, username and points, points are None for removed entries
+        :rtype: list of tuples
+        """
+        changes, self._changes = self._changes, set()
+        return [(challenge_id, username, self.challenges.get(challenge_id, dict()).get(username))
+                for challenge_id, username in changes]
+
+    def get_points(self, username):
+        return self._totals.get_points(username.lower())
+
+    def get_rank(self, username):
+        return self._totals.get_rank(username.lower())
+
+    def top(self, number):
+        return self._totals.top(number)
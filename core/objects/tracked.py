@@ -0,0 +1,63 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+from itertools import count
+
+# Shared by all tracked objects, so revisions of different objects can be compared
+_revisions = count(1)
+
+
+class Tracked:
+    """
+    Base class for objects that keep track of when they were last modified
+    Every assignment to a public attribute gives the object a new revision,
+    so a state store can skip objects that have not changed since they were saved.
+    An object kept inside another one, such as a flag in a challenge, gives its owner a new revision as well
+    """
+    _revision = 0
+    _saved_revision = 0
+    _owner = None
+    # Loaded from an older format, the object has to be written again in the current one
+    _upgraded = False
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if not name.startswith('_'):
+            self.touch()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_revision', None)
+        state.pop('_saved_revision', None)
+        state.pop('_owner', None)
+        return state
+
+    def touch(self):
+        """
+        Mark the object as modified, for changes made inside mutable attributes
+        """
+        self._revision = next(_revisions)
+        if self._owner is not None:
+            self._owner.touch()
+
+    def set_owner(self, owner):
+        """
+        :param owner: Tracked object that is touched whenever this object changes
+        """
+        self._owner = owner
+
+    def get_revision(self):
+        return self._revision
+
+    def is_dirty(self):
+        return self.get_revision() > self._saved_revision
+
+    def mark_clean(self, revision=None):
+        """
+        Mark the object as saved
+
+        :param revision: (optional) The revision that was saved, changes made after it keep the object dirty
+        """
+        self._saved_revision = self.get_revision() if revision is None else revision
+        self._upgraded = False
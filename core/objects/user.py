@@ -3,9 +3,10 @@
 # 2020 - Frank Godo
 
 from core import settings
+from core.objects.tracked import Tracked
 
 
-class ExtraUserInfo:
+class ExtraUserInfo(Tracked):
     def __init__(self, superuser, moderator):
         self.user_id = 0
         self.superuser = superuser
@@ -15,7 +16,7 @@ class ExtraUserInfo:
         self.cheered = 0
 
 
-class User:
+class User(Tracked):
     def __init__(self, name, superuser=False, moderator=False, client_id=None, channel_id=None):
         self.name = name
         self.interact = None
@@ -34,6 +35,11 @@ class User:
         else:
             return self.name
 
+    def get_revision(self):
+        if self.extra:
+            return max(self._revision, self.extra.get_revision())
+        return self._revision
+
     def fetch_data(self, client_id, channel_id):
         """
         Fetch extra data from Twitch API using client_id
@@ -0,0 +1,102 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import zlib
+import threading
+from collections.abc import MutableMapping
+
+DEFAULT_SHARDS = 64
+
+
+class UserTable(MutableMapping):
+    def __init__(self, shards=DEFAULT_SHARDS, loader=None):
+        """
+        Users of a profile, split into shards by a hash of the username
+        Shards are loaded on first access, and shards with changed users are tracked until they are saved
+
+        :param shards: Number of shards
+        :param loader: (optional) Callable returning the users dict of a shard index
+        """
+        self.shards = shards
+        self.loader = loader
+        self._shards = dict()
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<UserTable {len(self._shards)}/{self.shards} shards loaded, {len(self._dirty)} changed>"
+
+    @classmethod
+    def from_dict(cls, users, shards=DEFAULT_SHARDS):
+        """
+        Create a fully loaded table, with every shard marked as changed
+        """
+        table = cls(shards)
+        table._shards = {index: dict() for index in range(shards)}
+        for name, user in users.items():
+            table._shards[table.shard_of(name)][name] = user
+        table._dirty = set(range(shards))
+        return table
+
+    def shard_of(self, username):
+        return zlib.crc32(username.encode('utf-8')) % self.shards
+
+    def get_shard(self, index):
+        shard = self._shards.get(index)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.get(index)
+                if shard is None:
+                    shard = self.loader(index) if self.loader else dict()
+                    self._shards[index] = shard
+        return shard
+
+    def __getitem__(self, username):
+        return self.get_shard(self.shard_of(username))[username]
+
+    def __setitem__(self, username, user):
+        index = self.shard_of(username)
+        self.get_shard(index)[username] = user
+        self._dirty.add(index)
+
+    def __delitem__(self, username):
+        index = self.shard_of(username)
+        del self.get_shard(index)[username]
+        self._dirty.add(index)
+
+    def __contains__(self, username):
+        return username in self.get_shard(self.shard_of(username))
+
+    def __iter__(self):
+        for index in range(self.shards):
+            yield from list(self.get_shard(index))
+
+    def __len__(self):
+        return sum(len(self.get_shard(index)) for index in range(self.shards))
+
+    def mark_changed(self, username):
+        """
+        Mark the shard of a user that has been modified in place
+        """
+        self._dirty.add(self.shard_of(username))
+
+    def has_changed(self):
+        return bool(self._dirty)
+
+    def pop_changed(self):
+        """
+        Fetch the changed shards and stop tracking them
+
+        :return: Shard index -> users dict
+        :rtype: dict
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return {index: self._shards[index] for index in dirty if index in self._shards}
+
+    def restore_changed(self, indexes):
+        """
+        Track shards as changed again, after they could not be saved
+        """
+        self._dirty.update(indexes)
@@ -6,11 +6,27 @@ import logging
 
 MAX_FREEBIES = 10
 PRESS_DELAY = 50
+VIRTUALBOX_STANDBY_COUNT = 0  # booted linked clones kept ready per machine for instant restores, 0 disables
+INPUT_QUEUE_SIZE = 100  # keyboard input jobs waiting per challenge
+KEYMAP_CACHE_SIZE = 1024  # compiled commands kept, 0 disables the cache
+INPUT_COALESCE_WINDOW = 0  # ms, input arriving within the window is sent in one call, None disables merging
 DEFAULT_OBJECTIVE = "Escalate privileges in order to gain full control of the system"
 DEFAULT_PROFILE = 3
+FLAG_SUBMISSION_RATE = 0.2  # submissions per second and user
+FLAG_SUBMISSION_BURST = 5
+FLAG_REJECTED_CACHE_SIZE = 10000  # rejected submissions remembered, 0 disables the cache
 
 STATE_MIDDLEWARE = 'core.state.filestore.FileStore'
+# STATE_MIDDLEWARE = 'core.state.database.DatabaseStore'
+STATE_WRITER_QUEUE_SIZE = 1000
 # FILE_STORE_PATH = '.'
+FILE_STORE_JOURNAL = True
+FILE_STORE_JOURNAL_LIMIT = 100
+FILE_STORE_COMMIT_WINDOW = 200  # ms
+FILE_STORE_COMPRESS = False
+INTERACTION_LOG_ROTATE_SIZE = 16 * 1024 * 1024  # bytes
+INTERACTION_LOG_KEEP = 0  # segments, 0 keeps all
+# DATABASE_PATH = 'twitchbot.db'
 
 # Logging
 LOG_FILE = 'twitchbot.log'
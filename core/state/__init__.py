@@ -6,37 +6,68 @@ import time
 import logging
 from importlib import import_module
 from core import settings
-from core.vm.virtualbox import VirtualBoxSrv
-from core.objects.flag import FLAG_CAPTURED_SUCCESSFULLY
+from core.state.writer import StoreWriter
+from core.state.active import ActiveChallenge, make_prefix
+from core.state.submissions import SubmissionGuard
+from core.objects.flag import FLAG_CAPTURED_SUCCESSFULLY, FLAG_SUBMISSION_THROTTLED
+from core.objects.interaction import Interaction
+from core.objects.leaderboard import Leaderboard
 from bots.twitch import TwitchBot
 from core.exceptions import ProfileNotFoundError, ChallengeNotFoundError,\
-    NoProfileSelectedError, NoChallengeSelectedError, BoxNotInitializedError,\
-    BoxNotRunningError, BoxAlreadyRunningError, DuplicateFlagError, FlagNotFoundError,\
+    NoProfileSelectedError, NoChallengeSelectedError,\
+    BoxNotRunningError, DuplicateFlagError, FlagNotFoundError,\
     ObjectiveAlreadyExists, HintNotFoundError, HintMovementError
 
 logger = logging.getLogger(__name__)
 
+# Chat arguments starting with this pick the challenge a command is for, such as '!type #web ls'
+ROUTE_PREFIX = '#'
+
 
 class State:
     def __init__(self):
         self.profile = None
-        self.challenge = None
+        # Challenge id -> ActiveChallenge, every challenge that is being played
+        self.challenges = dict()
+        # Username -> id of the challenge the user plays
+        self.assignments = dict()
+        self._selected = None
+        self.season = None
+        self.submissions = SubmissionGuard()
         self.twitchbot = None
         self.hotseat = None
         self.hotseat_expiry = None
-        self.box = None
         self.press_delay = 0
         if hasattr(settings, 'PRESS_DELAY') and settings.PRESS_DELAY:
             self.press_delay = settings.PRESS_DELAY
         # Load values from the selected state store
         self.load_store(settings.STATE_MIDDLEWARE)
 
+    @property
+    def challenge(self):
+        """
+        The selected challenge, the one configured from the console and played when chat does not pick one
+        """
+        active = self.challenges.get(self._selected)
+        return active.challenge if active else None
+
+    @property
+    def box(self):
+        active = self.challenges.get(self._selected)
+        return active.box if active else None
+
+    @property
+    def teams(self):
+        active = self.challenges.get(self._selected)
+        return active.teams if active else None
+
     def load_store(self, middleware):
         parts = middleware.split('.')
         module_path = '.'.join(parts[:-1])
         klass = parts[-1]
         module = import_module(module_path)  # noqa: F841
         self.store = eval(f'module.{klass}')()
+        self.writer = StoreWriter(self.store)
         if hasattr(settings, 'DEFAULT_PROFILE') and settings.DEFAULT_PROFILE:
             profile_id = settings.DEFAULT_PROFILE
             try:
@@ -45,17 +76,23 @@ class State:
                 logger.error("The default profile does not exist")
 
     def cleanup(self, discard=False):
-        if self.box:
-            self.box.cleanup()
-        if self.challenge:
+        for active in self.challenges.values():
+            active.cleanup()
             if not discard:
-                self.store.save_challenge(self.challenge)
-            self.challenge = None
+                self.writer.save_challenge(active.challenge)
+        self.challenges = dict()
+        self.assignments = dict()
+        self._selected = None
         if self.profile:
             self.disconnect_twitch()
             if not discard:
-                self.store.save_profile(self.profile)
+                self.writer.save_profile(self.profile)
             self.profile = None
+        if self.season is not None:
+            if not discard:
+                self.writer.save_season(self.season)
+            self.season = None
+        self.writer.flush()
 
     def get_status(self):
         if not self.profile:
@@ -77,9 +114,11 @@ class State:
     def load_profile(self, profile_id, discard=False):
         if self.profile:
             self.cleanup(discard)
+        self.writer.flush()
         self.profile = self.store.load_profile(profile_id)
         if not self.profile:
             raise ProfileNotFoundError
+        self.season = self.store.load_season(self.profile.id)
         self.profile.check()
         if self.profile.challenge:
             try:
@@ -93,7 +132,7 @@ class State:
         if not self.profile:
             raise NoProfileSelectedError
         if self.store:
-            self.store.save_profile(self.profile)
+            self.writer.save_profile(self.profile)
 
     def get_api_token(self):
         if not self.profile:
@@ -105,8 +144,19 @@ class State:
             raise NoProfileSelectedError
         return self.profile.tokens.get('irc')
 
-    def new_interaction(self, interaction):
-        pass
+    def new_interaction(self, username, raw_input, action, challenge_id=None):
+        """
+        Record what a user sent to the challenge
+
+        :param username: The user that interacted
+        :param raw_input: The message as it was typed in chat
+        :param action: What was done with it, such as 'type' or 'press'
+        :param challenge_id: (optional) The challenge it was sent to, the selected challenge by default
+        """
+        profile_id = self.profile.id if self.profile else None
+        if challenge_id is None:
+            challenge_id = self._selected
+        self.writer.save_interaction(Interaction(username, raw_input, action, profile_id, challenge_id))
 
     def new_subscription(self, username, total_months):
         pass
@@ -141,20 +191,29 @@ class State:
                 self.hotseat = None
         return self.hotseat
 
+    def _update_users(self, usernames):
+        for username in usernames:
+            user = self.profile.users.get(username.lower())
+            if user:
+                self.writer.update_user(user)
+
     def allow_users(self, users):
         if not self.profile:
             raise NoProfileSelectedError
         self.profile.set_allowed_users(users)
+        self._update_users(users)
 
     def deny_users(self, users):
         if not self.profile:
             raise NoProfileSelectedError
         self.profile.set_denied_users(users)
+        self._update_users(users)
 
     def reset_users(self, users):
         if not self.profile:
             raise NoProfileSelectedError
-        self.profile.reset_users(users)
+        self.profile.reset_interact(users)
+        self._update_users(users)
 
     def allow_interaction(self, user):
         if not self.profile:
@@ -163,6 +222,7 @@ class State:
         hotseat = self.get_hotseat()
         if username not in self.profile.users.keys():
             self.profile.add_new_user(user)
+            self.writer.update_user(self.profile.users[username])
         if username in self.profile.superusers or user.is_mod:
             return (True, None)
         elif hotseat and username != hotseat.lower():
@@ -180,15 +240,11 @@ class State:
         # MAYBE: Use API to mark redemption as completed/rejected
         pass
 
-    def get_press_delay(self):
-        if not self.box:
-            raise BoxNotInitializedError
-        return self.box.get_delay()
+    def get_press_delay(self, challenge_id=None):
+        return self._get_active(challenge_id).get_press_delay()
 
-    def set_press_delay(self, delay, expiration=None):
-        if not self.box:
-            raise BoxNotInitializedError
-        self.box.set_delay(delay, expiration=expiration)
+    def set_press_delay(self, delay, expiration=None, challenge_id=None):
+        self._get_active(challenge_id).set_press_delay(delay, expiration=expiration)
     # endregion profile
 
     # region challenge
@@ -201,15 +257,22 @@ class State:
         return challenge
 
     def load_challenge(self, challenge_id):
-        self.challenge = self.store.load_challenge(challenge_id)
-        self.initialize_box()
+        """
+        Load a challenge as the selected challenge, in place of the previously selected one
+        Other active challenges keep running
+        """
+        previous = self._selected
+        active = self.activate_challenge(challenge_id)
+        self._selected = active.challenge.id
+        if previous is not None and previous != self._selected:
+            self.deactivate_challenge(previous)
         if self.twitchbot:
             # TODO: Update the channel description
             pass
-        return self.challenge
+        return active.challenge
 
-    def save_challenge(self):
-        self.store.save_challenge(self.challenge)
+    def save_challenge(self, challenge_id=None):
+        self.writer.save_challenge(self._get_active(challenge_id).challenge)
 
     def select_challenge(self, challenge_id):
         if not self.profile:
@@ -222,93 +285,81 @@ class State:
             return None
         return challenge
 
-    def initialize_box(self):
-        if self.box:
-            self.box.cleanup()
-            self.box = None
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        try:
-            self.box = VirtualBoxSrv(self.challenge.name, self.press_delay)
-        except ChallengeNotFoundError:
-            logger.error("The challenge '%s' is not configured correctly. VM client not found", self.challenge)
-            self.box = None
+    def initialize_box(self, challenge_id=None):
+        self._get_active(challenge_id).initialize_box()
 
     def challenge_status(self):
-        if not self.profile or not self.profile.challenge:
+        if not self.challenges and (not self.profile or not self.profile.challenge):
             return "No challenge selected"
-        elif not self.challenge:
+        elif not self.challenges:
             return "Challenge not loaded"
-        elif not self.box:
-            return f"Challenge '{self.challenge.name}' not initialized"
-        elif self.box.is_running():
-            return f"Challenge '{self.challenge.name}' is running"
-        else:
-            return f"Challenge '{self.challenge.name}' is not running"
+        return "\n".join(active.status() for active in self.challenges.values())
 
-    def start_challenge(self, restore=False):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        if not self.box:
-            raise BoxNotInitializedError
-        try:
-            if restore:
-                self.box.restore()
-            self.box.launch()
-        except BoxAlreadyRunningError:
-            pass
+    def start_challenge(self, restore=False, challenge_id=None):
+        self._get_active(challenge_id).start(restore=restore)
 
-    def snapshot_challenge(self, username):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        if not self.box:
-            raise BoxNotInitializedError
-        self.box.snapshot(username)
+    def restore_challenge(self, challenge_id=None):
+        """
+        :return: A warm standby took over, instead of restoring and booting the challenge
+        :rtype: bool
+        """
+        return self._get_active(challenge_id).restore()
 
-    def stop_challenge(self, save=True):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        if not self.box:
-            raise BoxNotInitializedError
-        try:
-            self.box.shut_down(save)
-        except BoxNotRunningError:
-            pass
+    def snapshot_challenge(self, username, challenge_id=None):
+        self._get_active(challenge_id).snapshot(username)
 
-    def get_special_keys(self):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        if not self.box:
-            raise BoxNotInitializedError
-        return self.box.get_special_keys()
+    def stop_challenge(self, save=True, challenge_id=None):
+        self._get_active(challenge_id).stop(save)
+
+    def set_challenge_machines(self, names):
+        """
+        Run the selected challenge on several machines, such as an attacker box and its targets
 
-    def send_keys(self, keys):
+        :param names: VirtualBox machine names, the first one gets the keyboard input
+        """
         if not self.challenge:
             raise NoChallengeSelectedError
-        if not self.box:
-            raise BoxNotInitializedError
+        self.challenge.set_machines(names)
+        self.save_challenge()
+        self.initialize_box()
+
+    def get_machines(self, challenge_id=None):
+        return self._get_active(challenge_id).get_machines()
+
+    def select_machine(self, name, challenge_id=None):
+        self._get_active(challenge_id).select_machine(name)
+
+    def get_special_keys(self, challenge_id=None):
+        return self._get_active(challenge_id).get_special_keys()
+
+    def send_keys(self, keys, challenge_id=None, username=None):
         try:
-            return self.box.send(keys)
+            return self._get_active(challenge_id).send_keys(keys, username)
         except BoxNotRunningError:
             raise
 
-    def type_text(self, text):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        if not self.box:
-            raise BoxNotInitializedError
+    def type_text(self, text, challenge_id=None, username=None):
         try:
-            return self.box.type(text)
+            return self._get_active(challenge_id).type_text(text, username)
         except BoxNotRunningError:
             raise
 
-    def release_keys(self):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        if not self.box:
-            raise BoxNotInitializedError
+    def execute_text(self, text, challenge_id=None, username=None):
+        """
+        Type a line of text and press enter
+        """
+        self._get_active(challenge_id).execute_text(text, username)
+
+    def get_input_pending(self, challenge_id=None):
+        """
+        :return: Input jobs that are queued or being delivered to the VM
+        :rtype: int
+        """
+        return self._get_active(challenge_id).get_input_pending()
+
+    def release_keys(self, challenge_id=None):
         try:
-            self.box.release()
+            self._get_active(challenge_id).release_keys()
         except BoxNotRunningError:
             raise
 
@@ -317,46 +368,100 @@ class State:
             raise NoChallengeSelectedError
         try:
             self.challenge.create_flag(flag_text, level, points_value, description=description, location=location)
+            self.submissions.forget(self.challenge.id)
             self.save_challenge()
         except DuplicateFlagError:
             raise
 
-    def list_flags(self):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        return "\n".join(str(flag) for flag in self.challenge.get_flags())
+    def set_flag_format(self, pattern):
+        """
+        Only accept flags matching a pattern in the selected challenge
 
-    def get_challenge_points(self, username):
+        :param pattern: Regular expression for the flag syntax, None to match flags anywhere in a message
+        """
         if not self.challenge:
             raise NoChallengeSelectedError
-        return self.challenge.get_challenge_points(username)
+        self.challenge.set_flag_format(pattern)
+        self.submissions.forget(self.challenge.id)
+        self.save_challenge()
 
-    def get_leaderboard(self, number):
+    def list_flags(self):
         if not self.challenge:
             raise NoChallengeSelectedError
-        return self.challenge.get_leaderboard(number)
+        return "\n".join(str(flag) for flag in self.challenge.get_flags())
+
+    def get_challenge_points(self, username, challenge_id=None):
+        return self._get_active(challenge_id).challenge.get_challenge_points(username)
+
+    def get_rank(self, username, challenge_id=None):
+        return self._get_active(challenge_id).challenge.get_rank(username)
+
+    def get_leaderboard(self, number, challenge_id=None):
+        return self._get_active(challenge_id).challenge.get_leaderboard(number)
 
     def delete_flag(self, flag):
         if not self.challenge:
             raise NoChallengeSelectedError
         try:
+            flagobj = self.challenge.get_flag(flag)
+            username, points = flagobj.captured, flagobj.value
             self.challenge.delete_flag(flag)
+            self.submissions.forget(self.challenge.id)
             self.save_challenge()
+            if username:
+                active = self._get_active()
+                self._update_season(active, username)
+                self._add_team_points(active, username, -points)
         except FlagNotFoundError:
             raise
 
-    def capture_flag(self, username, text):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        response = self.challenge.validate_flag(username, text)
+    def capture_flag(self, username, text, challenge_id=None):
+        active = self._get_active(challenge_id)
+        response = active.challenge.validate_flag(username, text)
         if response and response[0] == FLAG_CAPTURED_SUCCESSFULLY:
-            self.save_challenge()
+            self.writer.save_challenge(active.challenge)
+            self._update_season(active, username)
+            self._add_team_points(active, username, response[1])
         return response
 
+    def submit_flag(self, username, text, challenge_id=None):
+        """
+        Capture a flag submitted from chat
+        Submissions are limited per user, and repeats of recently rejected submissions are answered from a cache
+
+        :return: The result and points, or FLAG_SUBMISSION_THROTTLED and the seconds until the user can submit again.
+                 Seconds are None when the user has already been told to wait
+        :rtype: tuple
+        """
+        # A submission without an active challenge raises before it costs the user a token
+        active = self._get_active(challenge_id)
+        wait = self.submissions.take(username.lower())
+        if wait != 0:
+            return (FLAG_SUBMISSION_THROTTLED, wait)
+        response = self.submissions.get_rejected(active.challenge.id, text)
+        if response is None:
+            response = self.capture_flag(username, text, active.challenge.id)
+            captured = response[0] == FLAG_CAPTURED_SUCCESSFULLY
+            self.submissions.add_result(active.challenge.id, text, response, captured)
+        return response
+
+    def get_submission_counters(self):
+        """
+        :return: Accepted, rejected, throttled and cached flag submissions from chat since the bot started
+        :rtype: dict
+        """
+        return self.submissions.get_counters()
+
     def create_hint(self, hint, level, cost=0):
+        """
+        :return: Id of the new hint
+        :rtype: int
+        """
         if not self.challenge:
             raise NoChallengeSelectedError
-        self.challenge.create_hint(hint, level, cost)
+        hint_id = self.challenge.create_hint(hint, level, cost)
+        self.save_challenge()
+        return hint_id
 
     def list_hints(self):
         if not self.challenge:
@@ -367,19 +472,21 @@ class State:
             hints += ["\t"+str(hint) for hint in self.challenge.get_hints(level)]
         return "\n".join(hints)
 
-    def move_hint_up(self, level, index):
+    def move_hint_up(self, hint_id):
         if not self.challenge:
             raise NoChallengeSelectedError
         try:
-            self.challenge.move_hint_up(level, index)
+            self.challenge.move_hint_up(hint_id)
+            self.save_challenge()
         except (HintMovementError, HintNotFoundError):
             raise
 
-    def move_hint_down(self, level, index):
+    def move_hint_down(self, hint_id):
         if not self.challenge:
             raise NoChallengeSelectedError
         try:
-            self.challenge.move_hint_down(level, index)
+            self.challenge.move_hint_down(hint_id)
+            self.save_challenge()
         except (HintMovementError, HintNotFoundError):
             raise
 
@@ -388,13 +495,21 @@ class State:
             raise NoChallengeSelectedError
         try:
             self.challenge.delete_hint(hint_id)
+            self.save_challenge()
         except HintNotFoundError:
             raise
 
-    def reveal_hint(self):
-        if not self.challenge:
+    def reveal_hint(self, challenge_id=None):
+        """
+        Reveal the next hint of the current level, such as when a viewer redeems channel points for it
+        """
+        try:
+            active = self._get_active(challenge_id)
+        except NoChallengeSelectedError:
             return "No hints available at this time"
-        return self.challenge.reveal_next_hint()
+        response = active.challenge.reveal_next_hint()
+        self.writer.save_challenge(active.challenge)
+        return response
 
     def create_objective(self, objective, level):
         if not isinstance(level, int):
@@ -420,10 +535,8 @@ class State:
         self.challenge.delete_objective(level)
         self.save_challenge()
 
-    def get_current_objective(self):
-        if not self.challenge:
-            raise NoChallengeSelectedError
-        objective = self.challenge.get_current_objective()
+    def get_current_objective(self, challenge_id=None):
+        objective = self._get_active(challenge_id).challenge.get_current_objective()
         if objective:
             return objective
         elif not objective and hasattr(settings, 'DEFAULT_OBJECTIVE'):
@@ -434,7 +547,7 @@ class State:
     def set_current_objective(self, text):
         if not self.challenge:
             raise NoChallengeSelectedError
-        self.challenge.objective = text
+        self.challenge.set_current_objective(text)
         self.save_challenge()
 
     def reset_current_objective(self):
@@ -444,6 +557,213 @@ class State:
         self.save_challenge()
     # endregion challenge
 
+    # region active challenges
+    def _get_active(self, challenge_id=None):
+        """
+        :param challenge_id: (optional) Id of an active challenge, the selected challenge by default
+        :rtype: core.state.active.ActiveChallenge
+        :raises NoChallengeSelectedError: The challenge is not active
+        """
+        if challenge_id is None:
+            challenge_id = self._selected
+        active = self.challenges.get(challenge_id)
+        if not active:
+            raise NoChallengeSelectedError
+        return active
+
+    def activate_challenge(self, challenge_id):
+        """
+        Load a challenge and its VM, next to the challenges that are already being played
+
+        :return: The active challenge
+        :rtype: core.state.active.ActiveChallenge
+        :raises ChallengeNotFoundError: Challenge does not exist
+        """
+        if challenge_id in self.challenges:
+            return self.challenges[challenge_id]
+        self.writer.flush()
+        active = ActiveChallenge(self.store.load_challenge(challenge_id), self.press_delay)
+        if self.get_active_challenge(active.prefix):
+            # Another challenge already goes by this name in chat
+            active.prefix = str(active.challenge.id)
+        self.challenges[active.challenge.id] = active
+        self._sync_season(active)
+        self._build_teams(active)
+        active.initialize_box()
+        logger.info("Challenge '%s' is now active as #%s", active.challenge, active.prefix)
+        return active
+
+    def deactivate_challenge(self, challenge_id):
+        """
+        Save a challenge and release its VM, users that played it go back to the selected challenge
+
+        :raises NoChallengeSelectedError: The challenge is not active
+        """
+        active = self.challenges.pop(challenge_id, None)
+        if not active:
+            raise NoChallengeSelectedError
+        active.cleanup()
+        self.writer.save_challenge(active.challenge)
+        self.assignments = {username: assigned for username, assigned in self.assignments.items()
+                            if assigned != challenge_id}
+        if self._selected == challenge_id:
+            self._selected = None
+        logger.info("Challenge '%s' is no longer active", active.challenge)
+
+    def get_active_challenges(self):
+        return list(self.challenges.values())
+
+    def get_active_challenge(self, prefix):
+        """
+        :param prefix: The name chat uses for the challenge, or its id
+        :return: The active challenge, None if no active challenge goes by that name
+        :rtype: core.state.active.ActiveChallenge
+        """
+        prefix = make_prefix(prefix.lstrip(ROUTE_PREFIX))
+        for active in self.challenges.values():
+            if prefix == active.prefix or prefix == str(active.challenge.id):
+                return active
+        return None
+
+    def route(self, username, args):
+        """
+        Pick the challenge a chat command is for
+        A first argument such as '#web' picks a challenge, otherwise the challenge the user joined is used
+
+        :param args: Arguments of the command
+        :return: Id of the challenge, the selected challenge when the user has not picked one,
+                 and the arguments without the challenge prefix
+        :rtype: tuple
+        """
+        if args and args[0].startswith(ROUTE_PREFIX):
+            active = self.get_active_challenge(args[0])
+            if active:
+                return active.challenge.id, args[1:]
+        challenge_id = self.assignments.get(username.lower())
+        if challenge_id is None:
+            challenge_id = self._selected
+        return challenge_id, args
+
+    def join_challenge(self, username, prefix):
+        """
+        Send the commands of a user to an active challenge
+
+        :return: The challenge the user joined
+        :rtype: core.state.active.ActiveChallenge
+        :raises ChallengeNotFoundError: No active challenge goes by that name
+        """
+        active = self.get_active_challenge(prefix)
+        if not active:
+            raise ChallengeNotFoundError
+        self.assignments[username.lower()] = active.challenge.id
+        return active
+
+    def leave_challenge(self, username):
+        self.assignments.pop(username.lower(), None)
+
+    def get_joined_challenge(self, username):
+        """
+        :return: The challenge the commands of a user go to
+        :rtype: core.state.active.ActiveChallenge
+        """
+        return self.challenges.get(self.route(username, ())[0])
+    # endregion active challenges
+
+    # region season
+    def _sync_season(self, active):
+        """
+        Bring the season up to date with the scores of a loaded challenge
+        Covers captures made before the season was kept, or while another profile was selected
+        """
+        if self.season is not None:
+            leaderboard = active.challenge.get_leaderboard_scores()
+            if self.season.set_challenge(active.challenge.id, leaderboard):
+                self.writer.save_season(self.season)
+
+    def _update_season(self, active, username):
+        if self.season is not None:
+            challenge = active.challenge
+            points = None
+            if challenge.get_rank(username):
+                points = challenge.get_challenge_points(username)
+            if self.season.set_points(challenge.id, username.lower(), points):
+                self.writer.save_season(self.season)
+
+    def get_season_leaderboard(self, number):
+        if not self.profile:
+            raise NoProfileSelectedError
+        return [f"{points} pts: {username}" for username, points in self.season.top(number)]
+
+    def get_season_points(self, username):
+        if not self.profile:
+            raise NoProfileSelectedError
+        return self.season.get_points(username)
+
+    def get_season_rank(self, username):
+        if not self.profile:
+            raise NoProfileSelectedError
+        return self.season.get_rank(username)
+    # endregion season
+
+    # region teams
+    def _build_teams(self, active):
+        """
+        Sum up the challenge points of the members of each team, once when a challenge is loaded
+        """
+        if not self.profile:
+            active.teams = Leaderboard()
+            return
+        totals = dict()
+        for username, points in active.challenge.get_leaderboard_scores().items():
+            team = self.profile.get_team(username)
+            if team:
+                totals[team] = totals.get(team, 0) + points
+        active.teams = Leaderboard.from_scores(totals)
+
+    def _add_team_points(self, active, username, points):
+        if not self.profile:
+            return
+        team = self.profile.get_team(username)
+        if team and points:
+            # Teams without points left drop off the standings
+            active.teams.set_points(team, active.teams.get_points(team) + points or None)
+
+    def set_team(self, usernames, team):
+        """
+        Move users to a team, their challenge points move with them
+
+        :param usernames: list of usernames
+        :param team: Team name, None removes the users from their team
+        """
+        if not self.profile:
+            raise NoProfileSelectedError
+        previous = self.profile.set_team(usernames, team)
+        for username, old_team in previous.items():
+            if old_team == team:
+                continue
+            for active in self.challenges.values():
+                points = active.challenge.get_challenge_points(username)
+                if old_team and points:
+                    active.teams.set_points(old_team, active.teams.get_points(old_team) - points or None)
+                self._add_team_points(active, username, points)
+            self.writer.update_user(self.profile.users[username])
+
+    def get_team(self, username):
+        if not self.profile:
+            raise NoProfileSelectedError
+        return self.profile.get_team(username)
+
+    def get_team_points(self, team, challenge_id=None):
+        return self._get_active(challenge_id).teams.get_points(team)
+
+    def get_team_rank(self, team, challenge_id=None):
+        return self._get_active(challenge_id).teams.get_rank(team)
+
+    def get_team_leaderboard(self, number, challenge_id=None):
+        teams = self._get_active(challenge_id).teams
+        return [f"{points} pts: {team}" for team, points in teams.top(number)]
+    # endregion teams
+
     # region twitchbot
     def get_subscriptions(self):
         if self.profile and self.profile.channel_id:
@@ -0,0 +1,156 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import logging
+import threading
+from core import settings
+from core.vm.virtualbox import VirtualBoxGroup
+from core.objects.leaderboard import Leaderboard
+from core.exceptions import BoxNotFoundError, BoxNotInitializedError, BoxNotRunningError, BoxAlreadyRunningError
+
+logger = logging.getLogger(__name__)
+
+
+def make_prefix(name):
+    """
+    :return: The name chat uses to pick a challenge, such as '#web-server'
+    :rtype: str
+    """
+    return '-'.join(name.lower().split())
+
+
+class ActiveChallenge:
+    def __init__(self, challenge, press_delay=0):
+        """
+        A challenge that is being played, with its own VM, team standings and input
+
+        :param challenge: The loaded challenge
+        :param press_delay: Default delay between key presses in ms
+        """
+        self.challenge = challenge
+        self.prefix = make_prefix(challenge.name)
+        self.press_delay = press_delay
+        self.box = None
+        self.teams = Leaderboard()
+        # Input for one VM never waits on the input of another
+        self._input_lock = threading.Lock()
+
+    def __str__(self):
+        return f"#{self.prefix}: {self.challenge}"
+
+    def initialize_box(self):
+        self.cleanup()
+        try:
+            standby = 0
+            if hasattr(settings, 'VIRTUALBOX_STANDBY_COUNT') and settings.VIRTUALBOX_STANDBY_COUNT:
+                standby = settings.VIRTUALBOX_STANDBY_COUNT
+            self.box = VirtualBoxGroup(self.challenge.get_machines(), self.press_delay, standby)
+        except BoxNotFoundError:
+            logger.error("The challenge '%s' is not configured correctly. VM client not found", self.challenge)
+            self.box = None
+
+    def cleanup(self):
+        if self.box:
+            self.box.cleanup()
+            self.box = None
+
+    def _get_box(self):
+        if not self.box:
+            raise BoxNotInitializedError
+        return self.box
+
+    def status(self):
+        if not self.box:
+            return f"Challenge '{self.challenge.name}' not initialized"
+        elif self.box.is_running():
+            pending = self.box.get_input_pending()
+            if pending:
+                return f"Challenge '{self.challenge.name}' is running, {pending} input jobs pending"
+            return f"Challenge '{self.challenge.name}' is running"
+        else:
+            return f"Challenge '{self.challenge.name}' is not running"
+
+    # region box control
+    def start(self, restore=False):
+        box = self._get_box()
+        try:
+            if restore:
+                box.restore()
+            box.launch()
+        except BoxAlreadyRunningError:
+            pass
+
+    def restore(self):
+        """
+        Bring the machines back to their snapshot, a warm standby takes over when one is ready
+
+        :return: A standby took over, instead of restoring and booting the machines
+        :rtype: bool
+        """
+        box = self._get_box()
+        with self._input_lock:
+            if box.restore_from_standby():
+                return True
+        self.stop()
+        self.start(restore=True)
+        return False
+
+    def snapshot(self, username):
+        self._get_box().snapshot(username)
+
+    def stop(self, save=True):
+        box = self._get_box()
+        try:
+            box.shut_down(save)
+        except BoxNotRunningError:
+            pass
+
+    def get_machines(self):
+        """
+        :return: Names of the machines, and the name of the machine that gets the keyboard input
+        :rtype: tuple
+        """
+        box = self._get_box()
+        return box.get_machines(), box.selected
+
+    def select_machine(self, name):
+        box = self._get_box()
+        with self._input_lock:
+            box.select(name)
+
+    def get_press_delay(self):
+        return self._get_box().get_delay()
+
+    def set_press_delay(self, delay, expiration=None):
+        self._get_box().set_delay(delay, expiration=expiration)
+    # endregion box control
+
+    # region input
+    def get_special_keys(self):
+        return self._get_box().get_special_keys()
+
+    def send_keys(self, keys, username=None):
+        box = self._get_box()
+        with self._input_lock:
+            return box.send(keys, username)
+
+    def type_text(self, text, username=None):
+        box = self._get_box()
+        with self._input_lock:
+            return box.type(text, username)
+
+    def execute_text(self, text, username=None):
+        box = self._get_box()
+        with self._input_lock:
+            # Enter is typed as part of the text, so lines from a burst of commands can be sent in one call
+            box.type(text + '\n', username)
+
+    def get_input_pending(self):
+        return self._get_box().get_input_pending()
+
+    def release_keys(self):
+        box = self._get_box()
+        with self._input_lock:
+            box.release()
+    # endregion input
@@ -0,0 +1,671 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from core import settings
+from core.objects.profile import Profile
+from core.objects.challenge import Challenge, CHANGE_SNAPSHOT, CHANGE_CAPTURE, CHANGE_CREATE_FLAG,\
+    CHANGE_DELETE_FLAG, CHANGE_CREATE_OBJECTIVE, CHANGE_DELETE_OBJECTIVE, CHANGE_SET_OBJECTIVE,\
+    CHANGE_SET_FLAG_FORMAT, CHANGE_REVEAL_HINT, CHANGE_SET_MACHINES
+from core.objects.flag import Flag
+from core.objects.hint import Hint
+from core.objects.hintqueue import build_hint_queues
+from core.objects.objective import Objective
+from core.objects.user import User, ExtraUserInfo
+from core.objects.usertable import UserTable
+from core.objects.season import SeasonIndex
+from core.objects.interaction import Interaction
+from core.exceptions import ChallengeNotFoundError, ProfileNotFoundError
+from core.state.store import AbstractStore
+from core.state.filestore import get_full_path
+from core.state.serializer import encode_tokens, decode_tokens
+
+logger = logging.getLogger(__name__)
+
+DATABASE_FILENAME = 'twitchbot.db'
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY,
+    channel_name TEXT NOT NULL,
+    bot_name TEXT,
+    superusers TEXT NOT NULL DEFAULT '[]',
+    client_id TEXT,
+    tokens TEXT,
+    bot_id INTEGER,
+    channel_id INTEGER,
+    challenge INTEGER,
+    discord TEXT,
+    stream_state TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    profile_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    interact INTEGER,
+    interaction_count INTEGER NOT NULL DEFAULT 0,
+    team TEXT,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    superuser INTEGER NOT NULL DEFAULT 0,
+    moderator INTEGER NOT NULL DEFAULT 0,
+    following INTEGER NOT NULL DEFAULT 0,
+    subscribed INTEGER NOT NULL DEFAULT 0,
+    cheered INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (profile_id, name)
+);
+CREATE INDEX IF NOT EXISTS users_interact ON users (profile_id, interact);
+CREATE TABLE IF NOT EXISTS challenges (
+    id INTEGER PRIMARY KEY,
+    provider TEXT NOT NULL,
+    name TEXT NOT NULL,
+    level INTEGER NOT NULL DEFAULT 0,
+    objective TEXT,
+    state TEXT,
+    flag_format TEXT,
+    machines TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS flags (
+    challenge_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    description TEXT,
+    location TEXT,
+    PRIMARY KEY (challenge_id, text)
+);
+CREATE TABLE IF NOT EXISTS captures (
+    challenge_id INTEGER NOT NULL,
+    flag_text TEXT NOT NULL,
+    username TEXT NOT NULL,
+    capture_time INTEGER,
+    PRIMARY KEY (challenge_id, flag_text)
+);
+CREATE INDEX IF NOT EXISTS captures_username ON captures (challenge_id, username);
+CREATE TABLE IF NOT EXISTS hints (
+    challenge_id INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    revealed INTEGER NOT NULL DEFAULT 0,
+    hint_id INTEGER,
+    PRIMARY KEY (challenge_id, level, position)
+);
+CREATE TABLE IF NOT EXISTS objectives (
+    challenge_id INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (challenge_id, level)
+);
+CREATE TABLE IF NOT EXISTS season_scores (
+    profile_id INTEGER NOT NULL,
+    challenge_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (profile_id, challenge_id, username)
+);
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY,
+    profile_id INTEGER,
+    challenge_id INTEGER,
+    username TEXT NOT NULL,
+    raw_input TEXT,
+    action TEXT,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS interactions_username ON interactions (username, timestamp);
+CREATE INDEX IF NOT EXISTS interactions_timestamp ON interactions (timestamp);
+"""
+SCHEMA_VERSION = 5
+# Table and statement bringing an existing database up to a schema version, new tables are created by SCHEMA
+MIGRATIONS = {
+    2: [('challenges', 'ALTER TABLE challenges ADD COLUMN flag_format TEXT')],
+    3: [('hints', 'ALTER TABLE hints ADD COLUMN hint_id INTEGER')],
+    4: [('challenges', "ALTER TABLE challenges ADD COLUMN machines TEXT NOT NULL DEFAULT '[]'")],
+    # Pickled tokens are not loaded, they could run code. The bot asks for new tokens instead
+    5: [('profiles', "UPDATE profiles SET tokens = NULL WHERE typeof(tokens) = 'blob'")],
+}
+UPSERT_USER = """
+INSERT INTO users (profile_id, name, interact, interaction_count, team,
+                   user_id, superuser, moderator, following, subscribed, cheered)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (profile_id, name) DO UPDATE SET
+    interact = excluded.interact, interaction_count = excluded.interaction_count, team = excluded.team,
+    user_id = excluded.user_id, superuser = excluded.superuser, moderator = excluded.moderator,
+    following = excluded.following, subscribed = excluded.subscribed, cheered = excluded.cheered
+"""
+
+
+def get_database_path():
+    if hasattr(settings, 'DATABASE_PATH') and settings.DATABASE_PATH:
+        return settings.DATABASE_PATH
+    return str(get_full_path(DATABASE_FILENAME))
+
+
+def _user_row(profile_id, user):
+    extra = user.extra or ExtraUserInfo(False, False)
+    return (profile_id, user.name, user.interact, user.interaction_count, user.team,
+            extra.user_id, extra.superuser, extra.moderator, extra.following, extra.subscribed, extra.cheered)
+
+
+def _row_user(row):
+    name, interact, interaction_count, team, user_id, superuser, moderator, following, subscribed, cheered = row
+    user = User(name, superuser=bool(superuser), moderator=bool(moderator))
+    user.interact = None if interact is None else bool(interact)
+    user.interaction_count = interaction_count
+    user.team = team
+    user.extra.user_id = user_id
+    user.extra.following = bool(following)
+    user.extra.subscribed = subscribed
+    user.extra.cheered = cheered
+    return user
+
+
+class DatabaseStore(AbstractStore):
+    """
+    Store the profiles and challenges in a SQLite database
+    Uses twitchbot.db in the file store location if there is no settings.DATABASE_PATH
+
+    Users, flags, captures, hints and objectives are stored as rows,
+    so recorded challenge changes and user updates only touch the affected rows
+    """
+    def __init__(self, path=None):
+        self._profile = None
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path or get_database_path(), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+
+    def _migrate(self):
+        """
+        Create the tables, or upgrade those of a database created by an earlier version of the bot
+        """
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        tables = {row[0] for row in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        with self._db:
+            if 'challenges' in tables:
+                for upgrade in range(max(version, 1) + 1, SCHEMA_VERSION + 1):
+                    logger.info("Upgrading database to schema version %s", upgrade)
+                    for table, statement in MIGRATIONS[upgrade]:
+                        if table in tables:
+                            self._db.execute(statement)
+        self._db.executescript(SCHEMA)
+        self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _get_profile(self, profile_id):
+        if self._profile and self._profile.id == profile_id:
+            return self._profile
+        return self.load_profile(profile_id)
+
+    def _next_id(self, table):
+        return self._db.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0]
+
+    # region profile
+    def create_profile(self, channel, bot=None, client_id=None):
+        """
+        Create/Initialize a new profile
+
+        :parap client_id: The client_id to use for API requests
+        :param channel: The channel name
+        :param bot: (optional) The bot username
+        :return: Newly created profile
+        :rtype: core.objects.Profile
+        """
+        with self._lock:
+            profile = Profile(self._next_id('profiles'), channel, bot=bot, client_id=client_id)
+            if self.save_profile(profile, new=True):
+                logger.info("New profile created: %s", profile)
+                self._profile = profile
+            else:
+                profile = None
+        return profile
+
+    def load_profile(self, id=None):
+        """
+        Load an existing profile from the database
+
+        :return: The loaded profile object
+        :rtype: core.object.Profile
+        :raises ProfileNotFoundError: Profile does not exist
+        """
+        with self._lock:
+            row = self._db.execute('SELECT channel_name, bot_name, superusers, client_id, tokens, bot_id, '
+                                   'channel_id, challenge, discord FROM profiles WHERE id = ?', (id,)).fetchone()
+            if not row:
+                logger.error("Profile %s does not exist in the database", id)
+                raise ProfileNotFoundError
+            users = self._db.execute('SELECT name, interact, interaction_count, team, user_id, superuser, '
+                                     'moderator, following, subscribed, cheered FROM users WHERE profile_id = ?',
+                                     (id,)).fetchall()
+        profile = Profile.__new__(Profile)
+        profile.id = id
+        (profile.channel_name, profile.bot_name, superusers, profile.client_id, tokens,
+         profile.bot_id, profile.channel_id, profile.challenge, profile.discord) = row
+        profile.superusers = set(json.loads(superusers))
+        profile.tokens = decode_tokens(json.loads(tokens)) if tokens else dict()
+        profile.users = {user[0]: _row_user(user) for user in users}
+        for user in profile.users.values():
+            user.mark_clean()
+        profile.mark_clean()
+        self._profile = profile
+        return profile
+
+    def save_profile(self, profile, new=False):
+        """
+        Save a profile and its changed users to the database
+        Nothing is written if neither the profile nor its users have changed since they were saved
+
+        :return: Profile saved successfully
+        :rtype: Boolean
+        """
+        if not new and not profile.has_changes():
+            self._profile = profile
+            return True
+        revision = profile.get_revision()
+        users = [(user, user.get_revision()) for user in profile.users.values() if new or user.is_dirty()]
+        row = (profile.id, profile.channel_name, profile.bot_name, json.dumps(sorted(profile.superusers)),
+               profile.client_id, json.dumps(encode_tokens(profile.tokens)), profile.bot_id, profile.channel_id,
+               profile.challenge, profile.discord)
+        try:
+            with self._lock, self._db:
+                self._db.execute('INSERT OR REPLACE INTO profiles (id, channel_name, bot_name, superusers, client_id, '
+                                 'tokens, bot_id, channel_id, challenge, discord) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+                self._db.executemany(UPSERT_USER, [_user_row(profile.id, user) for user, _ in users])
+            profile.mark_clean(revision)
+            for user, user_revision in users:
+                user.mark_clean(user_revision)
+            if isinstance(profile.users, UserTable):
+                profile.users.pop_changed()
+            self._profile = profile
+        except (sqlite3.Error, TypeError) as e:
+            logger.error("Profile database storage error: %s", e)
+            return False
+        return True
+    # endregion profile
+
+    # region challenge
+    def create_challenge(self, provider, name):
+        """
+        Create a new challenge configuration
+
+        :return: The new challenge object
+        :rtype: core.object.Challenge
+        """
+        with self._lock:
+            challenge = Challenge(self._next_id('challenges'), provider, name)
+            if self.save_challenge(challenge, new=True):
+                logger.info("New challenge created: %s", challenge)
+            else:
+                challenge = None
+        return challenge
+
+    def load_challenge(self, id):
+        """
+        Load an existing challenge from the database
+
+        :return: The loaded challenge object
+        :rtype: core.object.Challenge
+        :raises ChallengeNotFoundError: Challenge does not exist
+        """
+        with self._lock:
+            row = self._db.execute('SELECT provider, name, level, objective, flag_format, machines FROM challenges '
+                                   'WHERE id = ?', (id,)).fetchone()
+            if not row:
+                logger.error("Challenge %s does not exist in the database", id)
+                raise ChallengeNotFoundError
+            flags = self._db.execute('SELECT f.text, f.level, f.value, f.description, f.location, '
+                                     'c.username, c.capture_time FROM flags f LEFT JOIN captures c '
+                                     'ON c.challenge_id = f.challenge_id AND c.flag_text = f.text '
+                                     'WHERE f.challenge_id = ?', (id,)).fetchall()
+            hints = self._db.execute('SELECT level, position, text, cost, revealed, hint_id FROM hints '
+                                     'WHERE challenge_id = ? ORDER BY level, position', (id,)).fetchall()
+            objectives = self._db.execute('SELECT level, text FROM objectives WHERE challenge_id = ?',
+                                          (id,)).fetchall()
+        provider, name, level, objective, flag_format, machines = row
+        challenge = Challenge(id, provider, name)
+        challenge.level = level
+        challenge.objective = objective
+        challenge.flag_format = flag_format
+        challenge.machines = json.loads(machines)
+        for text, flag_level, value, description, location, username, capture_time in flags:
+            flag = Flag(text, flag_level, value, description=description, location=location)
+            flag.captured = username
+            flag.capture_time = capture_time
+            challenge.flags[text] = flag
+        level_hints = dict()
+        for hint_level, position, text, cost, revealed, hint_id in hints:
+            hint = Hint(text, hint_level, cost, id=hint_id)
+            hint.revealed = bool(revealed)
+            level_hints.setdefault(hint_level, list()).append(hint)
+        challenge.hints = build_hint_queues(level_hints)
+        for objective_level, text in objectives:
+            challenge.objectives[objective_level] = Objective(text, objective_level)
+        challenge.own_children()
+        if any(row[5] is None for row in hints):
+            # Hints saved before they had ids, store the ids they were given
+            with self._lock, self._db:
+                self._write_challenge(challenge)
+        challenge.pop_changes()
+        challenge.mark_clean()
+        return challenge
+
+    def _write_challenge(self, challenge):
+        """
+        Replace every row belonging to a challenge
+        """
+        id = challenge.id
+        self._db.execute('INSERT INTO challenges (id, provider, name, level, objective, flag_format, machines) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET provider = excluded.provider, '
+                         'name = excluded.name, level = excluded.level, objective = excluded.objective, '
+                         'flag_format = excluded.flag_format, machines = excluded.machines',
+                         (id, challenge.provider, challenge.name, challenge.level, challenge.objective,
+                          challenge.flag_format, json.dumps(challenge.machines)))
+        for table in ('flags', 'captures', 'hints', 'objectives'):
+            self._db.execute(f'DELETE FROM {table} WHERE challenge_id = ?', (id,))
+        flags = challenge.flags.values()
+        self._db.executemany('INSERT INTO flags (challenge_id, text, level, value, description, location) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             [(id, f.text, f.level, f.value, f.description, f.location) for f in flags])
+        self._db.executemany('INSERT INTO captures (challenge_id, flag_text, username, capture_time) '
+                             'VALUES (?, ?, ?, ?)',
+                             [(id, f.text, f.captured, f.capture_time) for f in flags if f.is_captured()])
+        self._db.executemany('INSERT INTO hints (challenge_id, level, position, text, cost, revealed, hint_id) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             [(id, level, position, hint.text, hint.cost, hint.revealed, hint.id)
+                              for level, hints in challenge.hints.items() for position, hint in enumerate(hints)])
+        self._db.executemany('INSERT INTO objectives (challenge_id, level, text) VALUES (?, ?, ?)',
+                             [(id, o.level, o.text) for o in challenge.objectives.values()])
+
+    def _write_change(self, challenge, change):
+        """
+        Write a single recorded change to the affected rows
+        """
+        id = challenge.id
+        action, args = change[0], change[1:]
+        if action == CHANGE_CAPTURE:
+            self._db.execute('INSERT OR IGNORE INTO captures (challenge_id, flag_text, username, capture_time) '
+                             'VALUES (?, ?, ?, ?)', (id, *args))
+            self._db.execute('UPDATE challenges SET level = ?, objective = ? WHERE id = ?',
+                             (challenge.level, challenge.objective, id))
+        elif action == CHANGE_CREATE_FLAG:
+            self._db.execute('INSERT OR REPLACE INTO flags (challenge_id, text, level, value, description, location) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (id, *args))
+        elif action == CHANGE_DELETE_FLAG:
+            self._db.execute('DELETE FROM flags WHERE challenge_id = ? AND text = ?', (id, args[0]))
+            self._db.execute('DELETE FROM captures WHERE challenge_id = ? AND flag_text = ?', (id, args[0]))
+        elif action == CHANGE_CREATE_OBJECTIVE:
+            self._db.execute('INSERT OR REPLACE INTO objectives (challenge_id, level, text) VALUES (?, ?, ?)',
+                             (id, args[1], args[0]))
+        elif action == CHANGE_DELETE_OBJECTIVE:
+            self._db.execute('DELETE FROM objectives WHERE challenge_id = ? AND level = ?', (id, args[0]))
+        elif action == CHANGE_SET_OBJECTIVE:
+            self._db.execute('UPDATE challenges SET objective = ? WHERE id = ?', (args[0], id))
+        elif action == CHANGE_SET_FLAG_FORMAT:
+            self._db.execute('UPDATE challenges SET flag_format = ? WHERE id = ?', (args[0], id))
+        elif action == CHANGE_SET_MACHINES:
+            self._db.execute('UPDATE challenges SET machines = ? WHERE id = ?', (json.dumps(args[0]), id))
+        elif action == CHANGE_REVEAL_HINT:
+            self._db.execute('UPDATE hints SET revealed = 1 WHERE challenge_id = ? AND hint_id = ?', (id, args[0]))
+        else:
+            raise ValueError(f"Unknown challenge change: {action}")
+
+    def save_challenge(self, challenge, new=False, changes=None):
+        """
+        Save a challenge to the database
+        Only the recorded changes are written, unless the whole challenge has to be saved
+        Nothing is written if the challenge has not changed since it was saved
+
+        :param changes: (optional) Changes already popped from the challenge
+        :return: Challenge saved successfully
+        :rtype: Boolean
+        """
+        if changes is None:
+            changes = challenge.pop_changes()
+        if not new and not changes and not challenge.is_dirty():
+            return True
+        revision = challenge.get_revision()
+        try:
+            with self._lock, self._db:
+                if new or not changes or any(change[0] == CHANGE_SNAPSHOT for change in changes):
+                    self._write_challenge(challenge)
+                else:
+                    for change in changes:
+                        self._write_change(challenge, change)
+            challenge.mark_clean(revision)
+        except (sqlite3.Error, ValueError, TypeError) as e:
+            logger.error("Challenge database storage error: %s", e)
+            return False
+        return True
+
+    def set_challenge_state(self, profile, challenge, state):
+        with self._lock, self._db:
+            self._db.execute('UPDATE challenges SET state = ? WHERE id = ?', (state, challenge))
+    # endregion challenge
+
+    # region season
+    def load_season(self, profile_id):
+        """
+        Load the season scores of a profile
+
+        :return: The season, empty if nothing has been captured yet
+        :rtype: core.objects.SeasonIndex
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT challenge_id, username, points FROM season_scores WHERE profile_id = ?',
+                                    (profile_id,)).fetchall()
+        challenges = dict()
+        for challenge_id, username, points in rows:
+            challenges.setdefault(challenge_id, dict())[username] = points
+        season = SeasonIndex.__new__(SeasonIndex)
+        season.__setstate__({'id': profile_id, 'challenges': challenges})
+        return season
+
+    def save_season(self, season, changes=None):
+        """
+        Save the changed season scores of a profile
+
+        :param changes: (optional) Changes already popped from the season
+        :return: Season saved successfully
+        :rtype: Boolean
+        """
+        if changes is None:
+            changes = season.pop_changes()
+        try:
+            with self._lock, self._db:
+                self._db.executemany('DELETE FROM season_scores WHERE profile_id = ? AND challenge_id = ? '
+                                     'AND username = ?',
+                                     [(season.id, challenge_id, username)
+                                      for challenge_id, username, points in changes if points is None])
+                self._db.executemany('INSERT OR REPLACE INTO season_scores (profile_id, challenge_id, username, '
+                                     'points) VALUES (?, ?, ?, ?)',
+                                     [(season.id, challenge_id, username, points)
+                                      for challenge_id, username, points in changes if points is not None])
+        except sqlite3.Error as e:
+            logger.error("Season database storage error: %s", e)
+            return False
+        return True
+    # endregion season
+
+    # region users
+    def get_allowed_users(self, profile_id):
+        """
+        Fetch the list of allowed users
+
+        :param profile_id: Profile to load users from
+        :return: Usernames that are allowed to interact
+        :rtype: list of strings
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT name FROM users WHERE profile_id = ? '
+                                    'AND (interact = 1 OR superuser = 1 OR moderator = 1)', (profile_id,))
+            return [row[0] for row in rows]
+
+    def _set_interact(self, profile_id, usernames, interact):
+        profile = self._get_profile(profile_id)
+        rows = list()
+        for username in usernames:
+            user = profile.users.get(username)
+            if not user:
+                user = User(username)
+                profile.users[username] = user
+            user.interact = interact
+            rows.append(_user_row(profile_id, user))
+        try:
+            with self._lock, self._db:
+                self._db.executemany(UPSERT_USER, rows)
+        except sqlite3.Error as e:
+            logger.error("User database storage error: %s", e)
+            return False
+        return True
+
+    def set_allowed_users(self, profile_id, usernames):
+        """
+        Update the list of allowed users
+
+        :param profile_id: Profile id to save users to
+        :param usernames: list of usernames as string
+        :return: Saved successfully
+        :rtype: Boolean
+        """
+        return self._set_interact(profile_id, usernames, True)
+
+    def get_denied_users(self, profile_id):
+        """
+        Fetch the list of denied users
+
+        :param profile_id: Profile to load users from
+        :return: Usernames that are not allowed to interact
+        :rtype: list of strings
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT name FROM users WHERE profile_id = ? '
+                                    'AND interact = 0 AND superuser = 0 AND moderator = 0', (profile_id,))
+            return [row[0] for row in rows]
+
+    def set_denied_users(self, profile_id, usernames):
+        """
+        Update the list of denied users
+
+        :param profile_id: Profile id to save users to
+        :param usernames: list of usernames as string
+        :return: Saved successfully
+        :rtype: Boolean
+        """
+        return self._set_interact(profile_id, usernames, False)
+
+    def update_user(self, user):
+        """
+        Update a single user in the selected profile
+
+        :param user: User object or username
+        :return: Updated successfully
+        :rtype: Boolean
+        """
+        if not self._profile:
+            return False
+        if isinstance(user, str):
+            user = self._profile.users.get(user)
+            if not user:
+                return False
+        if not user.is_dirty():
+            return True
+        revision = user.get_revision()
+        try:
+            with self._lock, self._db:
+                self._db.execute(UPSERT_USER, _user_row(self._profile.id, user))
+            user.mark_clean(revision)
+        except sqlite3.Error as e:
+            logger.error("User database storage error: %s", e)
+            return False
+        return True
+    # endregion users
+
+    # region events
+    def _insert_interaction(self, profile_id, challenge_id, username, raw_input, action, timestamp=None):
+        self._db.execute('INSERT INTO interactions (profile_id, challenge_id, username, raw_input, action, '
+                         'timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                         (profile_id, challenge_id, username, raw_input, action, timestamp or time.time()))
+
+    def save_interaction(self, interaction):
+        """
+        Save a new interaction
+
+        :param interaction: New interaction object
+        :return: Saved successfully
+        :rtype: Boolean
+        """
+        try:
+            with self._lock, self._db:
+                self._insert_interaction(interaction.profile_id, interaction.challenge_id, interaction.username,
+                                         interaction.raw_input, interaction.action, interaction.timestamp)
+        except sqlite3.Error as e:
+            logger.error("Interaction database storage error: %s", e)
+            return False
+        return True
+
+    def read_interactions(self, username=None, start=None, end=None):
+        """
+        Stream the saved interactions, oldest first
+
+        :param username: (optional) Only interactions by this user
+        :param start: (optional) Only interactions at or after this unix timestamp
+        :param end: (optional) Only interactions before this unix timestamp
+        :rtype: generator of core.objects.Interaction
+        """
+        query = 'SELECT username, raw_input, action, profile_id, challenge_id, timestamp FROM interactions WHERE 1'
+        params = []
+        if username is not None:
+            query += ' AND username = ?'
+            params.append(username)
+        if start is not None:
+            query += ' AND timestamp >= ?'
+            params.append(start)
+        if end is not None:
+            query += ' AND timestamp < ?'
+            params.append(end)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY timestamp', params).fetchall()
+        for username, raw_input, action, profile_id, challenge_id, timestamp in rows:
+            yield Interaction(username, raw_input, action, profile_id, challenge_id, timestamp=timestamp)
+
+    def _profile_id_by_channel(self, channel):
+        row = self._db.execute('SELECT id FROM profiles WHERE channel_name = ?', (channel,)).fetchone()
+        return row[0] if row else None
+
+    def cheered(self, username, channel, amount, message):
+        with self._lock, self._db:
+            profile_id = self._profile_id_by_channel(channel)
+            self._db.execute('UPDATE users SET cheered = cheered + ? WHERE profile_id = ? AND name = ?',
+                             (amount, profile_id, username))
+            self._insert_interaction(profile_id, None, username, message, 'cheered')
+
+    def subscribed(self, username, channel, message):
+        with self._lock, self._db:
+            profile_id = self._profile_id_by_channel(channel)
+            self._db.execute('UPDATE users SET subscribed = subscribed + 1 WHERE profile_id = ? AND name = ?',
+                             (profile_id, username))
+            self._insert_interaction(profile_id, None, username, message, 'subscribed')
+
+    def spent_channel_points(self, username, channel, amount, reward):
+        with self._lock, self._db:
+            profile_id = self._profile_id_by_channel(channel)
+            self._insert_interaction(profile_id, None, username, f"{amount} {reward}", 'channel_points')
+
+    def flag_submit(self, username, challenge, flag):
+        # Only a submission is recorded, captures are validated by the challenge and saved with it
+        with self._lock, self._db:
+            self._insert_interaction(None, challenge, username, flag, 'flag_submit')
+
+    def set_stream_state(self, profile, stream_state):
+        with self._lock, self._db:
+            self._db.execute('UPDATE profiles SET stream_state = ? WHERE id = ?', (stream_state, profile))
+    # endregion events
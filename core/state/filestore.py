@@ -2,19 +2,32 @@
 # "Twitch Hacks Online"
 # 2020 - Frank Godo
 
+import io
 import os
+import json
 import pickle
 import logging
+import threading
+from functools import partial
 from pathlib import Path
 from core import settings
 from core.objects.profile import Profile
-from core.objects.challenge import Challenge
+from core.objects.challenge import Challenge, CHANGE_SNAPSHOT
 from core.objects.user import User
-from core.exceptions import ChallengeNotFoundError, ProfileNotFoundError
+from core.objects.usertable import UserTable
+from core.objects.season import SeasonIndex
+from core.exceptions import ChallengeNotFoundError, ProfileNotFoundError, SerializationError
 from core.state.store import AbstractStore
+from core.state import serializer
+from core.state.interactionlog import InteractionLog, ROTATE_SIZE
 
 logger = logging.getLogger(__name__)
 
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_LIMIT = 100
+SEASON_SUFFIX = '.season'
+STORED_TYPES = ('profile', 'challenge')
+
 
 def get_full_path(filename):
     path = Path.home() / '.config' / 'twitchbot'
@@ -28,38 +41,98 @@ def get_full_path(filename):
     return path
 
 
-def get_next_available_id(type):
-    all_files = os.listdir(get_full_path(None))
-    used_ids = []
-    for filename in all_files:
-        if not filename.endswith('.'+type):
-            continue
-        try:
-            used_ids.append(int(filename[:3]))
-        except ValueError:
-            continue
-    if not used_ids:
-        return 1
-    return max(used_ids) + 1
+def fsync_directory(path):
+    """
+    Persist renames within a directory, where the platform supports it
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
 
 class FileStore(AbstractStore):
     """
     Store the profiles and challenges as files
     Uses location ~/.config/twitchbot if there is no settings.FILE_STORE_PATH
+
+    Filenames are resolved through an in-memory index, which is rebuilt when the directory changes on disk
+
+    Users of a profile are stored in shards next to it, and only loaded and written when needed
+    Objects are stored in the versioned format of core.state.serializer, older pickled files are upgraded on load
+    Files are replaced atomically, and saves can be coalesced with settings.FILE_STORE_COMMIT_WINDOW
+
+    With settings.FILE_STORE_JOURNAL enabled, flag, capture and objective changes are appended as JSON lines
+    to a journal next to the challenge file, and compacted into the challenge file once it has grown too long
     """
     def __init__(self):
         self._profile = None
-
-    def _get_filename_by_id(self, id, type):
-        all_files = os.listdir(get_full_path(None))
-        for filename in all_files:
+        self._index = None
+        self._index_mtime = None
+        self._journal_lock = threading.Lock()
+        self._journal_records = dict()
+        self._commit_lock = threading.Lock()
+        self._pending = dict()
+        self._timers = dict()
+        self._interactions = None
+
+    # region index
+    def _build_index(self, path):
+        index = {type: dict() for type in STORED_TYPES}
+        for filename in sorted(os.listdir(path)):
+            type = filename.rsplit('.', 1)[-1]
+            if type not in index:
+                continue
             try:
-                if id == int(filename[:3]) and filename.endswith(type):
-                    return filename
+                index[type].setdefault(int(filename[:3]), filename)
             except ValueError:
                 continue
-        return None
+        self._index = index
+        logger.debug("Indexed %s", {type: len(ids) for type, ids in index.items()})
+
+    def _get_index(self):
+        """
+        Fetch the (type -> id -> filename) index
+        The store directory is only listed again when its mtime has changed
+        """
+        path = get_full_path(None)
+        mtime = path.stat().st_mtime_ns
+        if self._index is None or mtime != self._index_mtime:
+            self._build_index(path)
+            self._index_mtime = mtime
+        return self._index
+
+    def _sync_index(self):
+        """
+        Accept the current directory mtime after the store itself has added or removed files
+        """
+        if self._index is not None:
+            self._index_mtime = get_full_path(None).stat().st_mtime_ns
+
+    def _get_filename_by_id(self, id, type):
+        return self._get_index()[type].get(id)
+
+    def get_ids(self, type):
+        """
+        Fetch the ids of all stored objects of a type
+
+        :param type: 'profile' or 'challenge'
+        :rtype: list of integers
+        """
+        return sorted(self._get_index()[type])
+
+    def _get_next_available_id(self, type):
+        used_ids = self._get_index()[type]
+        if not used_ids:
+            return 1
+        return max(used_ids) + 1
+    # endregion index
 
     def _generate_new_filename(self, obj):
         if isinstance(obj, Profile):
@@ -72,30 +145,171 @@ class FileStore(AbstractStore):
         else:
             raise TypeError
 
+    def _get_type(self, obj):
+        if isinstance(obj, Profile):
+            return 'profile'
+        elif isinstance(obj, Challenge):
+            return 'challenge'
+        elif isinstance(obj, SeasonIndex):
+            return 'season'
+        raise TypeError
+
     def _save_object(self, obj, new=False):
         """
         Save a challenge or profile object to disk
+        With settings.FILE_STORE_COMMIT_WINDOW, saves of the same object within the window are written once
         """
-        path = None
+        window = self._commit_window()
+        if new or not window:
+            self._write_object(obj, new)
+            return
+        key = (self._get_type(obj), obj.id)
+        with self._commit_lock:
+            self._pending[key] = obj
+            if key in self._timers:
+                return
+            timer = threading.Timer(window / 1000, self._commit, args=(key,))
+            timer.daemon = True
+            self._timers[key] = timer
+        timer.start()
+
+    def _write_object(self, obj, new=False):
+        type = self._get_type(obj)
+        if type == 'season':
+            self._replace_file(self._get_season_path(obj.id), self._dumps(obj))
+            return
         if new:
-            path = get_full_path(self._generate_new_filename(obj))
+            filename = self._generate_new_filename(obj)
         else:
-            if isinstance(obj, Profile):
-                path = get_full_path(self._get_filename_by_id(obj.id, 'profile'))
-            elif isinstance(obj, Challenge):
-                path = get_full_path(self._get_filename_by_id(obj.id, 'challenge'))
-            else:
-                raise TypeError
+            filename = self._get_filename_by_id(obj.id, type)
+        path = get_full_path(filename)
+        revision = obj.get_revision()
         try:
-            with path.open('wb') as f:
-                pickle.dump(obj, f)
+            index = self._get_index()
+            if type == 'challenge':
+                # The snapshot contains every journaled change, so the journal goes with it
+                with self._journal_lock:
+                    self._replace_file(path, self._dumps(obj))
+                    self._clear_journal(obj.id)
+            else:
+                self._write_user_shards(obj)
+                # Changed users alone don't require the profile itself to be written
+                if new or obj.is_dirty():
+                    self._replace_file(path, self._dumps(obj))
+            obj.mark_clean(revision)
+            if new:
+                index[type][obj.id] = filename
+                self._sync_index()
         except (TypeError, FileNotFoundError, IsADirectoryError, PermissionError):
             raise
 
+    def _compress(self):
+        return hasattr(settings, 'FILE_STORE_COMPRESS') and settings.FILE_STORE_COMPRESS
+
+    def _dumps(self, obj):
+        return serializer.dumps(obj, compress=self._compress())
+
+    # region user shards
+    def _get_shard_path(self, profile_id, index, create=False):
+        path = get_full_path(f"{profile_id:03}.users")
+        if create and not path.exists():
+            path.mkdir()
+            self._sync_index()
+        return path / f"{index:02x}.shard"
+
+    def _load_user_shard(self, profile_id, index):
+        path = self._get_shard_path(profile_id, index)
+        try:
+            with path.open('rb') as f:
+                return serializer.loads_users(f.read())
+        except FileNotFoundError:
+            return dict()
+        except SerializationError as e:
+            logger.error("User shard %s could not be loaded: %s", path, e)
+            raise
+
+    def _write_user_shards(self, profile):
+        """
+        Write the shards with changed users, unchanged shards are neither loaded nor written
+        """
+        changed = profile.users.pop_changed()
+        try:
+            for index, users in changed.items():
+                data = serializer.dumps_users(users, compress=self._compress())
+                self._replace_file(self._get_shard_path(profile.id, index, create=True), data)
+        except Exception:
+            profile.users.restore_changed(changed.keys())
+            raise
+
+    def _attach_users(self, profile):
+        if not isinstance(profile.users, UserTable):
+            profile.users = UserTable.from_dict(profile.users)
+        profile.users.loader = partial(self._load_user_shard, profile.id)
+    # endregion user shards
+
+    def _write_temp(self, path, data, suffix='.tmp'):
+        """
+        Write data to a temporary file next to path, and make sure it has reached the disk
+        """
+        temp_path = path.with_name(path.name + suffix)
+        with temp_path.open('wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return temp_path
+
+    def _replace_file(self, path, data):
+        """
+        Atomically replace the contents of path, a crash leaves either the old or the new file
+        """
+        os.replace(self._write_temp(path, data), path)
+        fsync_directory(path.parent)
+        self._sync_index()
+
+    # region group commit
+    def _commit_window(self):
+        if hasattr(settings, 'FILE_STORE_COMMIT_WINDOW') and settings.FILE_STORE_COMMIT_WINDOW:
+            return settings.FILE_STORE_COMMIT_WINDOW
+        return 0
+
+    def _commit(self, key):
+        """
+        Write the latest pending save of an object
+        """
+        with self._commit_lock:
+            obj = self._pending.pop(key, None)
+            timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        if obj is None:
+            return
+        try:
+            self._write_object(obj)
+        except RuntimeError:
+            # The object was modified while it was being serialized, try again in the next window
+            logger.debug("%s %s changed during serialization, retrying", *key)
+            self._save_object(obj)
+        except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError) as e:
+            logger.error("%s %s could not be written: %s", key[0].capitalize(), key[1], e)
+
+    def flush(self):
+        """
+        Write all pending saves to disk
+        """
+        with self._commit_lock:
+            keys = list(self._pending.keys())
+        for key in keys:
+            self._commit(key)
+        if self._interactions:
+            self._interactions.flush()
+    # endregion group commit
+
     def _load_object(self, id, type):
         """
         Load a challenge or profile object from disk
         """
+        if (type, id) in self._pending:
+            self._commit((type, id))
         filename = self._get_filename_by_id(id, type)
         if not filename:
             logger.error("Could not resolve filename of %s with id %s", type, id)
@@ -103,11 +317,129 @@ class FileStore(AbstractStore):
         path = get_full_path(filename)
         try:
             with path.open('rb') as f:
-                obj = pickle.load(f)
-        except (TypeError, FileNotFoundError, IsADirectoryError, PermissionError):
+                obj = serializer.loads(f.read())
+        except (TypeError, FileNotFoundError, IsADirectoryError, PermissionError, SerializationError):
             raise
         return obj
 
+    # region journal
+    def _journal_enabled(self):
+        return hasattr(settings, 'FILE_STORE_JOURNAL') and settings.FILE_STORE_JOURNAL
+
+    def _journal_limit(self):
+        if hasattr(settings, 'FILE_STORE_JOURNAL_LIMIT') and settings.FILE_STORE_JOURNAL_LIMIT:
+            return settings.FILE_STORE_JOURNAL_LIMIT
+        return JOURNAL_LIMIT
+
+    def _get_journal_path(self, challenge_id):
+        filename = self._get_filename_by_id(challenge_id, 'challenge')
+        if not filename:
+            raise FileNotFoundError
+        return get_full_path(filename + JOURNAL_SUFFIX)
+
+    def _append_journal(self, challenge, changes):
+        """
+        Append change records to the journal of a challenge, and compact it if it has grown too long
+        """
+        data = b''.join(json.dumps(change, separators=(',', ':')).encode('utf-8') + b'\n' for change in changes)
+        with self._journal_lock:
+            journal = self._get_journal_path(challenge.id)
+            created = not journal.exists()
+            with journal.open('ab') as f:
+                f.write(data)
+            if created:
+                self._sync_index()
+            records = self._journal_records.get(challenge.id, 0) + len(changes)
+            self._journal_records[challenge.id] = records
+        if records >= self._journal_limit():
+            self._compact_journal(challenge)
+
+    def _read_journal(self, challenge_id):
+        """
+        Read the change records of a journal, a partial record left by a crash is cut off
+
+        :return: The change records, and whether the journal is pickled by an earlier version
+        :rtype: tuple
+        """
+        journal = self._get_journal_path(challenge_id)
+        with journal.open('rb') as f:
+            data = f.read()
+        if data.startswith(b'\x80'):
+            # Pickled journals are trusted like the legacy challenge files next to them
+            return self._read_legacy_journal(data), True
+        changes = []
+        complete = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("Missing end of line")
+                changes.append(json.loads(line))
+            except ValueError:
+                logger.warning("Ignoring incomplete record at the end of the journal for challenge %s", challenge_id)
+                # Records appended after it would not be read either
+                with journal.open('r+b') as f:
+                    f.truncate(complete)
+                break
+            complete += len(line)
+        return changes, False
+
+    def _read_legacy_journal(self, data):
+        changes = []
+        f = io.BytesIO(data)
+        while True:
+            try:
+                changes.append(pickle.load(f))
+            except EOFError:
+                break
+            except (pickle.UnpicklingError, ValueError, TypeError):
+                logger.warning("Ignoring incomplete record at the end of a pickled journal")
+                break
+        return changes
+
+    def _replay_journal(self, challenge):
+        """
+        Apply the journaled changes to a challenge loaded from disk
+
+        :return: The journal is pickled, it has to be replaced by a snapshot before records are appended
+        :rtype: bool
+        """
+        try:
+            changes, legacy = self._read_journal(challenge.id)
+        except FileNotFoundError:
+            changes, legacy = [], False
+        for change in changes:
+            challenge.apply_change(change)
+        challenge.pop_changes()
+        self._journal_records[challenge.id] = len(changes)
+        if changes:
+            logger.info("Replayed %s journal records for challenge %s", len(changes), challenge.id)
+        return legacy
+
+    def _clear_journal(self, challenge_id):
+        try:
+            self._get_journal_path(challenge_id).unlink()
+            self._sync_index()
+        except FileNotFoundError:
+            pass
+        self._journal_records[challenge_id] = 0
+
+    def _compact_journal(self, challenge):
+        """
+        Write a snapshot of the challenge and drop its journal
+        Runs on the thread that appends to the journal, so every journaled record is in the snapshot.
+        The snapshot can also contain changes that are journaled after it, replaying them has to leave the
+        challenge as it is, which is what Challenge.apply_change guarantees
+        """
+        logger.debug("Compacting journal of challenge %s", challenge.id)
+        try:
+            self._write_object(challenge)
+        except RuntimeError as e:
+            # The challenge was modified while it was being serialized, the next append tries again
+            logger.debug("Journal compaction of challenge %s postponed: %s", challenge.id, e)
+        except (TypeError, FileNotFoundError, PermissionError) as e:
+            logger.warning("Journal compaction of challenge %s failed: %s", challenge.id, e)
+    # endregion journal
+
     def create_profile(self, channel, bot=None, client_id=None):
         """
         Create/Initialize a new profile
@@ -118,7 +450,8 @@ class FileStore(AbstractStore):
         :return: Newly created profile
         :rtype: core.objects.Profile
         """
-        profile = Profile(get_next_available_id('profile'), channel, bot=bot, client_id=client_id)
+        profile = Profile(self._get_next_available_id('profile'), channel, bot=bot, client_id=client_id)
+        self._attach_users(profile)
         if self.save_profile(profile, new=True):
             logger.info("New profile created: %s", profile)
             self._profile = profile
@@ -136,22 +469,29 @@ class FileStore(AbstractStore):
         """
         try:
             obj = self._load_object(id, 'profile')
+            self._attach_users(obj)
+            if not obj._upgraded:
+                obj.mark_clean()
             self._profile = obj
             return obj
-        except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError) as e:
+        except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError, SerializationError) as e:
             logger.error("Profile file could not be loaded %s", e)
             raise ProfileNotFoundError
 
     def save_profile(self, profile, new=False):
         """
         Save a profile to disk
+        Nothing is written if neither the profile nor its users have changed since they were saved
 
         :return: Profile saved successfully
         :rtype: Boolean
         """
         try:
+            if getattr(profile.users, 'loader', None) is None:
+                self._attach_users(profile)
             self._profile = profile
-            self._save_object(profile, new)
+            if new or profile.has_changes():
+                self._save_object(profile, new)
         except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError) as e:
             logger.error("Profile file storage error: %s", e)
             return False
@@ -164,7 +504,7 @@ class FileStore(AbstractStore):
         :return: The new challenge object
         :rtype: core.object.Challenge
         """
-        challenge = Challenge(get_next_available_id('challenge'), provider, name)
+        challenge = Challenge(self._get_next_available_id('challenge'), provider, name)
         if self.save_challenge(challenge, new=True):
             logger.info("New challenge created: %s", challenge)
         else:
@@ -181,20 +521,38 @@ class FileStore(AbstractStore):
         """
         try:
             obj = self._load_object(id, 'challenge')
+            if self._replay_journal(obj) or obj._upgraded:
+                # Journaled changes are not enough, the whole challenge is written in the current format
+                obj._record(CHANGE_SNAPSHOT)
+            else:
+                obj.mark_clean()
             return obj
-        except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError) as e:
+        except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError, SerializationError) as e:
             logger.error("Challenge file could not be loaded %s", e)
             raise ChallengeNotFoundError
 
-    def save_challenge(self, challenge, new=False):
+    def save_challenge(self, challenge, new=False, changes=None):
         """
         Save a challenge to disk
+        Only the recorded changes are appended to the journal, when journaling is enabled
+        Nothing is written if the challenge has not changed since it was saved
 
+        :param changes: (optional) Changes already popped from the challenge
         :return: Challenge saved successfully
         :rtype: Boolean
         """
+        if changes is None:
+            changes = challenge.pop_changes()
+        if not new and not changes and not challenge.is_dirty():
+            return True
+        journal = self._journal_enabled() and not new and changes
         try:
-            self._save_object(challenge, new)
+            if journal and all(change[0] != CHANGE_SNAPSHOT for change in changes):
+                revision = challenge.get_revision()
+                self._append_journal(challenge, changes)
+                challenge.mark_clean(revision)
+            else:
+                self._save_object(challenge, new)
         except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError) as e:
             logger.error("Challenge file storage error: %s", e)
             return False
@@ -282,14 +640,64 @@ class FileStore(AbstractStore):
 
     def update_user(self, user):
         """
-        Update a user
+        Update a single user in the selected profile, only the shard of the user is written
 
         :param user: User object or username
         :return: Updated successfully
         :rtype: Boolean
         """
-        # TODO: Implement this
+        profile = self._profile
+        if not profile:
+            return False
+        if not isinstance(user, str):
+            user = user.name
+        if getattr(profile.users, 'loader', None) is None:
+            self._attach_users(profile)
+        # The user can have been modified in place, which the table does not notice
+        profile.users.mark_changed(user)
+        return self.save_profile(profile)
+
+    # region season
+    def _get_season_path(self, profile_id):
+        return get_full_path(f"{profile_id:03}{SEASON_SUFFIX}")
+
+    def load_season(self, profile_id):
+        """
+        Load the season scores of a profile
+
+        :return: The season, empty if nothing has been captured yet
+        :rtype: core.objects.SeasonIndex
+        """
+        if ('season', profile_id) in self._pending:
+            self._commit(('season', profile_id))
+        try:
+            with self._get_season_path(profile_id).open('rb') as f:
+                return serializer.loads(f.read())
+        except FileNotFoundError:
+            return SeasonIndex(profile_id)
+        except (PermissionError, IsADirectoryError, SerializationError) as e:
+            logger.error("Season of profile %s could not be loaded: %s", profile_id, e)
+            return SeasonIndex(profile_id)
+
+    def save_season(self, season, changes=None):
+        """
+        Save the season scores of a profile, the whole file is written when any score has changed
+
+        :param changes: (optional) Changes already popped from the season
+        :return: Season saved successfully
+        :rtype: Boolean
+        """
+        if changes is None:
+            changes = season.pop_changes()
+        if not changes:
+            return True
+        try:
+            self._save_object(season)
+        except (TypeError, PermissionError, FileNotFoundError, IsADirectoryError) as e:
+            logger.error("Season file storage error: %s", e)
+            return False
         return True
+    # endregion season
 
     def save_interaction(self, interaction):
         """
@@ -299,5 +707,28 @@ class FileStore(AbstractStore):
         :return: Saved successfully
         :rtype: Boolean
         """
-        # Interactions are not saved to disk
+        self._get_interaction_log().append(interaction)
         return True
+
+    def read_interactions(self, username=None, start=None, end=None):
+        """
+        Stream the saved interactions, oldest first
+
+        :param username: (optional) Only interactions by this user
+        :param start: (optional) Only interactions at or after this unix timestamp
+        :param end: (optional) Only interactions before this unix timestamp
+        :rtype: generator of core.objects.Interaction
+        """
+        return self._get_interaction_log().read(username=username, start=start, end=end)
+
+    def _get_interaction_log(self):
+        if not self._interactions:
+            rotate_size = ROTATE_SIZE
+            if hasattr(settings, 'INTERACTION_LOG_ROTATE_SIZE') and settings.INTERACTION_LOG_ROTATE_SIZE:
+                rotate_size = settings.INTERACTION_LOG_ROTATE_SIZE
+            keep = 0
+            if hasattr(settings, 'INTERACTION_LOG_KEEP') and settings.INTERACTION_LOG_KEEP:
+                keep = settings.INTERACTION_LOG_KEEP
+            self._interactions = InteractionLog(get_full_path('interactions'), rotate_size=rotate_size, keep=keep)
+            self._sync_index()
+        return self._interactions
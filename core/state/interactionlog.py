@@ -0,0 +1,202 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import os
+import struct
+import logging
+import threading
+from core.objects.interaction import Interaction
+
+logger = logging.getLogger(__name__)
+
+# Record: timestamp, profile id, challenge id, length of username, action and raw input
+RECORD = struct.Struct('>dIIBHH')
+SEGMENT_PREFIX = 'interactions-'
+SEGMENT_SUFFIX = '.log'
+BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 1.0
+ROTATE_SIZE = 16 * 1024 * 1024
+
+
+def _encode(text, limit):
+    data = (text or '').encode('utf-8')
+    if len(data) <= limit:
+        return data
+    # Cut at a character boundary, a partial character would not decode
+    return data[:limit].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def _complete_size(data):
+    """
+    :return: Size of the complete records at the start of a segment
+    :rtype: int
+    """
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        name_length, action_length, input_length = RECORD.unpack_from(data, offset)[3:]
+        record_end = offset + RECORD.size + name_length + action_length + input_length
+        if record_end > len(data):
+            break
+        offset = record_end
+    return offset
+
+
+class InteractionLog:
+    """
+    Append-only log of interactions, stored as binary records in rotated segment files
+    Records are buffered in memory and written by a background thread
+    """
+    def __init__(self, path, rotate_size=ROTATE_SIZE, keep=0, flush_interval=FLUSH_INTERVAL):
+        """
+        :param path: Directory to store the segment files in
+        :param rotate_size: Start a new segment when the current one reaches this size in bytes
+        :param keep: (optional) Number of segments to keep, 0 keeps all of them
+        :param flush_interval: Seconds between writes of the buffer
+        """
+        self.path = path
+        self.rotate_size = rotate_size
+        self.keep = keep
+        self.flush_interval = flush_interval
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.path.mkdir(parents=True, exist_ok=True)
+        segments = self._segments()
+        self._segment = segments[-1][0] if segments else 1
+        if segments:
+            self._truncate_partial(segments[-1][1])
+        self._thread = threading.Thread(target=self._run, name='interaction-log', daemon=True)
+        self._thread.start()
+
+    def _truncate_partial(self, path):
+        """
+        Cut off a record that was partially written when the bot stopped, records appended after it would be lost
+        """
+        with path.open('r+b') as f:
+            data = f.read()
+            size = _complete_size(data)
+            if size < len(data):
+                logger.warning("Removing incomplete record at the end of %s", path)
+                f.truncate(size)
+
+    def _segment_path(self, number):
+        return self.path / f"{SEGMENT_PREFIX}{number:06}{SEGMENT_SUFFIX}"
+
+    def _segments(self):
+        """
+        :return: Segment numbers and paths, oldest first
+        :rtype: list of tuples
+        """
+        segments = []
+        for filename in os.listdir(self.path):
+            if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append((int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]), self.path / filename))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def append(self, interaction):
+        """
+        Add an interaction to the write buffer
+        """
+        username = _encode(interaction.username, 255)
+        action = _encode(interaction.action, 65535)
+        raw_input = _encode(interaction.raw_input, 65535)
+        record = RECORD.pack(interaction.timestamp, interaction.profile_id or 0, interaction.challenge_id or 0,
+                             len(username), len(action), len(raw_input)) + username + action + raw_input
+        with self._lock:
+            self._buffer += record
+            full = len(self._buffer) >= BUFFER_SIZE
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error("Interaction log could not be written: %s", e)
+
+    def flush(self):
+        """
+        Write the buffered records to the current segment, rotating it when it is full
+        """
+        with self._write_lock:
+            with self._lock:
+                data, self._buffer = self._buffer, bytearray()
+            if not data:
+                return
+            path = self._segment_path(self._segment)
+            with path.open('ab') as f:
+                f.write(data)
+                size = f.tell()
+            if size >= self.rotate_size:
+                self._rotate()
+
+    def _rotate(self):
+        self._segment += 1
+        logger.debug("Rotating interaction log to segment %s", self._segment)
+        if self.keep:
+            for _, path in self._segments()[:-self.keep]:
+                path.unlink()
+
+    def _read_segment(self, path, username, start, end):
+        with path.open('rb') as f:
+            data = f.read()
+        view = memoryview(data)
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            timestamp, profile_id, challenge_id, name_length, action_length, input_length = \
+                RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            name_end = offset + name_length
+            action_end = name_end + action_length
+            record_end = action_end + input_length
+            if record_end > len(data):
+                logger.warning("Ignoring incomplete record at the end of %s", path)
+                return
+            matched = (start is None or timestamp >= start) and (end is None or timestamp < end) and \
+                (username is None or view[offset:name_end] == username)
+            if matched:
+                yield Interaction(bytes(view[offset:name_end]).decode('utf-8', 'replace'),
+                                  bytes(view[action_end:record_end]).decode('utf-8', 'replace'),
+                                  bytes(view[name_end:action_end]).decode('utf-8', 'replace'),
+                                  profile_id or None, challenge_id or None, timestamp=timestamp)
+            offset = record_end
+
+    def _first_timestamp(self, path):
+        with path.open('rb') as f:
+            header = f.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return None
+        return RECORD.unpack(header)[0]
+
+    def read(self, username=None, start=None, end=None):
+        """
+        Stream the logged interactions in the order they were made
+
+        :param username: (optional) Only interactions by this user
+        :param start: (optional) Only interactions at or after this unix timestamp
+        :param end: (optional) Only interactions before this unix timestamp
+        :rtype: generator of core.objects.Interaction
+        """
+        self.flush()
+        if username is not None:
+            username = _encode(username, 255)
+        segments = [path for _, path in self._segments()]
+        for index, path in enumerate(segments):
+            if start is not None and index + 1 < len(segments):
+                # Segments are in order, skip those that end before the requested range
+                following = self._first_timestamp(segments[index + 1])
+                if following is not None and following < start:
+                    continue
+            if end is not None:
+                first = self._first_timestamp(path)
+                if first is not None and first >= end:
+                    return
+            yield from self._read_segment(path, username, start, end)
@@ -0,0 +1,58 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import sys
+import logging
+from core.state.filestore import FileStore
+from core.state.database import DatabaseStore
+from core.exceptions import ProfileNotFoundError, ChallengeNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+def import_file_store(database, filestore=None):
+    """
+    Import every .profile, .challenge and .season file into the database, keeping their ids
+    Existing rows with the same ids are overwritten
+
+    :param database: DatabaseStore to import into
+    :param filestore: (optional) FileStore to import from, defaults to the configured location
+    :return: Number of imported profiles and challenges
+    :rtype: tuple
+    """
+    if filestore is None:
+        filestore = FileStore()
+    profiles = challenges = 0
+    for id in filestore.get_ids('profile'):
+        try:
+            profile = filestore.load_profile(id)
+        except ProfileNotFoundError:
+            continue
+        if database.save_profile(profile, new=True):
+            profiles += 1
+        season = filestore.load_season(id)
+        database.save_season(season, changes=[(challenge_id, username, points)
+                                              for challenge_id, scores in season.challenges.items()
+                                              for username, points in scores.items()])
+    for id in filestore.get_ids('challenge'):
+        try:
+            challenge = filestore.load_challenge(id)
+        except ChallengeNotFoundError:
+            continue
+        if database.save_challenge(challenge, new=True):
+            challenges += 1
+    logger.info("Imported %s profiles and %s challenges", profiles, challenges)
+    return profiles, challenges
+
+
+def main(args):
+    path = args[0] if args else None
+    database = DatabaseStore(path)
+    profiles, challenges = import_file_store(database)
+    database.close()
+    print(f"Imported {profiles} profiles and {challenges} challenges")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,420 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import gc
+import json
+import zlib
+import struct
+import pickle
+import logging
+from datetime import datetime
+from core.objects.profile import Profile
+from core.objects.challenge import Challenge
+from core.objects.flag import Flag
+from core.objects.hint import Hint
+from core.objects.hintqueue import HintQueue, build_hint_queues
+from core.objects.objective import Objective
+from core.objects.token import Token
+from core.objects.user import User, ExtraUserInfo
+from core.objects.usertable import UserTable
+from core.objects.season import SeasonIndex
+from core.objects.tracked import Tracked
+from core.exceptions import SerializationError
+
+logger = logging.getLogger(__name__)
+
+# Header: magic, format version, flags, object type, schema version of the object type
+MAGIC = b'THO\x00'
+HEADER = struct.Struct('>4sBBBH')
+FORMAT_VERSION = 1
+FLAG_COMPRESSED = 0x01
+
+TYPE_PROFILE = 1
+TYPE_CHALLENGE = 2
+TYPE_USERS = 3
+TYPE_SEASON = 4
+
+# Profile 1: Tokens stored as irc_token/api_token strings
+# Profile 2: Tokens stored as Token objects
+# Profile 3: Users stored in separate shards
+PROFILE_VERSION = 3
+# Challenge 1: No flag format
+# Challenge 2: Optional flag format for strict flag matching
+# Challenge 3: Hints stored with their id, in the order they are revealed
+# Challenge 4: Several VirtualBox machines per challenge
+CHALLENGE_VERSION = 4
+USERS_VERSION = 1
+SEASON_VERSION = 1
+
+USER_FIELDS = ('interact', 'interaction_count', 'team')
+EXTRA_FIELDS = ('user_id', 'superuser', 'moderator', 'following', 'subscribed', 'cheered')
+
+
+# region encoding
+def _encode_users(users):
+    """
+    Encode users as columns, one list per field
+    """
+    values = list(users.values())
+    columns = [[user.name for user in values]]
+    columns += [[getattr(user, field) for user in values] for field in USER_FIELDS]
+    extras = [user.extra or ExtraUserInfo(False, False) for user in values]
+    columns += [[getattr(extra, field) for extra in extras] for field in EXTRA_FIELDS]
+    return columns
+
+
+def _encode_token(token):
+    return [token.type, token.token, token.scopes, token.user_id, token.login, token.expiry.timestamp()]
+
+
+def _encode_profile(profile):
+    return [profile.id, profile.channel_name, profile.bot_name, sorted(profile.superusers), profile.client_id,
+            profile.bot_id, profile.channel_id, profile.challenge, profile.discord,
+            [[key, _encode_token(token)] for key, token in profile.tokens.items()],
+            profile.users.shards]
+
+
+def _encode_challenge(challenge):
+    return [challenge.id, challenge.provider, challenge.name, challenge.level, challenge.objective,
+            [[f.text, f.level, f.value, f.description, f.location, f.captured, f.capture_time]
+             for f in challenge.flags.values()],
+            [[level, [[h.id, h.text, h.cost, h.revealed] for h in hints]]
+             for level, hints in challenge.hints.items()],
+            [[o.text, o.level] for o in challenge.objectives.values()],
+            challenge.flag_format, challenge.machines]
+
+
+def _encode_season(season):
+    return [season.id, [[challenge_id, [[username, points] for username, points in scores.items()]]
+                        for challenge_id, scores in season.challenges.items()]]
+# endregion encoding
+
+
+# region decoding
+def _decode_users(columns):
+    names, interact, interaction_count, team = columns[:4]
+    user_new = User.__new__
+    extra_new = ExtraUserInfo.__new__
+    users = dict()
+    for row in zip(names, interact, interaction_count, team, *columns[4:]):
+        extra = extra_new(ExtraUserInfo)
+        extra.__dict__ = dict(zip(EXTRA_FIELDS, row[4:]))
+        user = user_new(User)
+        user.__dict__ = {'name': row[0], 'interact': row[1], 'interaction_count': row[2], 'team': row[3],
+                         'extra': extra}
+        users[row[0]] = user
+    return users
+
+
+def _decode_token(values):
+    token = Token.__new__(Token)
+    token.type, token.token, token.scopes, token.user_id, token.login, expiry = values
+    token.expiry = datetime.fromtimestamp(expiry)
+    return token
+
+
+def _decode_profile_v2(values):
+    (id, channel_name, bot_name, superusers, client_id, bot_id, channel_id, challenge, discord,
+     tokens, users) = values
+    return {'id': id, 'channel_name': channel_name, 'bot_name': bot_name, 'superusers': set(superusers),
+            'client_id': client_id, 'bot_id': bot_id, 'channel_id': channel_id, 'challenge': challenge,
+            'discord': discord, 'tokens': {key: _decode_token(token) for key, token in tokens},
+            'users': _decode_users(users)}
+
+
+def _decode_profile_v3(values):
+    (id, channel_name, bot_name, superusers, client_id, bot_id, channel_id, challenge, discord,
+     tokens, shards) = values
+    return {'id': id, 'channel_name': channel_name, 'bot_name': bot_name, 'superusers': set(superusers),
+            'client_id': client_id, 'bot_id': bot_id, 'channel_id': channel_id, 'challenge': challenge,
+            'discord': discord, 'tokens': {key: _decode_token(token) for key, token in tokens},
+            'users': UserTable(shards)}
+
+
+def _decode_challenge_v1(values):
+    id, provider, name, level, objective, flags, hints, objectives = values[:8]
+    state = {'id': id, 'provider': provider, 'name': name, 'level': level, 'objective': objective,
+             'flags': dict(), 'hints': dict(), 'objectives': dict()}
+    for text, flag_level, value, description, location, captured, capture_time in flags:
+        flag = Flag(text, flag_level, value, description=description, location=location)
+        flag.captured = captured
+        flag.capture_time = capture_time
+        state['flags'][text] = flag
+    for hint_level, level_hints in hints:
+        state['hints'][hint_level] = list()
+        for text, cost, order, revealed in level_hints:
+            hint = Hint(text, hint_level, cost)
+            hint.revealed = revealed
+            state['hints'][hint_level].append(hint)
+    for text, objective_level in objectives:
+        state['objectives'][objective_level] = Objective(text, objective_level)
+    return state
+
+
+def _decode_challenge_v2(values):
+    state = _decode_challenge_v1(values)
+    state['flag_format'] = values[8]
+    return state
+
+
+def _decode_challenge_v3(values):
+    state = _decode_challenge_v2(values[:6] + [[]] + values[7:])
+    for hint_level, level_hints in values[6]:
+        hints = list()
+        for id, text, cost, revealed in level_hints:
+            hint = Hint(text, hint_level, cost, id=id)
+            hint.revealed = revealed
+            hints.append(hint)
+        state['hints'][hint_level] = HintQueue(hints)
+    return state
+
+
+def _decode_challenge_v4(values):
+    state = _decode_challenge_v3(values)
+    state['machines'] = values[9]
+    return state
+
+
+def _decode_season_v1(values):
+    id, challenges = values
+    return {'id': id, 'challenges': {challenge_id: dict(scores) for challenge_id, scores in challenges}}
+# endregion decoding
+
+
+# region migrations
+def _profile_v1_to_v2(state):
+    state['tokens'] = dict()
+    for key in ('irc', 'api'):
+        value = state.pop(f'{key}_token', None)
+        if value:
+            token = Token(key)
+            token.token = value
+            state['tokens'][key] = token
+    return state
+
+
+def _profile_v2_to_v3(state):
+    state['users'] = UserTable.from_dict(state['users'])
+    return state
+
+
+def _challenge_v1_to_v2(state):
+    state['flag_format'] = None
+    return state
+
+
+def _challenge_v2_to_v3(state):
+    state['hints'] = build_hint_queues(state['hints'])
+    return state
+
+
+def _challenge_v3_to_v4(state):
+    state['machines'] = list()
+    return state
+# endregion migrations
+
+
+TYPES = {
+    TYPE_PROFILE: {
+        'class': Profile,
+        'version': PROFILE_VERSION,
+        'encode': _encode_profile,
+        'decoders': {2: _decode_profile_v2, 3: _decode_profile_v3},
+        'migrations': {1: _profile_v1_to_v2, 2: _profile_v2_to_v3},
+    },
+    TYPE_CHALLENGE: {
+        'class': Challenge,
+        'version': CHALLENGE_VERSION,
+        'encode': _encode_challenge,
+        'decoders': {1: _decode_challenge_v1, 2: _decode_challenge_v2, 3: _decode_challenge_v3,
+                     4: _decode_challenge_v4},
+        'migrations': {1: _challenge_v1_to_v2, 2: _challenge_v2_to_v3, 3: _challenge_v3_to_v4},
+    },
+    TYPE_SEASON: {
+        'class': SeasonIndex,
+        'version': SEASON_VERSION,
+        'encode': _encode_season,
+        'decoders': {1: _decode_season_v1},
+        'migrations': {},
+    },
+}
+
+
+def _get_type(obj):
+    for code, schema in TYPES.items():
+        if isinstance(obj, schema['class']):
+            return code, schema
+    raise TypeError
+
+
+def _migrate(schema, version, state):
+    """
+    Bring the attributes of an object stored with an older schema up to the current version
+    """
+    while version < schema['version']:
+        try:
+            migration = schema['migrations'][version]
+        except KeyError:
+            raise SerializationError(f"No migration from {schema['class'].__name__} version {version}")
+        state = migration(state)
+        version += 1
+    obj = schema['class'].__new__(schema['class'])
+    if hasattr(obj, '__setstate__'):
+        obj.__setstate__(state)
+    else:
+        obj.__dict__.update(state)
+    return obj
+
+
+def _legacy_version(obj):
+    if isinstance(obj, Profile):
+        # Pickled profiles always kept the users inline
+        return 2 if 'tokens' in obj.__dict__ else 1
+    if isinstance(obj, Challenge):
+        return 2 if 'flag_format' in obj.__dict__ else 1
+    return TYPES[_get_type(obj)[0]]['version']
+
+
+def _pack(code, version, values, compress):
+    payload = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload, 1)
+        flags |= FLAG_COMPRESSED
+    return HEADER.pack(MAGIC, FORMAT_VERSION, flags, code, version) + payload
+
+
+def _unpack(data):
+    """
+    :return: Object type, schema version and the decoded payload
+    :rtype: tuple
+    """
+    try:
+        _, format_version, flags, code, version = HEADER.unpack_from(data)
+        payload = data[HEADER.size:]
+        if flags & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        values = json.loads(payload)
+    except (struct.error, zlib.error, ValueError) as e:
+        raise SerializationError(e)
+    if format_version > FORMAT_VERSION:
+        raise SerializationError("Stored with a newer version of the bot")
+    return code, version, values
+
+
+def dumps(obj, compress=False):
+    """
+    Serialize a profile, challenge or season
+
+    :param obj: Profile, Challenge or SeasonIndex object
+    :param compress: (optional) Compress the payload with zlib
+    :rtype: bytes
+    """
+    code, schema = _get_type(obj)
+    return _pack(code, schema['version'], schema['encode'](obj), compress)
+
+
+def loads(data):
+    """
+    Deserialize a profile, challenge or season, upgrading older schema versions
+    Raw pickles written by earlier versions of the bot are accepted and upgraded as well
+
+    :param data: Serialized object
+    :rtype: core.objects.Profile, core.objects.Challenge or core.objects.SeasonIndex
+    :raises SerializationError: The data is not a valid profile, challenge or season
+    """
+    if not data.startswith(MAGIC):
+        return load_legacy(data)
+    code, version, values = _unpack(data)
+    schema = TYPES.get(code)
+    if not schema:
+        raise SerializationError(f"Not a profile, challenge or season: {code}")
+    if version > schema['version']:
+        raise SerializationError("Stored with a newer version of the bot")
+    # Constructing many small objects triggers the garbage collector over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        obj = _migrate(schema, version, schema['decoders'][version](values))
+    finally:
+        if enabled:
+            gc.enable()
+    if version < schema['version']:
+        _mark_upgraded(obj)
+    return obj
+
+
+def _mark_upgraded(obj):
+    """
+    Keep an upgraded object dirty, so the next save writes it in the current format
+    """
+    if isinstance(obj, Tracked):
+        obj.touch()
+        obj._upgraded = True
+    return obj
+
+
+def load_legacy(data):
+    """
+    Upgrade a profile or challenge stored as a raw pickle
+    """
+    try:
+        obj = pickle.loads(data)
+        code, schema = _get_type(obj)
+    except (pickle.UnpicklingError, EOFError, AttributeError, TypeError) as e:
+        raise SerializationError(e)
+    version = _legacy_version(obj)
+    if version == schema['version']:
+        return _mark_upgraded(obj)
+    logger.info("Upgrading %s %s from version %s", schema['class'].__name__, obj.id, version)
+    return _mark_upgraded(_migrate(schema, version, dict(obj.__dict__)))
+
+
+def encode_tokens(tokens):
+    """
+    Encode the tokens of a profile as JSON compatible lists, for stores that keep them apart from the profile
+
+    :param tokens: key -> Token
+    :rtype: list
+    """
+    return [[key, _encode_token(token)] for key, token in tokens.items()]
+
+
+def decode_tokens(values):
+    """
+    :param values: Tokens encoded by encode_tokens
+    :return: key -> Token
+    :rtype: dict
+    """
+    return {key: _decode_token(token) for key, token in values}
+
+
+def dumps_users(users, compress=False):
+    """
+    Serialize a dict of users, such as a shard of a UserTable
+
+    :param users: username -> User
+    :param compress: (optional) Compress the payload with zlib
+    :rtype: bytes
+    """
+    return _pack(TYPE_USERS, USERS_VERSION, _encode_users(users), compress)
+
+
+def loads_users(data):
+    """
+    Deserialize a dict of users
+
+    :rtype: dict
+    :raises SerializationError: The data is not a users dict
+    """
+    code, version, values = _unpack(data)
+    if code != TYPE_USERS or version > USERS_VERSION:
+        raise SerializationError(f"Not a supported users dict: {code} version {version}")
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _decode_users(values)
+    finally:
+        if enabled:
+            gc.enable()
@@ -61,12 +61,38 @@ class AbstractStore:
         """
         Save the current challenge to disk
 
+        :param changes: (optional) Changes already popped from the challenge
         :return: Challenge saved successfully
         :rtype: Boolean
         :raise ChallengeNotFoundError: No selected challenge
         """
         raise NotImplementedError
 
+    def flush(self):
+        """
+        Write any saves that are still pending to storage
+        """
+        pass
+
+    def load_season(self, profile_id):
+        """
+        Load the season scores of a profile, across all of its challenges
+
+        :return: The season, empty if nothing has been captured yet
+        :rtype: core.objects.SeasonIndex
+        """
+        raise NotImplementedError
+
+    def save_season(self, season, changes=None):
+        """
+        Save the season scores of a profile
+
+        :param changes: (optional) Changes already popped from the season
+        :return: Season saved successfully
+        :rtype: Boolean
+        """
+        raise NotImplementedError
+
     def get_allowed_users(self):
         """
         Fetch the list of allowed users
@@ -125,6 +151,17 @@ class AbstractStore:
         """
         raise NotImplementedError
 
+    def read_interactions(self, username=None, start=None, end=None):
+        """
+        Stream the saved interactions, oldest first
+
+        :param username: (optional) Only interactions by this user
+        :param start: (optional) Only interactions at or after this unix timestamp
+        :param end: (optional) Only interactions before this unix timestamp
+        :rtype: generator of core.objects.Interaction
+        """
+        raise NotImplementedError
+
     def cheered(self, username, channel, amount, message):
         raise NotImplementedError
 
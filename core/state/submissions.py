@@ -0,0 +1,113 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from core import settings
+
+SUBMISSION_RATE = 0.2  # submissions per second
+SUBMISSION_BURST = 5
+REJECTED_CACHE_SIZE = 10000
+# Buckets are pruned once this many users have submitted, users with a full bucket lose nothing
+MAX_BUCKETS = 10000
+
+
+class SubmissionGuard:
+    def __init__(self):
+        """
+        Keep flag submissions from chat cheap under brute forcing
+        Every user has a token bucket of submissions, and recently rejected submissions are answered from a cache
+        """
+        self.rate = SUBMISSION_RATE
+        if hasattr(settings, 'FLAG_SUBMISSION_RATE') and settings.FLAG_SUBMISSION_RATE:
+            self.rate = settings.FLAG_SUBMISSION_RATE
+        self.burst = SUBMISSION_BURST
+        if hasattr(settings, 'FLAG_SUBMISSION_BURST') and settings.FLAG_SUBMISSION_BURST:
+            self.burst = settings.FLAG_SUBMISSION_BURST
+        self.cache_size = REJECTED_CACHE_SIZE
+        if hasattr(settings, 'FLAG_REJECTED_CACHE_SIZE') and settings.FLAG_REJECTED_CACHE_SIZE is not None:
+            self.cache_size = settings.FLAG_REJECTED_CACHE_SIZE
+        self.counters = {'accepted': 0, 'rejected': 0, 'throttled': 0, 'cached': 0}
+        # Username -> tokens left, time of the last update, user has been told to slow down
+        self._buckets = dict()
+        self._prune_at = MAX_BUCKETS
+        # (challenge id, submission hash) -> response, least recently used first
+        self._rejected = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        for username, (tokens, updated, _) in list(self._buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self._buckets[username]
+        # Users that keep submitting can not be pruned, wait for twice as many before trying again
+        self._prune_at = max(MAX_BUCKETS, 2 * len(self._buckets))
+
+    def take(self, username, now=None):
+        """
+        Take a submission from the bucket of a user
+
+        :return: Seconds until the user can submit again, 0 when the submission is allowed.
+                 None when the user has already been told to wait
+        :rtype: float
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            tokens, updated, warned = self._buckets.get(username, (self.burst, now, False))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[username] = (tokens - 1, now, False)
+                if len(self._buckets) > self._prune_at:
+                    self._prune(now)
+                return 0
+            self.counters['throttled'] += 1
+            self._buckets[username] = (tokens, now, True)
+            if warned:
+                return None
+            return (1 - tokens) / self.rate
+
+    def _key(self, challenge_id, text):
+        return challenge_id, hashlib.blake2b(text.strip().encode('utf-8'), digest_size=16).digest()
+
+    def get_rejected(self, challenge_id, text):
+        """
+        :return: The response a recent identical submission got, None if it has not been rejected recently
+        :rtype: tuple
+        """
+        key = self._key(challenge_id, text)
+        with self._lock:
+            response = self._rejected.get(key)
+            if response is not None:
+                self._rejected.move_to_end(key)
+                self.counters['cached'] += 1
+                self.counters['rejected'] += 1
+            return response
+
+    def add_result(self, challenge_id, text, response, accepted):
+        """
+        Count a validated submission, rejected submissions are remembered
+        """
+        with self._lock:
+            if accepted:
+                self.counters['accepted'] += 1
+                return
+            self.counters['rejected'] += 1
+            if self.cache_size:
+                self._rejected[self._key(challenge_id, text)] = response
+                if len(self._rejected) > self.cache_size:
+                    self._rejected.popitem(last=False)
+
+    def forget(self, challenge_id):
+        """
+        Drop the remembered submissions of a challenge, after its flags changed
+        """
+        with self._lock:
+            for key in [key for key in self._rejected if key[0] == challenge_id]:
+                del self._rejected[key]
+
+    def get_counters(self):
+        with self._lock:
+            return dict(self.counters)
@@ -0,0 +1,88 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import queue
+import logging
+import threading
+from core import settings
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 1000
+RETRIES = 3
+
+
+class StoreWriter:
+    """
+    Run the saves of a state store on a dedicated thread
+    Saves are queued and return immediately, flush() waits until they have been written
+    """
+    def __init__(self, store):
+        self.store = store
+        size = QUEUE_SIZE
+        if hasattr(settings, 'STATE_WRITER_QUEUE_SIZE') and settings.STATE_WRITER_QUEUE_SIZE:
+            size = settings.STATE_WRITER_QUEUE_SIZE
+        self._queue = queue.Queue(size)
+        self._thread = threading.Thread(target=self._run, name='store-writer', daemon=True)
+        self._thread.start()
+
+    def __str__(self):
+        return f"{self.pending()} pending saves"
+
+    def _put(self, method, *args, **kwargs):
+        try:
+            self._queue.put_nowait((method, args, kwargs))
+        except queue.Full:
+            logger.warning("Store writer queue is full, waiting for pending saves")
+            self._queue.put((method, args, kwargs))
+
+    def _run(self):
+        while True:
+            method, args, kwargs = self._queue.get()
+            try:
+                self._call(method, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    def _call(self, method, args, kwargs):
+        for _ in range(RETRIES):
+            try:
+                if method(*args, **kwargs) is False:
+                    logger.error("Store writer could not complete %s", method.__name__)
+                return
+            except RuntimeError:
+                # The object was modified while it was being serialized
+                logger.debug("Retrying %s", method.__name__)
+            except Exception as e:
+                logger.exception(e)
+                return
+        logger.error("Store writer gave up on %s", method.__name__)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def save_profile(self, profile):
+        self._put(self.store.save_profile, profile)
+
+    def save_challenge(self, challenge):
+        # Changes are popped here, so they are written in the order they were made
+        self._put(self.store.save_challenge, challenge, changes=challenge.pop_changes())
+
+    def save_season(self, season):
+        changes = season.pop_changes()
+        if changes:
+            self._put(self.store.save_season, season, changes=changes)
+
+    def update_user(self, user):
+        self._put(self.store.update_user, user)
+
+    def save_interaction(self, interaction):
+        self._put(self.store.save_interaction, interaction)
+
+    def flush(self):
+        """
+        Wait for all queued saves, and write anything the store still holds back
+        """
+        self._queue.join()
+        self.store.flush()
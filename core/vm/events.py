@@ -0,0 +1,121 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MACHINE_RUNNING = 5
+
+
+class MachineStateEvents:
+    def __init__(self, vbox=None):
+        """
+        Machine state changes reported by VirtualBox, handed to the callbacks subscribed to a machine
+
+        :param vbox: The VirtualBox object to register with, None to publish states by hand
+        """
+        self._callbacks = dict()
+        self._lock = threading.Lock()
+        self._registration = None
+        if vbox is not None:
+            self._registration = vbox.register_on_machine_state_changed(self._on_event)
+
+    def _on_event(self, event):
+        self.publish(event.machine_id, int(event.state))
+
+    def subscribe(self, machine_id, callback):
+        """
+        :param callback: Called with the new state of the machine
+        """
+        with self._lock:
+            self._callbacks.setdefault(machine_id, []).append(callback)
+
+    def unsubscribe(self, machine_id, callback):
+        with self._lock:
+            callbacks = self._callbacks.get(machine_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._callbacks.pop(machine_id, None)
+
+    def publish(self, machine_id, state):
+        with self._lock:
+            callbacks = list(self._callbacks.get(machine_id, []))
+        logger.debug("Machine %s changed state to %s", machine_id, state)
+        for callback in callbacks:
+            callback(state)
+
+    def close(self):
+        if self._registration is not None:
+            import virtualbox.events
+            virtualbox.events.unregister_callback(self._registration)
+            self._registration = None
+
+
+class FakeMachineStateEvents(MachineStateEvents):
+    def __init__(self):
+        """
+        Event source that does not need VirtualBox, machine states are changed with set_state()
+        The last state of every machine is kept, so tests can check what the subscribers were told
+        """
+        super().__init__()
+        self.states = dict()
+
+    def set_state(self, machine_id, state):
+        """
+        Change the state of a machine, as if VirtualBox had reported it
+        """
+        self.states[machine_id] = state
+        self.publish(machine_id, state)
+
+    def get_state(self, machine_id):
+        """
+        :return: The last state set for the machine, None when it was never set
+        :rtype: int
+        """
+        return self.states.get(machine_id)
+
+    def subscribers(self, machine_id):
+        """
+        :return: Number of callbacks subscribed to the machine
+        :rtype: int
+        """
+        with self._lock:
+            return len(self._callbacks.get(machine_id, []))
+
+
+_events = None
+_events_unavailable = False
+_events_lock = threading.Lock()
+
+
+def get_machine_events(vbox):
+    """
+    :return: The event source shared by all machines, None when VirtualBox can not deliver events
+    :rtype: MachineStateEvents
+    """
+    global _events, _events_unavailable
+    with _events_lock:
+        if _events is None and not _events_unavailable:
+            try:
+                _events = MachineStateEvents(vbox)
+            except Exception as e:
+                _events_unavailable = True
+                logger.warning("Machine state events are not available, polling the state instead: %s", e)
+        return _events
+
+
+def use_machine_events(events):
+    """
+    Replace the shared event source, such as with a FakeMachineStateEvents
+
+    :return: The event source that was used before
+    """
+    global _events, _events_unavailable
+    with _events_lock:
+        previous, _events = _events, events
+        _events_unavailable = False
+    return previous
@@ -0,0 +1,184 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import time
+import queue
+import logging
+import threading
+from core import settings
+from core.exceptions import InputQueueFullError
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+COALESCE_WINDOW = None  # ms
+
+JOB_CALL = 'call'
+JOB_TEXT = 'text'
+JOB_KEYS = 'keys'
+
+
+def _can_merge(first, second):
+    """
+    Text is merged with text and plain key presses with plain key presses, as long as they go to the same machine
+    Presses that hold modifier keys are always sent on their own
+    """
+    kind, box, payload, _ = first
+    if kind != second[0] or box is not second[1] or kind == JOB_CALL:
+        return False
+    return kind == JOB_TEXT or (not payload[1] and not second[2][1])
+
+
+def _merge(jobs):
+    kind, box, payload, _ = jobs[0]
+    if kind == JOB_TEXT:
+        return box.type, (''.join(job[2] for job in jobs),)
+    elif kind == JOB_KEYS:
+        return box.press, ([key for job in jobs for key in job[2][0]], payload[1])
+    return payload[0], payload[1]
+
+
+class InputWorker:
+    """
+    Deliver the keyboard input of a box on a dedicated thread
+    Input is queued and returns immediately, so chat never waits on the press delay.
+    Text and key presses that are waiting together are merged into one keyboard call
+    """
+    def __init__(self, name):
+        self.name = name
+        size = QUEUE_SIZE
+        if hasattr(settings, 'INPUT_QUEUE_SIZE') and settings.INPUT_QUEUE_SIZE:
+            size = settings.INPUT_QUEUE_SIZE
+        self.window = COALESCE_WINDOW
+        if hasattr(settings, 'INPUT_COALESCE_WINDOW'):
+            self.window = settings.INPUT_COALESCE_WINDOW
+        self._queue = queue.Queue(size)
+        self._lock = threading.Lock()
+        self._delivered = threading.Condition(self._lock)
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name=f'input-{name}', daemon=True)
+        self._thread.start()
+
+    def __str__(self):
+        return f"{self.pending()} input jobs pending for {self.name}"
+
+    def _put(self, job):
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise InputQueueFullError
+            self.queued += 1
+            return self.queued
+
+    def put(self, method, *args):
+        """
+        Queue a call that sends input to the box, jobs are run in the order they were queued
+
+        :return: Number of the job, completed once self.completed reaches it
+        :rtype: int
+        :raises InputQueueFullError: Too many jobs are waiting
+        """
+        return self._put((JOB_CALL, None, (method, args), None))
+
+    def put_text(self, box, text, username=None):
+        """
+        Queue text to type on a machine, it can be merged with other text
+        """
+        return self._put((JOB_TEXT, box, text, username))
+
+    def put_keys(self, box, to_press, to_hold, username=None):
+        """
+        Queue keys to press on a machine, presses without modifiers can be merged
+        """
+        return self._put((JOB_KEYS, box, (to_press, to_hold), username))
+
+    def _collect(self, job):
+        """
+        Gather the jobs to deliver together with the first one
+
+        :return: Groups of jobs that are delivered in one call each, and whether the worker was stopped
+        :rtype: tuple
+        """
+        groups = [[job]]
+        if self.window is None:
+            return groups, False
+        deadline = time.monotonic() + self.window / 1000
+        while True:
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    job = self._queue.get(timeout=remaining)
+                else:
+                    job = self._queue.get_nowait()
+            except queue.Empty:
+                return groups, False
+            if job is None:
+                return groups, True
+            if _can_merge(groups[-1][-1], job):
+                groups[-1].append(job)
+            else:
+                groups.append([job])
+
+    def _deliver(self, jobs):
+        method, args = _merge(jobs)
+        try:
+            method(*args)
+        except Exception as e:
+            self.failed += len(jobs)
+            logger.exception(e)
+        with self._delivered:
+            self.completed += len(jobs)
+            self.batches += 1
+            self._delivered.notify_all()
+        users = [job[3] for job in jobs if job[3]]
+        if len(jobs) > 1:
+            logger.debug("Delivered %s input jobs to %s in one call, from %s", len(jobs), self.name, ', '.join(users))
+        elif users:
+            logger.debug("Delivered input to %s from %s", self.name, users[0])
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            groups, stopped = self._collect(job)
+            for jobs in groups:
+                self._deliver(jobs)
+            logger.debug("Input job %s completed for %s, %s pending", self.completed, self.name, self.pending())
+            if stopped:
+                return
+
+    def pending(self):
+        """
+        :return: Jobs that are queued or being delivered
+        :rtype: int
+        """
+        return self.queued - self.completed
+
+    def join(self):
+        """
+        Wait until all queued input has been delivered
+        """
+        with self._delivered:
+            self._delivered.wait_for(lambda: not self.pending() or not self._thread.is_alive())
+
+    def stop(self):
+        """
+        Drop the input that has not been delivered yet and stop the worker
+        """
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self.queued -= 1
+        self._queue.put(None)
+        self._thread.join()
+        with self._delivered:
+            self._delivered.notify_all()
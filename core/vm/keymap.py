@@ -0,0 +1,114 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+from functools import lru_cache
+from core import settings
+
+CACHE_SIZE = 1024
+SHIFT_MAKE = 0x2A
+SHIFT_BREAK = 0xAA
+
+# Set 1 scancodes of a US keyboard
+# Key name or unshifted character, shifted character, make code
+_KEYS = [('ESC', None, 0x01), ('1', '!', 0x02), ('2', '@', 0x03), ('3', '#', 0x04), ('4', '$', 0x05),
+         ('5', '%', 0x06), ('6', '^', 0x07), ('7', '&', 0x08), ('8', '*', 0x09), ('9', '(', 0x0A),
+         ('0', ')', 0x0B), ('-', '_', 0x0C), ('=', '+', 0x0D), ('BKSP', None, 0x0E), ('\x08', None, 0x0E),
+         ('TAB', None, 0x0F), ('\t', None, 0x0F)]
+_KEYS += [(char, char.upper(), code) for code, char in enumerate('qwertyuiop', 0x10)]
+_KEYS += [('[', '{', 0x1A), (']', '}', 0x1B), ('ENTER', None, 0x1C), ('\r', None, 0x1C), ('\n', None, 0x1C),
+          ('CTRL', None, 0x1D)]
+_KEYS += [(char, char.upper(), code) for code, char in enumerate('asdfghjkl', 0x1E)]
+_KEYS += [(';', ':', 0x27), ("'", '"', 0x28), ('`', '~', 0x29), ('LSHIFT', None, 0x2A), ('\\', '|', 0x2B)]
+_KEYS += [(char, char.upper(), code) for code, char in enumerate('zxcvbnm', 0x2C)]
+_KEYS += [(',', '<', 0x33), ('.', '>', 0x34), ('/', '?', 0x35), ('RSHIFT', None, 0x36), ('PRTSC', None, 0x37),
+          ('ALT', None, 0x38), ('SPACE', None, 0x39), (' ', None, 0x39), ('CAPS', None, 0x3A)]
+_KEYS += [(f'F{number}', None, code) for number, code in enumerate(range(0x3B, 0x45), 1)]
+_KEYS += [('NUM', None, 0x45), ('SCRL', None, 0x46), ('HOME', None, 0x47), ('UP', None, 0x48), ('PGUP', None, 0x49),
+          ('MINUS', None, 0x4A), ('LEFT', None, 0x4B), ('CENTER', None, 0x4C), ('RIGHT', None, 0x4D),
+          ('PLUS', None, 0x4E), ('END', None, 0x4F), ('DOWN', None, 0x50), ('PGDN', None, 0x51),
+          ('INS', None, 0x52), ('DEL', None, 0x53), ('F11', None, 0x57), ('F12', None, 0x58)]
+# Extended keys are sent with a 0xE0 prefix
+_EXTENDED_KEYS = [('E_DIV', 0x35), ('E_ENTER', 0x1C), ('E_INS', 0x52), ('E_DEL', 0x53), ('E_HOME', 0x47),
+                  ('E_END', 0x4F), ('E_PGUP', 0x49), ('E_PGDN', 0x51), ('E_LEFT', 0x4B), ('E_RIGHT', 0x4D),
+                  ('E_UP', 0x48), ('E_DOWN', 0x50), ('RALT', 0x38), ('RCTRL', 0x1D), ('LWIN', 0x5B), ('RWIN', 0x5C)]
+
+# Key name or character -> scancodes to press it, scancodes to release it
+SCANCODES = dict()
+for _key, _shifted, _code in _KEYS:
+    SCANCODES[_key] = ((_code,), (_code | 0x80,))
+    if _shifted:
+        SCANCODES[_shifted] = ((SHIFT_MAKE, _code), (_code | 0x80, SHIFT_BREAK))
+for _key, _code in _EXTENDED_KEYS:
+    SCANCODES[_key] = ((0xE0, _code), (0xE0, _code | 0x80))
+# Pause has no release codes
+SCANCODES['PAUSE'] = ((0xE1, 0x1D, 0x45, 0xE1, 0x9D, 0xC5), ())
+
+KEYBOARD_KEYS = list(SCANCODES)
+MODIFIERS = frozenset(['CTRL', 'SHIFT', 'LSHIFT', 'RSHIFT', 'ALT', 'RALT', 'RCTRL', 'LWIN', 'RWIN', 'WIN'])
+SPECIAL_KEYS = ' | '.join(key for key in KEYBOARD_KEYS if len(key) > 1)
+
+# Character -> scancodes of a full keystroke, characters missing from the table can not be typed
+KEYSTROKES = {key: make + release for key, (make, release) in SCANCODES.items() if len(key) == 1}
+
+
+def parse_keys(keys):
+    """
+    Sort key names from chat into keys to press and modifiers to hold, unknown keys are dropped
+
+    :return: Keys to press, and the modifier keys to hold while they are pressed
+    :rtype: tuple
+    """
+    to_press = []
+    to_hold = []
+    for key in keys:
+        if len(key) > 1:
+            key = key.upper()
+        if key in MODIFIERS:
+            if key in ('WIN', 'SHIFT'):
+                key = 'L' + key
+            if key not in to_hold:
+                to_hold.append(key)
+        elif key in SCANCODES:
+            to_press.append(key)
+    return to_press, to_hold
+
+
+class Keymap:
+    def __init__(self):
+        """
+        Compile text and key presses into scancode sequences
+        Every keystroke is a tuple of scancodes, so it can be written in one call and followed by the press delay.
+        Compiled sequences are cached, chat repeats the same commands a lot
+        """
+        size = CACHE_SIZE
+        if hasattr(settings, 'KEYMAP_CACHE_SIZE') and settings.KEYMAP_CACHE_SIZE is not None:
+            size = settings.KEYMAP_CACHE_SIZE
+        self.compile_text = lru_cache(maxsize=size)(self._compile_text)
+        self.compile_keys = lru_cache(maxsize=size)(self._compile_keys)
+
+    def _compile_text(self, text):
+        """
+        :return: Keystrokes typing the text, characters that can not be typed are left out
+        :rtype: tuple
+        """
+        get = KEYSTROKES.get
+        return tuple(stroke for stroke in map(get, text) if stroke)
+
+    def _compile_keys(self, to_press, to_hold):
+        """
+        :param to_press: Tuple of key names pressed one after another
+        :param to_hold: Tuple of modifier key names held down while the keys are pressed
+        :return: Keystrokes pressing the keys
+        :rtype: tuple
+        """
+        strokes = [sum((SCANCODES[key][0] for key in to_hold), ())]
+        strokes += [SCANCODES[key][0] + SCANCODES[key][1] for key in to_press]
+        strokes.append(sum((SCANCODES[key][1] for key in reversed(to_hold)), ()))
+        return tuple(stroke for stroke in strokes if stroke)
+
+    def cache_info(self):
+        return self.compile_text.cache_info(), self.compile_keys.cache_info()
+
+
+keymap = Keymap()
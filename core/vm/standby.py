@@ -0,0 +1,203 @@
+# twitchhacks.online
+# "Twitch Hacks Online"
+# 2020 - Frank Godo
+
+import re
+import time
+import uuid
+import logging
+import threading
+from core.exceptions import BoxNotRunningError
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 30  # seconds
+
+
+class StandbyPool:
+    def __init__(self, source, make_box, size):
+        """
+        Booted linked clones of the current snapshot of a machine, ready to take over when the machine is restored
+        Clones are built, and replaced machines are shut down and deleted, on a background thread
+
+        :param source: VirtualBoxSrv of the machine the challenge is configured with
+        :param make_box: Creates a VirtualBoxSrv for a machine name
+        :param size: Number of clones to keep ready
+        """
+        self.source = source
+        self.make_box = make_box
+        self.size = size
+        self._ready = []
+        self._retired = []
+        self._clones = set()
+        # Bumped for every new snapshot of the source machine, clones built from an older one are never handed out
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f'standby-{source.machine.name}', daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def __str__(self):
+        return f"{len(self._ready)}/{self.size} standby clones of {self.source.machine.name}"
+
+    def ready(self):
+        with self._lock:
+            return len(self._ready)
+
+    def take(self):
+        """
+        :return: A running clone, None when no clone is ready yet
+        :rtype: VirtualBoxSrv
+        """
+        with self._lock:
+            box = self._ready.pop(0) if self._ready else None
+        self._wake.set()
+        return box
+
+    def retire(self, box):
+        """
+        Shut down a machine that has been replaced, clones are deleted as well
+        """
+        with self._lock:
+            self._retired.append(box)
+        self._wake.set()
+
+    def refresh(self):
+        """
+        Replace the ready clones, after a new snapshot has been taken of the source machine
+        """
+        with self._lock:
+            self._generation += 1
+            self._retired.extend(self._ready)
+            self._ready = []
+        self._wake.set()
+
+    def _build(self):
+        machine = self.source.machine
+        name = f"{machine.name}-standby-{uuid.uuid4().hex[:8]}"
+        logger.info("Building standby clone %s", name)
+        # A linked clone only stores the differences to the snapshot, so it is created in seconds
+        clone = machine.clone(snapshot_name_or_id=machine.current_snapshot.id, name=name)
+        self._clones.add(name)
+        box = None
+        try:
+            box = self.make_box(name)
+            box.launch()
+        except Exception:
+            if box is not None:
+                self._discard(box)
+            else:
+                self._remove_clone(clone)
+            raise
+        return box
+
+    def _remove_clone(self, machine):
+        try:
+            machine.remove(delete=True)
+            self._clones.discard(machine.name)
+            logger.info("Deleted standby clone %s", machine.name)
+        except Exception as e:
+            logger.exception(e)
+
+    def _remove_orphans(self):
+        """
+        Delete the clones left behind by a bot process that did not get to clean up
+        """
+        pattern = re.compile(re.escape(self.source.machine.name) + r'-standby-[0-9a-f]{8}')
+        for machine in self.source.vbox.machines:
+            if not pattern.fullmatch(machine.name):
+                continue
+            logger.info("Removing leftover standby clone %s", machine.name)
+            self._clones.add(machine.name)
+            try:
+                box = self.make_box(machine.name)
+                if box.is_running():
+                    box.attach()
+            except Exception as e:
+                logger.exception(e)
+                self._remove_clone(machine)
+                continue
+            self._discard(box)
+
+    def _discard(self, box):
+        try:
+            box.shut_down(False)
+        except BoxNotRunningError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+        name = box.machine.name
+        if name not in self._clones:
+            # The configured machine goes back to its snapshot, as it would have without a standby
+            try:
+                box.restore()
+            except Exception as e:
+                logger.exception(e)
+        box.unlock()
+        if name in self._clones:
+            self._remove_clone(box.machine)
+
+    def _discard_retired(self):
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for box in retired:
+            self._discard(box)
+
+    def _back_off(self):
+        """
+        Wait before building again after a build failed, machines that are retired in the meantime are still discarded
+        """
+        deadline = time.monotonic() + RETRY_DELAY
+        while not self._stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if self._wake.wait(remaining):
+                self._wake.clear()
+                self._discard_retired()
+
+    def _run(self):
+        try:
+            self._remove_orphans()
+        except Exception as e:
+            logger.exception(e)
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            self._discard_retired()
+            while not self._stopped and self.ready() < self.size:
+                # Replaced machines are shut down between builds, not after the pool is full again
+                self._discard_retired()
+                with self._lock:
+                    generation = self._generation
+                try:
+                    box = self._build()
+                except Exception as e:
+                    logger.exception(e)
+                    self._back_off()
+                    continue
+                with self._lock:
+                    current = generation == self._generation
+                    if current:
+                        self._ready.append(box)
+                if not current:
+                    logger.info("Standby clone %s was built from an old snapshot", box.machine.name)
+                    self._discard(box)
+                    continue
+                logger.info("%s", self)
+            if self._stopped:
+                return
+
+    def stop(self):
+        """
+        Stop building clones, and shut down and delete the clones that are not in use
+        """
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            boxes, self._ready, self._retired = self._ready + self._retired, [], []
+        for box in boxes:
+            self._discard(box)
@@ -4,51 +4,80 @@
 
 import time
 import logging
-import virtualbox
-from core.exceptions import BoxNotFoundError, BoxNotRunningError, BoxAlreadyRunningError
-from virtualbox.library import VBoxErrorObjectNotFound, OleErrorUnexpected
+import threading
+from core.vm.input import InputWorker
+from core.vm.events import get_machine_events, MACHINE_RUNNING
+from core.vm.standby import StandbyPool
+from core.vm.keymap import keymap, parse_keys, SPECIAL_KEYS
+from core.exceptions import BoxNotFoundError, BoxNotRunningError, BoxAlreadyRunningError, StandbyActiveError
 
 logger = logging.getLogger(__name__)
 
-KEYBOARD_KEYS = ['ESC', '1', '!', '2', '@', '3', '#', '4', '$', '5', '%', '6', '^', '7', '&', '8', '*',
-                 '9', '(', '0', ')', '-', '_', '=', '+', 'BKSP', '\x08', 'TAB', '\t', 'q', 'Q', 'w', 'W',
-                 'e', 'E', 'r', 'R', 't', 'T', 'y', 'Y', 'u', 'U', 'i', 'I', 'o', 'O', 'p', 'P', '[', '{',
-                 ']', '}', 'ENTER', '\r', '\n', 'CTRL', 'a', 'A', 's', 'S', 'd', 'D', 'f', 'F', 'g', 'G',
-                 'h', 'H', 'j', 'J', 'k', 'K', 'l', 'L', ';', ':', "'", '"', '`', '~', 'LSHIFT', '\\', '|',
-                 'z', 'Z', 'x', 'X', 'c', 'C', 'v', 'V', 'b', 'B', 'n', 'N', 'm', 'M', ',', '<', '.', '>',
-                 '/', '?', 'RSHIFT', 'PRTSC', 'ALT', 'SPACE', ' ', 'CAPS', 'F1', 'F2', 'F3', 'F4', 'F5',
-                 'F6', 'F7', 'F8', 'F9', 'F10', 'F11', 'F12', 'NUM', 'SCRL', 'HOME', 'UP', 'PGUP', 'MINUS',
-                 'LEFT', 'CENTER', 'RIGHT', 'PLUS', 'END', 'DOWN', 'PGDN', 'INS', 'DEL', 'E_DIV', 'E_ENTER',
-                 'E_INS', 'E_DEL', 'E_HOME', 'E_END', 'E_PGUP', 'E_PGDN', 'E_LEFT', 'E_RIGHT', 'E_UP',
-                 'E_DOWN', 'RALT', 'RCTRL', 'LWIN', 'RWIN', 'PAUSE']
-MODIFIERS = ['CTRL', 'SHIFT', 'LSHIFT', 'RSHIFT', 'ALT', 'RALT', 'RCTRL', 'LWIN', 'RWIN', 'WIN']
+
+def _library():
+    """
+    The VirtualBox SDK is imported when it is first needed, so machines can be tested without it
+
+    :return: The virtualbox.library module
+    """
+    import virtualbox.library
+    return virtualbox.library
+
+
+def wait_for(*progresses):
+    """
+    Wait for VirtualBox operations that are running at the same time, this takes as long as the slowest one
+
+    :param progresses: Progress objects, None for operations that did not have to be started
+    """
+    for progress in progresses:
+        if progress is not None:
+            progress.wait_for_completion()
 
 
 class VirtualBoxSrv():
-    def __init__(self, name, delay):
+    def __init__(self, name, delay, vbox=None, session=None):
+        """
+        :param name: VirtualBox machine name
+        :param delay: Default delay between key presses in ms
+        :param vbox: (optional) VirtualBox object to find the machine with, such as a fake one in tests
+        :param session: (optional) Session to control the machine with
+        :raises BoxNotFoundError: The machine does not exist
+        """
         self.default_delay = delay
         self.delay = None
         self.expiration_time = None
-        self.vbox = virtualbox.VirtualBox()
-        self.session = virtualbox.Session()
+        if vbox is None or session is None:
+            import virtualbox
+            if vbox is None:
+                vbox = virtualbox.VirtualBox()
+            if session is None:
+                session = virtualbox.Session()
+        self.vbox = vbox
+        self.session = session
         try:
             self.machine = self.vbox.find_machine(name)
-        except VBoxErrorObjectNotFound:
+        except _library().VBoxErrorObjectNotFound:
             self.machine = None
             raise BoxNotFoundError
+        # The state is kept up to date by events, so input does not have to ask VirtualBox whether the box runs.
+        # It is read after subscribing, a change between the read and the subscription would be missed otherwise
+        self.machine_id = self.machine.id
+        self.state = None
+        self._state_lock = threading.Lock()
+        self._state_events = 0
+        self.events = get_machine_events(self.vbox)
+        if self.events:
+            self.events.subscribe(self.machine_id, self._on_state_changed)
+        self.refresh_state()
 
     def __str__(self):
         if self.machine:
             return f"{self.machine.name} on VirtualBox"
         return "VirtualBox machine not initialized"
 
-    def _sanitize_text(self, text):
-        text = text.replace('€', '')
-        text = text.replace('¡', '')
-        return text
-
     def get_special_keys(self):
-        return ' | '.join([x for x in KEYBOARD_KEYS if len(x) > 1])
+        return SPECIAL_KEYS
 
     def set_delay(self, delay, expiration=None):
         self.expiration_time = None
@@ -67,10 +96,30 @@ class VirtualBoxSrv():
         logger.debug("Returning default delay %s", self.default_delay)
         return self.default_delay
 
+    def _on_state_changed(self, state):
+        with self._state_lock:
+            self._state_events += 1
+            self.state = state
+
+    def refresh_state(self):
+        """
+        Read the state from VirtualBox, after an operation that changed it has completed
+        """
+        if self.machine is None:
+            return
+        seen = self._state_events
+        state = int(self.machine.state)
+        with self._state_lock:
+            # An event that arrived during the read is newer than the state that was read
+            if seen == self._state_events:
+                self.state = state
+
     def is_running(self):
         if self.machine is None:
             return False
-        return int(self.machine.state) == 5
+        if not self.events:
+            self.refresh_state()
+        return self.state == MACHINE_RUNNING
 
     def cleanup(self):
         if self.session is None:
@@ -79,74 +128,290 @@ class VirtualBoxSrv():
             self.shut_down(True)
         except BoxNotRunningError:
             pass
+        self.unlock()
+
+    def attach(self):
+        """
+        Take control of a machine that is already running, such as one left behind by an earlier bot process
+        """
+        self.machine.lock_machine(self.session, _library().LockType.shared)
+
+    def unlock(self):
+        if self.events:
+            self.events.unsubscribe(self.machine_id, self._on_state_changed)
         try:
             self.session.unlock_machine()
-        except OleErrorUnexpected:
+        except _library().OleErrorUnexpected:
             pass
 
-    def launch(self):
+    # region operations
+    # The begin_ methods start an operation and return its progress without waiting for it,
+    # so the machines of a challenge can be handled at the same time
+    def begin_launch(self):
         if self.is_running():
             raise BoxAlreadyRunningError
-        if not self.is_running() and self.machine:
-            progress = self.machine.launch_vm_process(self.session, "gui", "")
-            progress.wait_for_completion()
+        if self.machine:
+            return self.machine.launch_vm_process(self.session, "gui", "")
+        return None
 
-    def restore(self):
+    def begin_restore(self):
         snapshot = self.session.machine.current_snapshot
-        progress = self.session.machine.restore_snapshot(snapshot)
-        progress.wait_for_completion()
+        return self.session.machine.restore_snapshot(snapshot)
 
-    def shut_down(self, save, restore=False):
+    def begin_shut_down(self, save):
         if not self.is_running():
             raise BoxNotRunningError
         if save:
-            progress = self.session.machine.save_state()
-        else:
-            progress = self.session.console.power_down()
-        progress.wait_for_completion()
+            return self.session.machine.save_state()
+        return self.session.console.power_down()
+
+    def begin_snapshot(self, username):
+        progress, _ = self.session.machine.take_snapshot(f"{int(time.time())}", f"Taken by {username}", True)
+        return progress
+
+    def launch(self):
+        wait_for(self.begin_launch())
+        self.refresh_state()
+
+    def restore(self):
+        wait_for(self.begin_restore())
+        self.refresh_state()
+
+    def shut_down(self, save, restore=False):
+        wait_for(self.begin_shut_down(save))
+        self.refresh_state()
         if restore:
             self.restore()
 
     def snapshot(self, username):
-        progress, _ = self.session.machine.take_snapshot(f"{int(time.time())}", f"Taken by {username}", True)
-        progress.wait_for_completion()
+        wait_for(self.begin_snapshot(username))
+        self.refresh_state()
+    # endregion operations
+
+    def put_scancodes(self, strokes):
+        """
+        Write compiled keystrokes, each one in a single write followed by the press delay
+        Without a press delay all of them are written at once
+        """
+        keyboard = self.session.console.keyboard
+        delay = self.get_delay()
+        if not delay:
+            codes = [code for stroke in strokes for code in stroke]
+            if codes:
+                keyboard.put_scancodes(codes)
+            return
+        delay = delay / 1000
+        for stroke in strokes:
+            keyboard.put_scancodes(list(stroke))
+            time.sleep(delay)
 
     def type(self, text):
         if not self.is_running():
             raise BoxNotRunningError
         if type(text) is not str:
             raise TypeError
-        text = self._sanitize_text(text)
         logger.debug("Typing '%s'", text)
         try:
-            self.session.console.keyboard.put_keys(text, press_delay=self.get_delay())
+            self.put_scancodes(keymap.compile_text(text))
         except Exception as e:
             logger.exception(e)
 
-    def send(self, keys):
+    def parse_keys(self, keys):
+        return parse_keys(keys)
+
+    def press(self, to_press, to_hold):
         if not self.is_running():
             raise BoxNotRunningError
-        to_press = []
-        to_hold = set()
-        for key in keys:
-            if len(key) > 1:
-                key = key.upper()
-            if key in MODIFIERS:
-                if key in ['WIN', 'SHIFT']:
-                    key = 'L' + key
-                to_hold.add(key)
-            elif key in KEYBOARD_KEYS:
-                to_press.append(key)
-            else:
-                pass
+        self.put_scancodes(keymap.compile_keys(tuple(to_press), tuple(to_hold)))
+        logger.debug("Holding keys %s while pressing %s", to_hold, to_press)
+
+    def send(self, keys):
+        to_press, to_hold = self.parse_keys(keys)
         if not to_press and not to_hold:
             logger.debug("No keys to press")
             return []
-        self.session.console.keyboard.put_keys(press_keys=to_press, hold_keys=list(to_hold))
-        logger.debug("Holding keys %s while pressing %s", to_hold, to_press)
-        return list(to_hold) + to_press
+        self.press(to_press, to_hold)
+        return to_hold + to_press
 
     def release(self):
         if not self.is_running():
             raise BoxNotRunningError
         self.session.console.keyboard.release_keys()
+
+
+class VirtualBoxGroup():
+    def __init__(self, names, delay, standby=0, make_box=None):
+        """
+        The machines of a challenge, such as an attacker box and its targets
+        They are launched, saved, snapshotted and restored together, keyboard input goes to the selected machine
+
+        :param names: VirtualBox machine names, the first one is selected
+        :param delay: Default delay between key presses in ms
+        :param standby: (optional) Booted clones to keep ready for every machine, so restores do not wait for a boot
+        :param make_box: (optional) Creates the VirtualBoxSrv for a machine name, such as one with a fake VirtualBox
+        :raises BoxNotFoundError: One of the machines does not exist
+        """
+        if make_box is None:
+            def make_box(name):
+                return VirtualBoxSrv(name, delay)
+        self.boxes = dict()
+        try:
+            for name in names:
+                self.boxes[name] = make_box(name)
+        except Exception:
+            # The machines found so far would stay subscribed to the state events and locked
+            for box in self.boxes.values():
+                box.unlock()
+            raise
+        self.selected = names[0]
+        self.input = InputWorker(names[0])
+        self.pools = dict()
+        if standby:
+            for name, box in self.boxes.items():
+                self.pools[name] = StandbyPool(box, make_box, standby)
+
+    def __str__(self):
+        if len(self.boxes) == 1:
+            return str(self.boxes[self.selected])
+        return f"{', '.join(self.boxes)} on VirtualBox"
+
+    def get_machines(self):
+        return list(self.boxes)
+
+    def select(self, name):
+        """
+        Send the keyboard input to another machine
+
+        :raises BoxNotFoundError: The machine is not part of the group
+        """
+        if name not in self.boxes:
+            raise BoxNotFoundError
+        self.selected = name
+        logger.info("Keyboard input now goes to %s", name)
+
+    def _get_selected(self):
+        return self.boxes[self.selected]
+
+    def get_special_keys(self):
+        return self._get_selected().get_special_keys()
+
+    def set_delay(self, delay, expiration=None):
+        for box in self.boxes.values():
+            box.set_delay(delay, expiration=expiration)
+
+    def get_delay(self):
+        return self._get_selected().get_delay()
+
+    def is_running(self):
+        return any(box.is_running() for box in self.boxes.values())
+
+    def cleanup(self):
+        self.input.stop()
+        # Clones are deleted, the configured machines keep the state they were in when they were replaced
+        for name, pool in self.pools.items():
+            if self.boxes[name] is not pool.source:
+                pool.retire(self.boxes[name])
+                self.boxes[name] = pool.source
+        try:
+            self.shut_down(True)
+        except BoxNotRunningError:
+            pass
+        for box in self.boxes.values():
+            if box.session is not None:
+                box.unlock()
+        for pool in self.pools.values():
+            pool.stop()
+
+    # region operations
+    def _refresh_state(self):
+        # The events of a finished operation may still be on their way
+        for box in self.boxes.values():
+            box.refresh_state()
+
+    def launch(self):
+        stopped = [box for box in self.boxes.values() if not box.is_running()]
+        if not stopped:
+            raise BoxAlreadyRunningError
+        wait_for(*[box.begin_launch() for box in stopped])
+        self._refresh_state()
+
+    def restore(self):
+        wait_for(*[box.begin_restore() for box in self.boxes.values()])
+        self._refresh_state()
+
+    def shut_down(self, save, restore=False):
+        running = [box for box in self.boxes.values() if box.is_running()]
+        if not running:
+            raise BoxNotRunningError
+        wait_for(*[box.begin_shut_down(save) for box in running])
+        self._refresh_state()
+        if restore:
+            self.restore()
+
+    def snapshot(self, username):
+        """
+        :raises StandbyActiveError: A standby clone has taken over, its snapshot would be deleted with it
+        """
+        if any(self.boxes[name] is not pool.source for name, pool in self.pools.items()):
+            raise StandbyActiveError
+        wait_for(*[box.begin_snapshot(username) for box in self.boxes.values()])
+        self._refresh_state()
+        for pool in self.pools.values():
+            pool.refresh()
+
+    def restore_from_standby(self):
+        """
+        Replace every machine with a booted clone of its snapshot, the replaced machines are shut down in the background
+        Configured machines are restored to their snapshot, clones are deleted. Input that is still queued is dropped
+
+        :return: A clone was ready for every machine
+        :rtype: bool
+        """
+        if not self.pools or not all(pool.ready() for pool in self.pools.values()):
+            return False
+        # Queued input holds on to the machines that are replaced, it is dropped instead of typed into them
+        self.input.stop()
+        self.input = InputWorker(self.input.name)
+        for name, pool in self.pools.items():
+            box = pool.take()
+            replaced = self.boxes[name]
+            box.delay, box.expiration_time = replaced.delay, replaced.expiration_time
+            self.boxes[name] = box
+            pool.retire(replaced)
+            logger.info("%s took over from %s", box, replaced)
+        return True
+    # endregion operations
+
+    # region input
+    # Input is queued on the input worker and delivered to the machine that was selected when it was queued
+    def _get_running(self):
+        box = self._get_selected()
+        if not box.is_running():
+            raise BoxNotRunningError
+        return box
+
+    def type(self, text, username=None):
+        box = self._get_running()
+        if type(text) is not str:
+            raise TypeError
+        self.input.put_text(box, text, username)
+
+    def send(self, keys, username=None):
+        box = self._get_running()
+        to_press, to_hold = box.parse_keys(keys)
+        if not to_press and not to_hold:
+            logger.debug("No keys to press")
+            return []
+        self.input.put_keys(box, to_press, to_hold, username)
+        return to_hold + to_press
+
+    def release(self):
+        self.input.put(self._get_running().release)
+
+    def get_input_pending(self):
+        """
+        :return: Input jobs that are queued or being delivered
+        :rtype: int
+        """
+        return self.input.pending()
+    # endregion input